@@ -0,0 +1,56 @@
+from pelicandb import Pelican,CODECS
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+"""
+Document codec benchmark: encode/decode of realistic documents and insert/read through a collection for every available codec
+(pickle and marshal are always available, msgspec and orjson if installed)
+
+"""
+
+COUNT = 50000
+
+def make_document(i):
+    return {"_id":str(i),
+            "name":"Goods "+str(i),
+            "barcode":str(4600000000000+i),
+            "price":round(random.uniform(1,1000),2),
+            "quantity":random.randint(0,500),
+            "active":i%7!=0,
+            "tags":random.sample(["fruit","vegetable","dairy","bakery","frozen","drinks"],3),
+            "supplier":{"name":"Supplier "+str(i%100),"inn":str(7700000000+i%100),"city":"Moscow"},
+            "lines":[{"sku":str(i)+"-"+str(n),"qty":n,"price":n*10.5} for n in range(5)],
+            "comment":"Lorem ipsum dolor sit amet "*3}
+
+documents = [make_document(i) for i in range(COUNT)]
+
+print(f'{"codec":10}{"size, MB":>10}{"encode, s":>12}{"decode, s":>12}{"insert, s":>12}{"load, s":>12}')
+
+for name,(encode,decode) in CODECS.items():
+    start = time.time()
+    encoded = [encode(document) for document in documents]
+    t_encode = time.time()-start
+
+    start = time.time()
+    for value in encoded:
+        decode(memoryview(value))
+    t_decode = time.time()-start
+
+    size = sum(len(value) for value in encoded)/1024/1024
+
+    path = tempfile.mkdtemp()
+    db = Pelican("benchmark_db",path=path,codec=name)
+    start = time.time()
+    db["goods"].insert([dict(document) for document in documents],NoIndex=True)
+    t_insert = time.time()-start
+
+    start = time.time()
+    result = Pelican("benchmark_db",path=path)["goods"].all()
+    t_load = time.time()-start
+    shutil.rmtree(path)
+
+    print(f'{name:10}{size:>10.1f}{t_encode:>12.3f}{t_decode:>12.3f}{t_insert:>12.3f}{t_load:>12.3f}')
@@ -4,6 +4,10 @@ from typing import List
 import os
 import uuid
 import pickle
+import marshal
+import zlib
+import lzma
+import bz2
 from pathlib import Path
 from filelock import Timeout, SoftFileLock
 import inspect
@@ -12,9 +16,33 @@ from types import TracebackType
 import hashlib
 import itertools
 #from msgspec.json import decode,encode
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 import re
 import time
 import gc
+import mmap
+import struct
+import functools
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import operator
+import collections
+import bisect
+import heapq
 
 
 
@@ -22,11 +50,65 @@ import gc
 LOCK_TIMEOUT = 90
 #B-tree branches sise for text search
 BRANCH_SIZE=10
+#length of the modification prefix in the header of the pointer file
+PREFIX_SIZE = 36
+#width of the data file append offset stored after the modification prefix
+OFFSET_SIZE = 16
+#size of the last-version journal (*.idl) after which it is checkpointed into the snapshot (*.id)
+IDX_CHECKPOINT_SIZE = 4*1024*1024
+#pointer file formats: text lines (*.ptr) or fixed-width binary records (*.ptb) with an ID string table (*.pts)
+POINTER_FORMATS = ["text","binary"]
+#binary pointer record: data offset, data length, version, offset and length of the ID in the string table
+POINTER_RECORD = struct.Struct("<QIIQH")
+#size of the header line (prefix, ":", offset, newline) which precedes binary pointer records
+HEADER_SIZE = PREFIX_SIZE+OFFSET_SIZE+2
+#binary pointer record of a compressed collection: the record above followed by the compression flag 
+#and the offset and length of the document in the decompressed record or block
+POINTER_RECORD_COMPRESSED = struct.Struct("<QIIQHBII")
+#compression methods of the data file and their pointer flags
+COMPRESSIONS = {"zlib":1,"lzma":2,"bz2":3}
+#compression modes: each document is compressed separately or documents written together are compressed in blocks
+COMPRESSION_MODES = ["record","block"]
+#pointer flag bit of a document stored in a compressed block
+COMPRESSION_BLOCK = 0x80
+#maximum size of the documents compressed into one block
+BLOCK_SIZE = 64*1024
+#number of decompressed blocks cached by a collection
+BLOCK_CACHE_SIZE = 32
+#number of pointers read and decoded at a time by a scan of a collection stored on disk (see find_iter)
+READ_CHUNK = 1000
+#options of a page of find results requested by feed (see page_options)
+PAGE_OPTIONS = {"sort","limit","skip","projection"}
+#initial number of rows of a columnar cache (see ColumnCache)
+COLUMN_CAPACITY = 1024
+#largest integer stored exactly in a float64 column
+EXACT_INTEGER = 2**53
+#size of the live documents copied by shrink at a time
+SHRINK_BATCH_SIZE = 4*1024*1024
+#record of the version clock (*.clk): time and the size of the data file written by that time
+CLOCK_RECORD = struct.Struct("<dQ")
+#minimal interval in seconds between records of the version clock
+CLOCK_INTERVAL = 1
+#number of compiled query plans kept in the cache
+QUERY_PLAN_CACHE_SIZE = 256
+#durability levels: writes go straight to the files, or through the write-ahead log synchronized with the disk 
+#at most every durability_interval seconds ("batch") or at every commit ("full")
+DURABILITY_LEVELS = ["none","batch","full"]
+#default interval in seconds between synchronizations of the write-ahead log with durability "batch"
+DURABILITY_INTERVAL = 0.05
+#header of a write-ahead log record: length and CRC32 of the pickled file writes
+WAL_RECORD = struct.Struct("<II")
+#size of the write-ahead log after which it is checkpointed
+WAL_CHECKPOINT_SIZE = 16*1024*1024
 
 
 
 # Utilities
 
+#cache of compiled query plans (see query_plan)
+QUERY_PLANS = collections.OrderedDict()
+QUERY_PLAN_LOCK = threading.Lock()
+
 """
 General encoding and decoding functions. 
 If necessary, it can be replaced by msgspec.encode() and msgspec.from msgspec.json import decode,encode
@@ -48,6 +130,46 @@ def from_json_str(value):
      return json.loads(value)
 
 
+"""
+Document codecs: name -> (encode, decode). 
+encode returns the bytes of a document, decode takes a bytes-like object (a slice of the memory-mapped data file) and returns the document.
+The codec is chosen when a collection is created and recorded in admin.db, collections without a record are pickled.
+msgspec (MessagePack) and orjson are registered if installed, marshal and the JSON codecs support only built-in types
+"""
+CODECS = {}
+
+def register_codec(name,encode,decode):
+    CODECS[name] = (encode,decode)
+
+register_codec("pickle",functools.partial(pickle.dumps,protocol=pickle.HIGHEST_PROTOCOL),pickle.loads)
+register_codec("marshal",marshal.dumps,marshal.loads)
+if msgspec!=None:
+    register_codec("msgspec",msgspec.msgpack.encode,msgspec.msgpack.decode)
+if orjson!=None:
+    register_codec("orjson",orjson.dumps,orjson.loads)
+
+def get_codec(name):
+    if not name in CODECS:
+        raise ValueError(f'Unknown or unavailable codec {name}')
+    return CODECS[name]
+
+#compress and decompress functions by pointer flag
+COMPRESSORS = {1:(zlib.compress,zlib.decompress),2:(lzma.compress,lzma.decompress),3:(bz2.compress,bz2.decompress)}
+
+"""
+Checks the compression setting of a collection
+
+:compression: None or {"method": "zlib"|"lzma"|"bz2", "mode": "record"|"block"}
+
+"""
+def check_compression(compression):
+    if compression!=None:
+        if not compression.get("method") in COMPRESSIONS:
+            raise ValueError(f'Unknown compression method {compression.get("method")}')
+        if not compression.get("mode") in COMPRESSION_MODES:
+            raise ValueError(f'Unknown compression mode {compression.get("mode")}')
+
+
 
 """
 condition check function
@@ -61,130 +183,628 @@ Syntax replicates MongoDB query syntas
 
 """
 def check_condition(condition, document):
+    return query_plan(condition)(document)
+
+#a document field that is absent
+MISSING = object()
+
+#comparison operators of conditions
+COMPARISONS = {"$eq":operator.eq,"$ne":operator.ne,"$gt":operator.gt,"$gte":operator.ge,"$lt":operator.lt,"$lte":operator.le}
+
+"""
+Compiles a query condition into a function of a document (query plan).
+Fields are read with one dict lookup, regular expressions are compiled once, $and/$or stop at the first deciding element.
+All fields of a condition and all operators of a field must be met; a condition on an absent field is not met (except $not)
+
+:condition: query condition (see check_condition)
+
+:returns: function returning True if the condition is met to the document
+
+"""
+def compile_condition(condition):
     if isinstance(condition,Dict):
-        for key,value in condition.items(): #logical expression AND and OR
+        predicates = []
+        for key,value in condition.items():
             if isinstance(value,List):
                 if key=="$and":
-                    res = None
-                    for element in value:
-                        if res==None:
-                            res = check_condition(element, document)
-                        else:    
-                            res=res and check_condition(element, document)
-                    return res 
+                    predicates.append(compile_all([compile_condition(element) for element in value]))
                 elif key=="$or":
-                    res = None
-                    for element in value:
-                        if res==None:
-                            res = check_condition(element, document)
-                        else:    
-                            res=res or check_condition(element, document)
-                    return res  
-                
-            else:    
-                if isinstance(value,Dict): #comparison operators
-                    
-                    if '$regex' in value: #regular expression matching
-                        for key_document,value_document in document.items():
-                            if key==key_document and isinstance(value_document,str):
-                                pattern = re.compile(value['$regex'])
-                            
-                                if pattern.search(value_document):
-                                    return True
-                                else:
-                                    return False
-                    elif '$ne' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                        
-                                if value['$ne']!=value_document:
-                                    return True
-                                else:
-                                    return False
-                    elif '$not' in value:
-                         return not check_condition({key:value["$not"]}, document)           
-                    elif '$in' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                                if value_document in value['$in']:
-                                    return True
-                                else:
-                                    return False 
-                    elif '$nin' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                                if not value_document in value['$in']:
-                                    return True
-                                else:
-                                    return False                        
-                    elif '$eq' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                        
-                                if value['$eq']==value_document:
-                                    return True
-                                else:
-                                    return False 
-                    elif '$gt' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                        
-                                if value_document>value['$gt']:
-                                    return True
-                                else:
-                                    return False
-                    elif '$gte' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                        
-                                if value_document>=value['$gte']:
-                                    return True
-                                else:
-                                    return False   
-                    elif '$lt' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                        
-                                if value_document<value['$lt']:
-                                    return True
-                                else:
-                                    return False
-                    elif '$lte' in value:
-                        for key_document,value_document in document.items():
-                            if key==key_document:
-                        
-                                if value_document<=value['$lte']:
-                                    return True
-                                else:
-                                    return False
-                                                                                        
-                else:   #simple condition (pattern search)
-                    for key_document,value_document in document.items():
-                        if key==key_document:
-                            if value==value_document:
-                                return True
-                            else:
-                                return False
+                    predicates.append(compile_any([compile_condition(element) for element in value]))
+            elif isinstance(value,Dict): #comparison operators
+                predicates.extend(compile_operators(key,value))
+            else: #simple condition (pattern search)
+                predicates.append(compile_comparison(key,operator.eq,value))
+        if len(predicates)==1:
+            return predicates[0]
+        return compile_all(predicates)
     elif isinstance(condition,List):
         f = condition[0]
-        #res = getattr(f,document)(*condition[1:])
-        res = f(document,*condition[1:])
-        return res
+        args = condition[1:]
+        return lambda document: f(document,*args)
+
+    return lambda document: False
+
+def compile_operators(key,value):
+    predicates = []
+    for name,operand in value.items():
+        if name in COMPARISONS:
+            predicates.append(compile_comparison(key,COMPARISONS[name],operand))
+        elif name=="$regex": #regular expression matching
+            predicates.append(compile_regex(key,operand))
+        elif name=="$in":
+            predicates.append(compile_membership(key,operand,True))
+        elif name=="$nin":
+            predicates.append(compile_membership(key,operand,False))
+        elif name=="$not":
+            inner = compile_condition({key:operand})
+            predicates.append(lambda document: not inner(document))
+    return predicates
+
+def compile_comparison(key,compare,operand):
+    def match(document):
+        value = document.get(key,MISSING)
+        return value is not MISSING and compare(value,operand)
+    return match
+
+def compile_regex(key,pattern):
+    search = re.compile(pattern).search
+    def match(document):
+        value = document.get(key)
+        return isinstance(value,str) and search(value)!=None
+    return match
+
+def compile_membership(key,values,inside):
+    items = values
+    if isinstance(values,(list,tuple,set)):
+        try:
+            values = frozenset(values)
+        except TypeError: #unhashable operands are compared one by one
+            pass
+    def match(document):
+        value = document.get(key,MISSING)
+        if value is MISSING:
+            return False
+        try:
+            return (value in values)==inside
+        except TypeError: #unhashable value
+            return (value in items)==inside
+    return match
+
+def compile_all(predicates):
+    if len(predicates)==0:
+        return lambda document: False
+    def match(document):
+        for predicate in predicates:
+            if not predicate(document):
+                return False
+        return True
+    return match
+
+def compile_any(predicates):
+    def match(document):
+        for predicate in predicates:
+            if predicate(document):
+                return True
+        return False
+    return match
+
+"""
+Values of an equality or $in predicate that can be looked up in a hash index (only strings are indexed)
+
+:value: condition of a field
+
+:returns: list of values or None if the predicate can't use a hash index
+
+"""
+def indexable_values(value):
+    if isinstance(value,str):
+        return [value]
+    if isinstance(value,dict):
+        if isinstance(value.get("$eq"),str):
+            return [value["$eq"]]
+        values = value.get("$in")
+        if isinstance(values,(list,tuple,set)) and all(isinstance(element,str) for element in values):
+            return list(values)
+    return None
+
+"""
+Position of a value in a sorted index: numbers (and booleans) are ordered before strings, 
+other values (None, NaN, lists, dictionaries) are not indexed
+
+:value: value of the indexed field
+
+:returns: tuple (rank, value) or None
+
+"""
+def sort_key(value):
+    if isinstance(value,(int,float)):
+        if value!=value: #NaN
+            return None
+        return (0,value)
+    if isinstance(value,str):
+        return (1,value)
+    return None
+
+"""
+Bounds of an equality or range predicate ($eq, $gt, $gte, $lt, $lte) that can be served by a sorted index.
+All operands must be of the same rank (numbers or strings), other operators are checked on the found documents
+
+:value: condition of a field
+
+:returns: tuple (low, low inclusive, high, high inclusive) of sort keys (None is an open bound) or None
+
+"""
+def range_bounds(value):
+    if not isinstance(value,dict):
+        key = sort_key(value)
+        if key==None:
+            return None
+        return (key,True,key,True)
+
+    low = high = None
+    low_inclusive = high_inclusive = True
+    rank = None
+    for name,operand in value.items():
+        if not name in ("$eq","$gt","$gte","$lt","$lte"):
+            continue
+        key = sort_key(operand)
+        if key==None or (rank!=None and key[0]!=rank):
+            return None
+        rank = key[0]
+        if name in ("$eq","$gt","$gte"):
+            inclusive = name!="$gt"
+            if low==None or key>low or (key==low and not inclusive):
+                low,low_inclusive = key,inclusive
+        if name in ("$eq","$lt","$lte"):
+            inclusive = name!="$lt"
+            if high==None or key<high or (key==high and not inclusive):
+                high,high_inclusive = key,inclusive
+    if rank==None:
+        return None
+    return (low,low_inclusive,high,high_inclusive)
+
+"""
+Sort order of find(sort=...) as a list of (field, direction), direction is 1 (ascending) or -1 (descending)
+
+:sort: field, list of fields or of (field, direction), or dictionary {field: direction}
+
+"""
+def sort_fields(sort):
+    if isinstance(sort,str):
+        sort = [sort]
+    elif isinstance(sort,dict):
+        sort = list(sort.items())
+    fields = []
+    for element in sort:
+        if isinstance(element,str):
+            element = (element,1)
+        if not isinstance(element,(list,tuple)) or len(element)!=2 or not element[1] in (1,-1):
+            raise ValueError(f'Sort order should be a list of (field, 1 or -1): {sort}')
+        fields.append((element[0],element[1]))
+    if len(fields)==0:
+        raise ValueError(f'Sort order is empty')
+    return fields
+
+"""
+Sort key of a document for find(sort=...): documents are compared field by field in the direction of each field.
+Values are ordered as in sorted indexes (see sort_key), documents without a sortable value of a field are placed last
+"""
+class DocumentOrder:
+    __slots__ = ("fields","keys")
+
+    def __init__(self,document,fields):
+        self.fields = fields
+        self.keys = [sort_key(document.get(field)) for field,direction in fields]
+
+    def __lt__(self,other):
+        for (field,direction),a,b in zip(self.fields,self.keys,other.keys):
+            if a==b:
+                continue
+            if a==None:
+                return False
+            if b==None:
+                return True
+            return a<b if direction>0 else b<a
+        return False
+
+"""
+Projection of a document: the listed fields and _id.
+Syntax replicates MongoDB projection: a list of fields, {field: 1} to include fields or {field: 0} to exclude them
+
+:document: document
+:projection: list of fields, dictionary or None (the whole document)
+
+:returns: document or a new dictionary with the projected fields (values are not copied)
+
+"""
+def project(document,projection):
+    if projection==None:
+        return document
+    fields = projection
+    if isinstance(projection,dict):
+        fields = [key for key,value in projection.items() if value]
+        if len(fields)==0 or (fields==["_id"] and len(projection)>1): #exclusion
+            return {key:value for key,value in document.items() if not key in projection or projection[key]}
+    result = {}
+    if "_id" in document and not (isinstance(projection,dict) and projection.get("_id",1)==0):
+        result["_id"] = document["_id"]
+    for key in fields:
+        if key in document:
+            result[key] = document[key]
+    return result
+
+#accumulators of the $group stage of an aggregation pipeline
+ACCUMULATORS = ["$sum","$avg","$count","$min","$max"]
+
+"""
+Compiles an expression of an aggregation pipeline into a function of a document:
+"$field" is the value of the field, a dictionary is evaluated element by element, other values are constants
+
+:expression: expression
+
+:returns: function of a document
+
+"""
+def compile_expression(expression):
+    if isinstance(expression,str) and expression.startswith("$"):
+        field = expression[1:]
+        return lambda document: document.get(field)
+    if isinstance(expression,dict):
+        elements = [(key,compile_expression(value)) for key,value in expression.items()]
+        return lambda document: {key:f(document) for key,f in elements}
+    return lambda document: expression
+
+"""
+Compiles the $group stage: documents are grouped by the _id expression (None - one group), 
+the other fields are accumulators {"$sum": expression}, {"$avg": expression}, {"$count": {}}, {"$min": expression}, {"$max": expression}.
+$sum and $avg take numbers only, $min and $max compare values as sorted indexes (see sort_key).
+Only the state of the accumulators is kept for every group
+
+:group: stage parameter
+
+:returns: function of an iterable of documents returning the list of groups
+
+"""
+def compile_group(group):
+    if not isinstance(group,dict) or not "_id" in group:
+        raise ValueError(f'$group should be a dictionary with _id: {group}')
+    key = compile_expression(group["_id"])
+    fields = []
+    for name,accumulator in group.items():
+        if name=="_id":
+            continue
+        if not isinstance(accumulator,dict) or len(accumulator)!=1 or not next(iter(accumulator)) in ACCUMULATORS:
+            raise ValueError(f'Unknown accumulator of {name}: {accumulator}')
+        kind,expression = next(iter(accumulator.items()))
+        fields.append((name,kind,compile_expression(expression)))
+
+    def run(documents):
+        groups = {}
+        for document in documents:
+            value = key(document)
+            group_key = condition_key(value)
+            state = groups.get(group_key)
+            if state==None:
+                state = groups[group_key] = [value]+[[0,0] if kind in ("$sum","$avg","$count") else None for name,kind,f in fields]
+            for i,(name,kind,f) in enumerate(fields,1):
+                if kind=="$count":
+                    state[i][1]+=1
+                    continue
+                element = f(document)
+                if kind=="$sum" or kind=="$avg":
+                    if isinstance(element,(int,float)) and not isinstance(element,bool):
+                        state[i][0]+=element
+                        state[i][1]+=1
+                else:
+                    element_key = sort_key(element)
+                    if element_key!=None and (state[i]==None or (element_key<state[i][0] if kind=="$min" else element_key>state[i][0])):
+                        state[i] = (element_key,element)
+
+        result = []
+        for state in groups.values():
+            document = {"_id":state[0]}
+            for i,(name,kind,f) in enumerate(fields,1):
+                if kind=="$sum":
+                    document[name] = state[i][0]
+                elif kind=="$count":
+                    document[name] = state[i][1]
+                elif kind=="$avg":
+                    document[name] = state[i][0]/state[i][1] if state[i][1]>0 else None
+                else:
+                    document[name] = None if state[i]==None else state[i][1]
+            result.append(document)
+        return result
+    return run
+
+"""
+Compiles a stage of an aggregation pipeline into a function of an iterable of documents returning an iterable.
+Stages: $match (query condition, see check_condition), $group (see compile_group), $count (field name), 
+$sort (see sort_fields), $skip, $limit, $project (see project)
+
+:stage: dictionary {stage name: parameter}
+
+"""
+def compile_stage(stage):
+    if not isinstance(stage,dict) or len(stage)!=1:
+        raise ValueError(f'Pipeline stage should be a dictionary with one key: {stage}')
+    name,parameter = next(iter(stage.items()))
+    if name=="$match":
+        match = query_plan(parameter)
+        return lambda documents: (document for document in documents if match(document))
+    if name=="$group":
+        return compile_group(parameter)
+    if name=="$count":
+        def count(documents):
+            n = sum(1 for document in documents)
+            return [{parameter:n}] if n>0 else [] #no documents, no result (like $group)
+        return count
+    if name=="$sort":
+        fields = sort_fields(parameter)
+        return lambda documents: sorted(documents,key=lambda document: DocumentOrder(document,fields))
+    if name=="$skip":
+        return lambda documents: itertools.islice(documents,parameter,None)
+    if name=="$limit":
+        return lambda documents: itertools.islice(documents,parameter)
+    if name=="$project":
+        return lambda documents: (project(document,parameter) for document in documents)
+    raise ValueError(f'Unknown pipeline stage {name}')
+
+"""
+Canonical form of a query condition, the key of the query plan cache. 
+Keys of dictionaries are sorted, values are tagged with their type (1, 1.0 and True are different conditions)
+"""
+def condition_key(condition):
+    if isinstance(condition,dict):
+        return (dict,)+tuple(sorted((key,condition_key(value)) for key,value in condition.items()))
+    if isinstance(condition,(list,tuple)):
+        return (list,)+tuple(condition_key(value) for value in condition)
+    return (type(condition),condition)
 
-    return False
+"""
+Compiled query plan of a condition from the LRU cache of plans (see compile_condition)
+
+:condition: query condition
+
+:returns: function of a document
+
+"""
+def query_plan(condition):
+    key = condition_key(condition)
+    with QUERY_PLAN_LOCK:
+        try:
+            plan = QUERY_PLANS.get(key)
+        except TypeError: #the condition has unhashable values, its plan isn't cached
+            return compile_condition(condition)
+        if plan!=None:
+            QUERY_PLANS.move_to_end(key)
+            return plan
+    plan = compile_condition(condition)
+    with QUERY_PLAN_LOCK:
+        QUERY_PLANS[key] = plan
+        if len(QUERY_PLANS)>QUERY_PLAN_CACHE_SIZE:
+            QUERY_PLANS.popitem(last=False)
+    return plan
 
 """
-Quickly writes the data modification prefix to the collection file
+Bytes of the data modification prefix written at the start of the collection file.
+The append offset is written only if the file header already has room for it (files created by earlier versions keep a bare prefix)
 
 :path: filename of collection
 :prefix: modification prefix
+:data_end: size of the data file (*.dat) after the write
+
+"""
+def prefix_bytes(path,prefix,data_end=None):
+    if data_end!=None:
+        with open(path,"rb") as f:
+            text =f.read(PREFIX_SIZE+OFFSET_SIZE+1)
+        if len(text)==PREFIX_SIZE+OFFSET_SIZE+1 and text[PREFIX_SIZE:PREFIX_SIZE+1]==b":":
+            return format_header(prefix,data_end).encode()
+    return prefix.encode()
+
+"""
+Writes file contents at the given offsets (applies the writes of a write-ahead log record)
+
+:writes: list of (path, offset, bytes)
+
+"""
+def apply_writes(writes):
+    files = {}
+    try:
+        for path,offset,content in writes:
+            f = files.get(path)
+            if f==None:
+                f = open(path,"r+b" if os.path.isfile(path) else "w+b")
+                files[path] = f
+            f.seek(offset)
+            f.write(content)
+    finally:
+        for f in files.values():
+            f.close()
+
+"""
+Reads the records of the write-ahead log. A record torn by a crash and everything after it are ignored
+
+:path: filename of the log
+
+:returns: list of records, each a list of (path relative to the database folder, offset, bytes)
+
+"""
+def read_wal(path):
+    records = []
+    if not os.path.isfile(path):
+        return records
+    with open(path,"rb") as f:
+        data = f.read()
+    position = 0
+    while position+WAL_RECORD.size<=len(data):
+        length,crc = WAL_RECORD.unpack_from(data,position)
+        record = data[position+WAL_RECORD.size:position+WAL_RECORD.size+length]
+        if len(record)<length or zlib.crc32(record)!=crc:
+            break
+        records.append(pickle.loads(record))
+        position+=WAL_RECORD.size+length
+    return records
+
+"""
+Flushes a file to the disk if it exists
+
+:path: filename
+
+"""
+def fsync_file(path):
+    try:
+        fd = os.open(path,os.O_RDWR)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+"""
+Header line of the pointer file: modification prefix and the append offset of the data file
+
+:prefix: modification prefix
+:data_end: size of the data file (*.dat)
+
+"""
+def format_header(prefix,data_end):
+    return prefix+":"+str(data_end).zfill(OFFSET_SIZE)
+
+"""
+Parses the header line of the pointer file
+
+:line: first line of the pointer file
+
+:returns: modification prefix and the append offset (None if the header has no offset)
+
+"""
+def parse_header(line):
+    line = line.rstrip()
+    uid = line[:PREFIX_SIZE]
+    data_end = None
+    if len(line)==PREFIX_SIZE+OFFSET_SIZE+1 and line[PREFIX_SIZE]==":":
+        try:
+            data_end = int(line[PREFIX_SIZE+1:])
+        except ValueError:
+            data_end = None
+    return uid,data_end
+
+"""
+Replays the last-version journal on top of the dictionary.
+Each record of the journal is a pickled list of (document ID, version) pairs, version None marks a deleted document.
+An incomplete record at the end (interrupted write) is ignored
+
+:path: filename of the journal
+:idx: last-version dictionary to be updated
+:start: offset of the first record to replay
+:changes: list to collect replayed pairs (optional)
+
+:returns: offset after the last complete record
+
+"""
+def replay_idx_journal(path,idx,start=0,changes=None):
+    consumed = start
+    with open(path,'rb') as f:
+        f.seek(start)
+        while True:
+            try:
+                records = pickle.load(f)
+            except (EOFError,pickle.UnpicklingError):
+                break
+            consumed = f.tell()
+            for doc_id,version in records:
+                if version==None:
+                    idx.pop(doc_id,None)
+                else:
+                    idx[doc_id] = version
+            if changes!=None:
+                changes.extend(records)
+    return consumed
+
+"""
+Builds a lookup of the time by which a document was written from the version clock
+
+:clock: list of (time, data file size) records sorted by size
+
+:returns: function of a pointer returning the time or None if the document was written after the last record
+
+"""
+def clock_lookup(clock):
+    ends = [end for t,end in clock]
+    times = [t for t,end in clock]
+    for i in range(len(times)-2,-1,-1):
+        times[i] = min(times[i],times[i+1])
+    
+    def lookup(value):
+        i = bisect.bisect_left(ends,value[1])
+        return times[i] if i<len(times) else None
+
+    return lookup
+
+"""
+Checks the retention policy of a collection
+
+:retention: None or {"keep_versions": number of the last versions kept, "keep_seconds": age in seconds of versions kept}
+
+"""
+def check_retention(retention):
+    if retention!=None:
+        keep_versions = retention.get("keep_versions")
+        keep_seconds = retention.get("keep_seconds")
+        if keep_versions!=None and (not isinstance(keep_versions,int) or keep_versions<1):
+            raise ValueError(f'keep_versions must be a positive integer: {keep_versions}')
+        if keep_seconds!=None and (not isinstance(keep_seconds,(int,float)) or keep_seconds<0):
+            raise ValueError(f'keep_seconds must be a non-negative number: {keep_seconds}')
 
 """
-def write_prefix(path,prefix):
-    with open(path,"r+", encoding='utf-8') as f:
-            text =f.read(36)
-            f.seek(0)
-            f.write(prefix)
+File identity used to notice that a file was replaced or rewritten
+
+:path: filename
+
+:returns: (inode, size, modification time) or None if there is no file
+
+"""
+def stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino,st.st_size,st.st_mtime_ns)
+
+"""
+Decorator of public collection operations.
+Modification by another process is checked once when the operation starts (a stat call),
+nested accesses to the collection data within the operation are not checked again
+"""
+def collection_operation(f):
+    @functools.wraps(f)
+    def wrapper(self,*args,**kwargs):
+        local = self._local
+        depth = getattr(local,"depth",0)
+        if depth==0:
+            self._data
+        local.depth = depth+1
+        try:
+            return f(self,*args,**kwargs)
+        finally:
+            local.depth = depth
+    return wrapper
+
+"""
+Decorator of collection queries. In a thread inside a snapshot of the database (see Pelican.snapshot)
+the query runs on the state of the collection pinned by the snapshot. 
+Queries made by other operations (updates, deletes) read the current state
+"""
+def snapshot_query(f):
+    @functools.wraps(f)
+    def wrapper(self,*args,**kwargs):
+        snapshot = getattr(self._db.__dict__['_snapshot_local'],"snapshot",None)
+        if snapshot!=None and self._snapshot==None and getattr(self._local,"depth",0)==0 and not self._is_index():
+            return f(snapshot._pin(self),*args,**kwargs)
+        return f(self,*args,**kwargs)
+    return wrapper
 
 """
 splits the dictionary into 2 dictionaries
@@ -199,6 +819,8 @@ def splitDict(d):
     return d1, d2
 
 def format_datastr(id,t):
+    if len(t)>4: #compressed document: flag, offset and end in the decompressed data
+        return '"{id}":[{begin},{end},{version},"{uid}",{flag},{inner_begin},{inner_end}]'.format(id = id, begin=t[0], end=t[1],version = t[2],uid=t[3],flag=t[4],inner_begin=t[5],inner_end=t[6])
     return '"{id}":[{begin},{end},{version},"{uid}"]'.format(id = id, begin=t[0], end=t[1],version = t[2],uid=t[3])
 
 """
@@ -322,6 +944,478 @@ def delete_in_branchces_dynamic_text_binary(base,value_id,value):
 
 
 
+"""
+Number that is compared exactly with the values of a float64 column
+"""
+def exact_number(value):
+    return isinstance(value,float) or (isinstance(value,int) and abs(value)<=EXACT_INTEGER)
+
+"""
+Columnar cache of numeric fields of a collection (see Collection.register_columns): 
+NumPy arrays of the values of the fields aligned with the list of document IDs.
+Numbers and booleans are stored as float64, other values are marked as not present; 
+a field holding an integer which is not exact in float64 is not used. 
+Rows of removed documents are marked dead, the arrays are compacted when half of the rows are dead.
+A row keeps the version of the document, so an older version never replaces a newer one
+"""
+class ColumnCache:
+    def __init__(self,fields):
+        self.fields = list(fields)
+        self.lock = threading.Lock()
+        self.ids = []
+        self.positions = {}
+        self.size = 0
+        self.dead = 0
+        self.alive = numpy.zeros(COLUMN_CAPACITY,dtype=bool)
+        self.versions = numpy.zeros(COLUMN_CAPACITY,dtype=numpy.int64)
+        self.values = {field:numpy.zeros(COLUMN_CAPACITY) for field in self.fields}
+        self.present = {field:numpy.zeros(COLUMN_CAPACITY,dtype=bool) for field in self.fields}
+        self.boolean = {field:numpy.zeros(COLUMN_CAPACITY,dtype=bool) for field in self.fields}
+        self.floating = {field:numpy.zeros(COLUMN_CAPACITY,dtype=bool) for field in self.fields}
+        self.textual = {field:numpy.zeros(COLUMN_CAPACITY,dtype=bool) for field in self.fields}
+        self.exact = {field:True for field in self.fields}
+
+    def _columns(self):
+        return [self.values,self.present,self.boolean,self.floating,self.textual]
+
+    def _resize(self,rows,capacity):
+        def resize(array):
+            result = numpy.zeros(capacity,dtype=array.dtype)
+            result[:len(rows)] = array[rows]
+            return result
+        self.alive = resize(self.alive)
+        self.versions = resize(self.versions)
+        for columns in self._columns():
+            for field in self.fields:
+                columns[field] = resize(columns[field])
+
+    def add(self,documents):
+        with self.lock:
+            for document in documents:
+                doc_id = document.get("_id")
+                if doc_id==None:
+                    continue
+                version = document.get("_version",0)
+                position = self.positions.get(doc_id)
+                if position==None:
+                    if self.size==len(self.alive):
+                        self._resize(numpy.arange(self.size),2*self.size)
+                    position = self.size
+                    self.size+=1
+                    self.ids.append(doc_id)
+                    self.positions[doc_id] = position
+                elif version<self.versions[position]:
+                    continue
+                self.alive[position] = True
+                self.versions[position] = version
+                for field in self.fields:
+                    value = document.get(field)
+                    numeric = isinstance(value,(int,float))
+                    self.present[field][position] = numeric
+                    self.textual[field][position] = isinstance(value,str)
+                    if numeric:
+                        self.values[field][position] = value
+                        self.boolean[field][position] = isinstance(value,bool)
+                        self.floating[field][position] = isinstance(value,float)
+                        if not exact_number(value):
+                            self.exact[field] = False
+
+    def remove(self,ids):
+        with self.lock:
+            for doc_id in ids:
+                position = self.positions.pop(doc_id,None)
+                if position!=None:
+                    self.alive[position] = False
+                    self.dead+=1
+            if self.dead>COLUMN_CAPACITY and 2*self.dead>self.size:
+                rows = numpy.flatnonzero(self.alive[:self.size])
+                self._resize(rows,max(COLUMN_CAPACITY,2*len(rows)))
+                self.ids = [self.ids[i] for i in rows]
+                self.positions = {doc_id:position for position,doc_id in enumerate(self.ids)}
+                self.size = len(self.ids)
+                self.dead = 0
+
+    """
+    Mask of the rows meeting the predicates of the condition on the cached fields: 
+    $eq, $gt, $gte, $lt, $lte and $in with numbers, the other predicates are not evaluated
+
+    :returns: tuple (mask, True if the whole condition is evaluated) or None if no predicate can be evaluated
+    """
+    def _mask(self,condition):
+        result = None
+        complete = True
+        for key,value in condition.items():
+            if not key in self.values or not self.exact[key]:
+                complete = False
+                continue
+            column = self.values[key][:self.size]
+            mask = self.present[key][:self.size]
+            used = False
+            for name,operand in (value.items() if isinstance(value,dict) else [("$eq",value)]):
+                if name in ("$eq","$gt","$gte","$lt","$lte") and exact_number(operand):
+                    mask = mask & COMPARISONS[name](column,operand)
+                    used = True
+                elif name=="$in" and isinstance(operand,(list,tuple,set)) and len(operand)>0 and all(exact_number(element) for element in operand):
+                    mask = mask & numpy.isin(column,list(operand))
+                    used = True
+                else:
+                    complete = False
+            if used:
+                result = mask if result is None else result & mask
+            else:
+                complete = False
+        if result is None:
+            return None
+        return result & self.alive[:self.size],complete
+
+    """
+    IDs of the documents which may meet the condition (see _mask) or None
+    """
+    def select(self,condition):
+        with self.lock:
+            selection = self._mask(condition)
+            if selection==None:
+                return None
+            ids = self.ids
+            return [ids[i] for i in numpy.flatnonzero(selection[0])]
+
+    """
+    Evaluates $group with _id None and the accumulators $count, $sum (of a cached field or an integer), 
+    $avg, $min and $max of cached fields on the rows meeting the condition
+
+    :condition: query condition of the $match stage or None
+    :group: parameter of the $group stage
+
+    :returns: list of the resulting documents or None if the stages can't be evaluated on the columns
+    """
+    def aggregate(self,condition,group):
+        if not isinstance(group,dict) or group.get("_id","") is not None:
+            return None
+        with self.lock:
+            if condition==None:
+                mask = self.alive[:self.size]
+            else:
+                selection = self._mask(condition) if isinstance(condition,dict) else None
+                if selection==None or not selection[1]:
+                    return None
+                mask = selection[0]
+            count = int(numpy.count_nonzero(mask))
+            if count==0:
+                return []
+
+            document = {"_id":None}
+            for name,accumulator in group.items():
+                if name=="_id":
+                    continue
+                if not isinstance(accumulator,dict) or len(accumulator)!=1:
+                    return None
+                operator,expression = next(iter(accumulator.items()))
+                if operator=="$count":
+                    document[name] = count
+                    continue
+                if operator=="$sum" and isinstance(expression,int) and not isinstance(expression,bool):
+                    document[name] = expression*count
+                    continue
+                if not operator in ("$sum","$avg","$min","$max") or not isinstance(expression,str) or not expression.startswith("$"):
+                    return None
+                field = expression[1:]
+                if not field in self.values or not self.exact[field]:
+                    return None
+                size = self.size
+                selected = mask & self.present[field][:size]
+                if numpy.any(selected & self.boolean[field][:size]):
+                    return None
+                if operator in ("$min","$max") and numpy.any(mask & self.textual[field][:size]):
+                    return None
+                values = self.values[field][:size][selected]
+                floating = numpy.any(self.floating[field][:size][selected])
+                if operator in ("$min","$max"):
+                    if len(values)==0:
+                        document[name] = None
+                        continue
+                    position = numpy.flatnonzero(selected)[values.argmin() if operator=="$min" else values.argmax()]
+                    value = self.values[field][position]
+                    document[name] = float(value) if self.floating[field][position] else int(value)
+                    continue
+                total = values.sum()
+                if floating:
+                    total = float(total)
+                elif abs(total)<2**62:
+                    total = int(values.astype(numpy.int64).sum())
+                else:
+                    return None
+                if operator=="$sum":
+                    document[name] = total
+                else:
+                    document[name] = total/len(values) if len(values)>0 else None
+            return [document]
+
+"""
+Base of the views of stored documents (see DocumentView). 
+A nested view keeps the view of the whole document (root) and its path in it, 
+after the document has been copied the nested view reads and changes the copy
+"""
+class StoredView:
+    _created = False #no view was made in the process, written documents aren't searched for views (see unwrap_view)
+
+    def __init__(self,value,root=None,path=()):
+        StoredView._created = True
+        self._value = value
+        self._root = self if root==None else root
+        self._path = path
+        self._copied = False
+
+    def _target(self):
+        root = self._root
+        if not root._copied:
+            return self._value
+        target = root._value
+        for key in self._path:
+            target = target[key]
+        return target
+
+    def _writable(self):
+        root = self._root
+        if not root._copied:
+            root._value = copy.deepcopy(root._value)
+            root._copied = True
+        return self._target()
+
+    def _wrap(self,key,value):
+        if self._root._copied:
+            return value
+        if isinstance(value,dict):
+            return DocumentView(value,self._root,self._path+(key,))
+        if isinstance(value,list):
+            return ListView(value,self._root,self._path+(key,))
+        return value
+
+    def __len__(self):
+        return len(self._target())
+
+    def __repr__(self):
+        return repr(self._target())
+
+    """
+    Returns a deep copy of the value
+    """
+    def copy(self):
+        return copy.deepcopy(self._target())
+
+    #views nested in written documents are pickled and deep-copied as plain values
+    def __reduce__(self):
+        return (type(self._target()),(self.copy(),))
+
+"""
+Plain value of a view returned by find(condition, copy=False). 
+Views nested in dictionaries and lists are replaced by plain values in place, other values are returned as they are
+"""
+def unwrap_view(value):
+    if not StoredView._created:
+        return value
+    if isinstance(value,StoredView):
+        return value.copy()
+    if isinstance(value,dict):
+        for key,item in value.items():
+            if isinstance(item,(StoredView,dict,list)):
+                plain = unwrap_view(item)
+                if not plain is item:
+                    value[key] = plain
+    elif isinstance(value,list):
+        for index,item in enumerate(value):
+            if isinstance(item,(StoredView,dict,list)):
+                plain = unwrap_view(item)
+                if not plain is item:
+                    value[index] = plain
+    return value
+
+"""
+View of a stored document returned by find(condition, copy=False) instead of a deep copy.
+Nested dictionaries and lists are returned as views too. 
+The document is copied on the first change made through the view or its nested views (copy on write), 
+the stored document is never changed. Views are written to collections as plain values, use copy() to get a plain dictionary (to serialize it)
+"""
+class DocumentView(StoredView,collections.abc.MutableMapping):
+    def __getitem__(self,key):
+        return self._wrap(key,self._target()[key])
+
+    def __setitem__(self,key,value):
+        self._writable()[key] = value
+
+    def __delitem__(self,key):
+        del self._writable()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __contains__(self,key):
+        return key in self._target()
+
+"""
+View of a list of a stored document (see DocumentView)
+"""
+class ListView(StoredView,collections.abc.MutableSequence):
+    def __getitem__(self,index):
+        if isinstance(index,slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index<0:
+            index+=len(self)
+        return self._wrap(index,self._target()[index])
+
+    def __setitem__(self,index,value):
+        self._writable()[index] = value
+
+    def __delitem__(self,index):
+        del self._writable()[index]
+
+    def insert(self,index,value):
+        self._writable().insert(index,value)
+
+    def __eq__(self,other):
+        if isinstance(other,(list,ListView)):
+            return len(self)==len(other) and all(a==b for a,b in zip(self,other))
+        return NotImplemented
+
+"""
+Lock manager of a database: shared and exclusive locks of the database files.
+Where fcntl is available, the locks are flock locks of *.flock files: readers share a lock, a writer holds it alone,
+and the lock of a crashed process is released by the system. 
+Elsewhere both kinds are exclusive soft locks of *.lock files (stale ones are removed when the database is opened).
+A thread holding the lock of a file acquires it again without waiting. The time spent waiting for locks is counted (see Pelican.lock_stats)
+"""
+class LockManager:
+    def __init__(self):
+        self._local = threading.local()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    """
+    Lock of a file
+
+    :path: locked file
+
+    Arguments:
+    :shared: shared (read) lock instead of exclusive
+
+    :returns: lock with acquire(timeout) and release() like filelock locks
+
+    """
+    def lock(self,path,**kwargs):
+        return FileLock(self,path,kwargs.get("shared",False))
+
+    def _held(self):
+        held = getattr(self._local,"held",None)
+        if held==None:
+            held = {}
+            self._local.held = held
+        return held
+
+    def _count(self,path,contended,wait,timeout=False):
+        name = os.path.basename(path)
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats==None:
+                stats = {"acquired":0,"contended":0,"timeouts":0,"wait_time":0.0,"max_wait":0.0}
+                self._stats[name] = stats
+            if timeout:
+                stats["timeouts"]+=1
+            else:
+                stats["acquired"]+=1
+            if contended:
+                stats["contended"]+=1
+                stats["wait_time"]+=wait
+                stats["max_wait"] = max(stats["max_wait"],wait)
+
+    """
+    Lock statistics: acquisitions, contended acquisitions (the lock was held by another process or thread), timeouts,
+    total and maximal wait time in seconds by lock file
+
+    Arguments:
+    :reset: clear the statistics
+
+    """
+    def stats(self,**kwargs):
+        with self._stats_lock:
+            result = {name:dict(stats) for name,stats in self._stats.items()}
+            if kwargs.get("reset")==True:
+                self._stats = {}
+        return result
+
+"""
+Lock of a file acquired through the lock manager (see LockManager)
+"""
+class FileLock:
+    def __init__(self,manager,path,shared):
+        self._manager = manager
+        self._path = path
+        self._shared = shared
+
+    """
+    Acquires the lock
+
+    :timeout: seconds to wait, None or a negative value to wait forever (filelock.Timeout is raised when it expires)
+
+    """
+    def acquire(self,timeout=None):
+        held = self._manager._held()
+        entry = held.get(self._path)
+        if entry!=None:
+            if entry[2] and not self._shared:
+                raise ValueError(f'Lock {self._path} is held shared, it can\'t be acquired exclusive')
+            entry[1]+=1
+            return self
+        
+        start = time.perf_counter()
+        contended = False
+        if fcntl!=None:
+            handle = os.open(self._path+".flock",os.O_RDWR|os.O_CREAT,0o666)
+            mode = fcntl.LOCK_SH if self._shared else fcntl.LOCK_EX
+            delay = 0.0005
+            while True:
+                try:
+                    fcntl.flock(handle,mode|fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    contended = True
+                    if timeout!=None and timeout>=0 and time.perf_counter()-start>=timeout:
+                        os.close(handle)
+                        self._manager._count(self._path,True,time.perf_counter()-start,True)
+                        raise Timeout(self._path+".flock")
+                    time.sleep(delay)
+                    delay = min(delay*2,0.05)
+        else:
+            handle = SoftFileLock(self._path+".lock")
+            try:
+                handle.acquire(timeout=0)
+            except Timeout:
+                contended = True
+                try:
+                    handle.acquire(timeout=-1 if timeout==None else timeout)
+                except Timeout:
+                    self._manager._count(self._path,True,time.perf_counter()-start,True)
+                    raise
+        
+        held[self._path] = [handle,1,self._shared]
+        self._manager._count(self._path,contended,time.perf_counter()-start)
+        return self
+
+    def release(self):
+        held = self._manager._held()
+        entry = held[self._path]
+        entry[1]-=1
+        if entry[1]==0:
+            del held[self._path]
+            if fcntl!=None:
+                os.close(entry[0]) #closing the file releases the flock lock
+            else:
+                entry[0].release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.release()
+
 """
 The main class for connecting to the database and working with collections 
 """    
@@ -340,13 +1434,16 @@ class Pelican(dict):
         :document: document or list of documents to be added
         
         Arguments:
-        :no_index: OFF to change indexes
+        :no_index: OFF to change indexes. Unique hash indexes and sorted indexes are changed anyway: queries and the uniqueness check rely on them
         :upsert: INSERT or UPDATE
         :session: transaction instance
 
 
         """
+        @collection_operation
         def insert(self,document,**kwargs):
+             if isinstance(document,StoredView): #a list view is inserted as a list of documents
+                document = document.copy()
              if isinstance(document, str):
                 try:
                     document = json.loads(document)
@@ -377,6 +1474,7 @@ class Pelican(dict):
         :dataset: values to replace
 
         """
+        @collection_operation
         def update(self,condition,dataset, **kwargs):
              
              if isinstance(dataset, str):
@@ -384,13 +1482,14 @@ class Pelican(dict):
                     dataset = json.loads(dataset)
                 except:
                     raise ValueError(f'Dataset is not a JSON') 
+             dataset = unwrap_view(dataset)
         
              f = self._before_change_handler
              if f!=None:
                 f("update",[condition,dataset])
 
              if isinstance(condition,str):
-                item = self.get(condition) 
+                item = copy.deepcopy(self.get(condition)) 
 
                 if item == None:
                     raise ValueError(f'Item not found {condition}')     
@@ -417,7 +1516,7 @@ class Pelican(dict):
                             set.append(item)    
 
                   if isinstance(condition,dict): 
-                       result = copy.deepcopy(self.find(condition))
+                       result = self.find(condition)
                        for item in result:
                         
                         for key,value in dataset.items():
@@ -440,6 +1539,7 @@ class Pelican(dict):
         :condition: document ID/ list of documents IDs/ query condition
 
         """
+        @collection_operation
         def delete(self,condition, **kwargs):
              
              if isinstance(condition,str):
@@ -469,7 +1569,7 @@ class Pelican(dict):
                             set.append(item)    
 
                   if isinstance(condition,dict): 
-                       result = copy.deepcopy(self.find(condition))
+                       result = self.find(condition)
                        for item in result:
                         
                         if item!=None:
@@ -497,18 +1597,28 @@ class Pelican(dict):
             self._maindata_temp = {}
 
             self._recording=False
-            self._modification_uuid=None
+            self._invalidate()
+            self._data_end = 0
 
             if self._is_index():
                 if os.path.exists(self._path):
                     os.remove(self._path) 
             else:     
+                self._close_data_map()
+                self._db._checkpoint_wal()
                 if os.path.exists(self._path):
                     os.remove(self._path)
                 if os.path.exists(self._path_data):
                     os.remove(self._path_data) 
                 if os.path.exists(self._path_id):
                     os.remove(self._path_id)         
+                if os.path.exists(self._path_id_journal):
+                    os.remove(self._path_id_journal)
+                if os.path.exists(self._path_ids):
+                    os.remove(self._path_ids)
+                if os.path.exists(self._path_clock):
+                    os.remove(self._path_clock)
+                self._id_refs = {}
 
     
         #Query functions
@@ -519,6 +1629,8 @@ class Pelican(dict):
         :key: document ID   
 
         """
+        @snapshot_query
+        @collection_operation
         def get(self,key):
             if self._db._RAM == True:
                 return self._maindata.get(key)        
@@ -531,23 +1643,28 @@ class Pelican(dict):
                         if os.path.isfile(self._path_data):
                             c = self._data.get(key+"_"+str(last_version))
                             if c!=None:
-                                in_file = open(self._path_data, "rb") 
-                                in_file.seek(c[0])
-                                data = in_file.read(c[1]) 
-                                res = pickle.loads(data)
-                                return res
+                                return self._read_document(c)
             return None    
         
+        """
+        Return a version of the document. 
+        Raises ValueError if the version was removed by the retention policy of the collection (see set_retention)
+
+        :key: document ID
+        :version: version number
+
+        """
+        @snapshot_query
+        @collection_operation
         def get_version(self,key,version):
             
             if version!=None:
                 c = self._data.get(key+"_"+str(version))
                 if c!=None:
-                    in_file = open(self._path_data, "rb") 
-                    in_file.seek(c[0])
-                    data = in_file.read(c[1]) 
-                    res = pickle.loads(data)
-                    return res
+                    return self._read_document(c)
+                last_version = self._data_idx.get(key)
+                if last_version!=None and 0<=version<last_version:
+                    raise ValueError(f'Version {version} of document {key} was removed by the retention policy')
             return None    
         
         """
@@ -558,6 +1675,7 @@ class Pelican(dict):
 
         """
         
+        @collection_operation
         def get_by_index(self,index,value):
             key = index._data.get(hashlib.sha1(value.encode()).hexdigest())
             if key==None:
@@ -569,20 +1687,163 @@ class Pelican(dict):
         Queries documents from the collection by condition
 
         :condition: query condition
+        :sort: order of the documents, list of (field, 1 or -1) (see find_iter)
+        :limit: maximum number of documents
+        :skip: number of matching documents to skip
+        :projection: fields of the returned documents (see project)
+        :copy: False - return read-only views of the stored documents (DocumentView, copied on change) instead of deep copies
         
 
         """
-        def find(self,condition):    
-            if self._db._RAM == True:
-                data = self._maindata
-                
-                result = [element for element in data.values() if check_condition(condition,element) and element.get("_id") in self._data_idx]
-            else:         
-                data = self.all()
+        @snapshot_query
+        @collection_operation
+        def find(self,condition,**kwargs):    
+            return list(self.find_iter(condition,**kwargs))
 
-                result = [element for element in data if check_condition(condition,element)  and element.get("_id") in self._data_idx]
+        """
+        Cursor of a query: a generator of the documents meeting the condition.
+        Documents are read and decoded while the cursor is iterated (in RAM=False mode READ_CHUNK documents at a time), 
+        reading stops as soon as limit documents are produced.
+        Sorted results are read in the order of a sorted index on the sort field if there is one, 
+        otherwise the matching documents are sorted (only the first skip+limit of them are kept if limit is set)
+
+        :condition: query condition, None - all documents
+        :sort: order of the documents: list of (field, 1 or -1) (see sort_fields), documents without the field are placed last
+        :limit: maximum number of documents
+        :skip: number of matching documents to skip
+        :projection: fields of the returned documents (see project)
+        :copy: False - return read-only views of the stored documents (see find)
 
-            return copy.deepcopy(result)
+        """
+        @snapshot_query
+        def find_iter(self,condition,**kwargs):
+            skip = kwargs.get("skip") or 0
+            limit = kwargs.get("limit")
+            projection = kwargs.get("projection")
+            copied = kwargs.get("copy",True)
+            if limit!=None and limit<=0:
+                return
+
+            if kwargs.get("sort")!=None:
+                documents = self._sorted_matches(condition,sort_fields(kwargs["sort"]),None if limit==None else skip+limit)
+            else:
+                documents = self._matches(condition)
+
+            for element in itertools.islice(documents,skip,None if limit==None else skip+limit):
+                element = project(element,projection)
+                yield copy.deepcopy(element) if copied else DocumentView(element)
+
+        """
+        Aggregation pipeline: a list of stages (see compile_stage) run in one streaming pass over the collection.
+        A leading $match uses indexes as find does, documents are not copied, $group keeps only the state of its groups.
+        [$match, $group] without grouping fields is evaluated on the columnar cache if possible (see register_columns).
+        Syntax replicates MongoDB aggregation
+
+        :pipeline: list of stages or a JSON string
+
+        :returns: list of the resulting documents
+
+        """
+        @snapshot_query
+        @collection_operation
+        def aggregate(self,pipeline):
+            if isinstance(pipeline, str):
+                try:
+                    pipeline = json.loads(pipeline)
+                except:
+                    raise ValueError(f'Pipeline is not a JSON') 
+            if not isinstance(pipeline,list):
+                raise ValueError(f'Pipeline should be a list of stages')
+
+            stages = [compile_stage(stage) for stage in pipeline]
+            condition = None
+            if len(pipeline)>0 and isinstance(pipeline[0],dict) and "$match" in pipeline[0]:
+                condition = pipeline[0]["$match"]
+
+            columns = self._column_cache()
+            if columns!=None and len(pipeline)==(1 if condition==None else 2) and "$group" in pipeline[-1]:
+                result = columns.aggregate(condition,pipeline[-1]["$group"])
+                if result!=None:
+                    return result
+            documents = self._matches(condition)
+            for stage in stages[(0 if condition==None else 1):]:
+                documents = stage(documents)
+            return copy.deepcopy(list(documents))
+
+        def _matches(self,condition):
+            match = None if condition==None else query_plan(condition)
+            for element in self._candidates(condition):
+                if match==None or match(element):
+                    yield element
+
+        """
+        Matching documents in the sort order. A single sort field with a sorted index is read in the order of the index 
+        (unless a hash index finds the candidates), documents without a sortable value of the field follow. 
+        Otherwise the first count documents are selected by a heap (all of them are sorted if count is None)
+        """
+        def _sorted_matches(self,condition,fields,count):
+            field,direction = fields[0]
+            index = self._sorted_index(field) if len(fields)==1 else None
+            if index!=None and not (isinstance(condition,dict) and self._hash_ids(condition)!=None):
+                match = None if condition==None else query_plan(condition)
+                bounds = range_bounds(condition[field]) if isinstance(condition,dict) and field in condition else None
+                if bounds!=None:
+                    ids = self._db[index]._sorted_range(*bounds)
+                else:
+                    ids = list(self._db[index]._sorted_entries()[1])
+                if direction<0:
+                    ids.reverse()
+                data_idx = self._data_idx
+                for doc_id in ids:
+                    element = self.get(doc_id)
+                    if element!=None and doc_id in data_idx and (match==None or match(element)):
+                        yield element
+                if bounds==None:
+                    for element in self._matches(condition):
+                        if sort_key(element.get(field))==None:
+                            yield element
+                return
+
+            order = lambda element: DocumentOrder(element,fields)
+            if count!=None:
+                yield from heapq.nsmallest(count,self._matches(condition),key=order)
+            else:
+                yield from sorted(self._matches(condition),key=order)
+
+        """
+        Documents of the collection which may meet the condition, read lazily.
+        Candidates are looked up in an index (see _indexed_ids) or selected by the columnar cache (see register_columns) if possible, 
+        otherwise the collection is scanned
+        """
+        def _candidates(self,condition):
+            data_idx = self._data_idx
+            ids = self._indexed_ids(condition)
+            if ids==None and isinstance(condition,dict) and self._column_cache()!=None:
+                ids = self._columns.select(condition)
+            if ids!=None: #candidates from an index or the columnar cache, the whole condition is checked on them
+                if self._db._RAM == True:
+                    maindata = self._maindata
+                    for doc_id in ids:
+                        element = maindata.get(doc_id)
+                        if element!=None and doc_id in data_idx:
+                            yield element
+                else:
+                    temp = self._maindata_temp
+                    for start in range(0,len(ids),READ_CHUNK):
+                        chunk = ids[start:start+READ_CHUNK]
+                        documents = self._read_documents({doc_id:data_idx[doc_id] for doc_id in chunk if doc_id in data_idx and not doc_id in temp})
+                        for doc_id in chunk:
+                            element = temp.get(doc_id) if doc_id in temp else documents.get(doc_id)
+                            if element!=None and doc_id in data_idx:
+                                yield element
+            elif self._db._RAM == True:
+                for element in list(self._maindata.values()):
+                    if element.get("_id") in data_idx:
+                        yield element
+            else:
+                items = list(data_idx.items())
+                for start in range(0,len(items),READ_CHUNK):
+                    yield from self._read_documents(dict(items[start:start+READ_CHUNK])).values()
 
             # Write the newly updated data back to the storage
             #self._storage.write(tables)
@@ -590,17 +1851,179 @@ class Pelican(dict):
             # Clear the query cache, as the table contents have changed
             #self.clear_cache()
         
+        """
+        Query planner: IDs of the documents which may meet the condition, looked up in a stored unique hash index 
+        of the collection by an equality or $in predicate of the condition on the indexed field 
+        (an index which allows repeated values keeps one ID per value, it can't find all the documents).
+        Without such a predicate the narrowest range ($gt, $gte, $lt, $lte or equality) on the field of a sorted index is used,
+        the IDs are returned in the order of the field.
+        Dynamic indexes (empty until reindexed), indexes updated from a queue and snapshots are not used
+
+        :condition: query condition
+
+        :returns: list of document IDs or None if the collection has to be scanned
+
+        """
+        def _indexed_ids(self,condition):
+            if not isinstance(condition,dict) or self._snapshot!=None or self._db.queue!=None:
+                return None
+            ids = self._hash_ids(condition)
+            if ids==None:
+                ids = self._range_ids(condition)
+            return ids
+
+        def _hash_ids(self,condition):
+            indexes = self._db._collection_indexes(self._name,"hash")
+            keys = {settings['key']:name for name,settings in indexes.items() if settings.get("unique")==True and settings.get("dynamic")!=True}
+            
+            best = None
+            for key,value in condition.items():
+                if key in keys:
+                    values = indexable_values(value)
+                    if values!=None and (best==None or len(values)<len(best[1])):
+                        best = (keys[key],values)
+            if best==None:
+                return None
+
+            data = self._db[best[0]]._data
+            ids = {}
+            for value in best[1]:
+                doc_id = data.get(hashlib.sha1(value.encode()).hexdigest())
+                if doc_id!=None:
+                    ids[doc_id] = True
+            return list(ids)
+
+        def _range_ids(self,condition):
+            indexes = self._db._collection_indexes(self._name,"sorted")
+            best = None
+            for key,value in condition.items():
+                for name,settings in indexes.items():
+                    if settings['key']==key:
+                        bounds = range_bounds(value)
+                        if bounds!=None:
+                            ids = self._db[name]._sorted_range(*bounds)
+                            if best==None or len(ids)<len(best):
+                                best = ids
+            return best
+
+        """
+        Name of the sorted index on a field, None if there is no index or it can't be used (snapshots, indexes updated from a queue)
+        """
+        def _sorted_index(self,key):
+            if self._snapshot!=None or self._db.queue!=None:
+                return None
+            for name,settings in self._db._collection_indexes(self._name,"sorted").items():
+                if settings['key']==key:
+                    return name
+            return None
+
+        """
+        Documents having a sortable value of the field (see sort_key) in the order of the field.
+        Read through a sorted index on the field if it is registered, otherwise the collection is scanned and sorted
+        """
+        def _ordered_documents(self,key,reverse=False):
+            data_idx = self._data_idx
+            index = self._sorted_index(key)
+            if index!=None:
+                keys,ids = self._db[index]._sorted_entries()
+                for doc_id in (reversed(ids) if reverse else list(ids)):
+                    element = self.get(doc_id)
+                    if element!=None and doc_id in data_idx:
+                        yield element
+            else:
+                elements = [(sort_key(element.get(key)),element) for element in self.all() if element.get("_id") in data_idx]
+                elements = [element for element in elements if element[0]!=None]
+                elements.sort(key=lambda element: element[0],reverse=reverse)
+                for element in elements:
+                    yield element[1]
+
+        """
+        Returns the documents ordered by a field (numbers before strings), documents without a sortable value of the field are skipped.
+        A sorted index on the field is used if it is registered (see register_sorted_index)
+
+        :key: document field
+        :reverse: descending order
+        :copy: False - return read-only views of the documents (see find)
+
+        """
+        @snapshot_query
+        @collection_operation
+        def ordered(self,key,**kwargs):
+            result = list(self._ordered_documents(key,kwargs.get("reverse",False)))
+            if kwargs.get("copy",True)==False:
+                return [DocumentView(element) for element in result]
+            return copy.deepcopy(result)
+
+        """
+        Returns the document with the smallest value of a field or None (see ordered)
+
+        :key: document field
+
+        """
+        @snapshot_query
+        @collection_operation
+        def min(self,key):
+            return copy.deepcopy(next(self._ordered_documents(key),None))
+
+        """
+        Returns the document with the largest value of a field or None (see ordered)
+
+        :key: document field
+
+        """
+        @snapshot_query
+        @collection_operation
+        def max(self,key):
+            return copy.deepcopy(next(self._ordered_documents(key,True),None))
+
+        """
+        Columnar cache of numeric fields (requires NumPy). The values of the fields are kept in NumPy arrays in the memory of the process,
+        comparisons ($eq, $gt, $gte, $lt, $lte, $in with numbers) of find conditions are evaluated on the arrays
+        and the rest of the condition is checked on the selected documents; [$match, $group] pipelines without grouping fields 
+        are evaluated on the arrays. The cache is built at the next query, kept up to date by inserts and deletes of the process 
+        and built again after changes made by other processes or transactions
+
+        :fields: numeric document fields
+
+        """
+        def register_columns(self,*fields):
+            if numpy==None:
+                raise ValueError(f'NumPy is required for the columnar cache')
+            self._column_fields = list(dict.fromkeys((self._column_fields or [])+list(fields)))
+            self._columns = None
+
+        def _column_cache(self):
+            if self._column_fields==None or self._snapshot!=None:
+                return None
+            if self._columns==None:
+                columns = ColumnCache(self._column_fields)
+                if self._db._RAM == True:
+                    columns.add(list(self._maindata.values()))
+                else:
+                    columns.add(self._read_documents(self._data_idx).values())
+                self._columns = columns
+            return self._columns
+
+        def _add_columns(self,documents):
+            if self._columns!=None:
+                self._columns.add(documents)
+
+        def _remove_columns(self,ids):
+            if self._columns!=None:
+                self._columns.remove(ids)
+
         """
         Returns all documents
         """
+        @snapshot_query
+        @collection_operation
         def all(self):
             result = []
 
             if self._db._RAM == True:
                 result = list(self._maindata.values())
             else:         
-                for key,value in self._data_idx.items():
-                    result.append(self.get_version(key,value))
+                result = list(self._read_documents(self._data_idx).values())
 
             return result
         
@@ -628,7 +2051,7 @@ class Pelican(dict):
             path = Path(self._db.__dict__['_basepath']+os.sep+"admin.db")    
             path.parent.mkdir(parents=True, exist_ok=True) 
             
-            lock = SoftFileLock(str(path.absolute())+".lock")
+            lock = self._db._file_lock(str(path.absolute()))
             
             try:
                     with  lock.acquire(timeout=self._db['_timeout']):
@@ -650,10 +2073,7 @@ class Pelican(dict):
                         self._db["db_indexes"][name] = {"collection":self._name,"key":key,"dynamic":kwargs.get("dynamic")}
                         self._db["text_indexes"][name] = {"collection":self._name,"key":key,"dynamic":kwargs.get("dynamic")}
 
-                        with open(str(path.absolute()),"w", encoding='utf-8') as f:    
-    
-                                    json.dump(admin,f)
-                                    f.close()    
+                        self._db._write_admin(admin)
 
 
                                 
@@ -665,12 +2085,21 @@ class Pelican(dict):
         adding hash index
         :name: index name
         :key: document field
+
+        Arguments:
+        :dynamic: the index is kept in memory only, empty until reindexed
+        :unique: documents with a value of the field that another document already has are rejected. 
+        Only unique indexes are used by the query planner (see _indexed_ids), such an index is built at once 
         """
 
         def register_hash_index(self,name,key,**kwargs):
             #self._db[self._name+"_"+name] = {}
+            if kwargs.get("unique")==True:
+                self._hash_entries(key,True)
 
             self._db._register_unique_index(self._name,name,key,**kwargs)
+            if kwargs.get("unique")==True:
+                self.reindex_hash(name)
 
 
         """
@@ -679,6 +2108,7 @@ class Pelican(dict):
         :name: index name
 
         """
+        @collection_operation
         def reindex_hash(self,name):
             indexes = self._db["hash_indexes"]
             index_settings = indexes.get(name)
@@ -687,32 +2117,77 @@ class Pelican(dict):
                   raise ValueError(f'No index settings found') 
             
             key = index_settings['key']
+            data = self._hash_entries(key,index_settings.get("unique")==True)
             self._db[name]._recording=True
             if index_settings.get("dynamic") == True:
-                self._db[name]._data = {}
-                for value_document in self.all():
-                    if key in value_document:
-                        id = hashlib.sha1(value_document.get(key).encode()).hexdigest()
-                        self._db[name]._data[id] =value_document["_id"]
+                self._db[name]._data = data
                  
             else:    
-                self._db[name]._data = {}
-                
-                for value_document in self.all():
-                    if key in value_document:
-                        id = hashlib.sha1(value_document.get(key).encode()).hexdigest()
-                        self._db[name]._data[id] =value_document["_id"]
-                    
+                self._db[name]._data = data
                 
                 self._db[name]._write_index()
             self._db[name]._recording=False    
 
+        """
+        Hash index entries {hash of value: document ID} of the documents of the collection
+
+        :key: document field
+        :unique: raise ValueError if documents repeat a value
+
+        """
+        def _hash_entries(self,key,unique):
+            data = {}
+            for value_document in self.all():
+                value = value_document.get(key)
+                if isinstance(value,str):
+                    id = hashlib.sha1(value.encode()).hexdigest()
+                    if unique and id in data:
+                        raise ValueError(f'Value {value} of field {key} is not unique')
+                    data[id] =value_document["_id"]
+            return data
+
+        """
+        adding sorted index. Keeps the values of a field in sorted order for range queries, ordered reads and min/max.
+        Numbers and strings are indexed (see sort_key), the index is built from the documents of the collection
+
+        :name: index name
+        :key: document field
+        """
+        def register_sorted_index(self,name,key,**kwargs):
+            self._db._register_unique_index(self._name,name,key,section="sorted_indexes")
+            self.reindex_sorted(name)
+
+        """
+        reindex sorted index
+
+        :name: index name
+
+        """
+        @collection_operation
+        def reindex_sorted(self,name):
+            index_settings = self._db["sorted_indexes"].get(name)
+            if  index_settings==None:
+                  raise ValueError(f'No index settings found') 
+
+            key = index_settings['key']
+            data = {}
+            for document in self.all():
+                if sort_key(document.get(key))!=None:
+                    data[document["_id"]] = document[key]
+
+            collection = self._db[name]
+            collection._recording=True
+            collection._data = data
+            collection._write_index()
+            collection._recording=False
+
         """
         reindex function for text indexes
 
         :index_name: name of a index
 
         """       
+        @collection_operation
         def reindex_text(self,index_name):
              
              #Надо поставить ограничение на маленькие размеры списков
@@ -767,6 +2242,37 @@ class Pelican(dict):
 
 
 
+        """
+        Checks the values of unique hash indexes before documents are written, 
+        including documents of the current session and other documents of the same write.
+        An index entry whose document no longer has the value (changed or removed) is not a conflict
+
+        :documents: documents to be written
+
+        """
+        def _check_unique_values(self,documents):
+            for index,settings in self._db._collection_indexes(self._name,"hash").items():
+                if settings.get("unique")!=True:
+                    continue
+                key = settings['key']
+                data = self._db[index]._data
+                owners = {document.get(key):doc_id for doc_id,document in self._maindata_temp.items() if isinstance(document.get(key),str)}
+                for document in documents:
+                    value = document.get(key)
+                    if not isinstance(value,str):
+                        continue
+                    doc_id = document.get("_id")
+                    owner = owners.get(value)
+                    if owner==None:
+                        owner = data.get(hashlib.sha1(value.encode()).hexdigest())
+                        if owner!=None and owner!=doc_id:
+                            stored = self.get(owner)
+                            if stored==None or stored.get(key)!=value:
+                                owner = None
+                    if owner!=None and owner!=doc_id:
+                        raise ValueError(f'Value {value} of unique index {index} already exists')
+                    owners[value] = doc_id
+
         """
         Add value to hash-index
         :document: document to be stored to index
@@ -775,9 +2281,11 @@ class Pelican(dict):
 
                                               
 
-        def _add_values_to_unique_indexes(self,documents):
-            indexes = self._db._get_unique_indexes()
+        def _add_values_to_unique_indexes(self,documents,**kwargs):
+            indexes = self._db._collection_indexes(self._name,"hash")
             for index,value in indexes.items():
+                if kwargs.get("NoIndex")==True and value.get("unique")!=True: #see insert
+                    continue
                 if value['collection'] == self._name:
                     d = self._db[index]._data  
                     self._db[index]._recording=True
@@ -789,9 +2297,10 @@ class Pelican(dict):
                     if not value.get("dynamic") == True:
                         self._db[index]._write_index()
                     self._db[index]._recording=False          
+            self._add_values_to_sorted_indexes(documents)
 
         def _delete_values_from_unique_indexes(self,documents):                        
-            indexes = self._db._get_unique_indexes()
+            indexes = self._db._collection_indexes(self._name,"hash")
             
             for index,value in indexes.items():
                 
@@ -812,7 +2321,7 @@ class Pelican(dict):
                     self._db[index]._recording=False  
                            
         def _add_values_to_text_indexes(self,documents):
-            indexes = self._db['text_indexes']
+            indexes = self._db._collection_indexes(self._name,"text")
             for index,value in indexes.items():
                  if value['collection'] == self._name:
                       for document in documents:
@@ -859,7 +2368,7 @@ class Pelican(dict):
 
 
         def _delete_values_from_text_indexes(self,documents):
-            indexes = self._db['text_indexes']
+            indexes = self._db._collection_indexes(self._name,"text")
             for index,value in indexes.items():
                  if value['collection'] == self._name:
                       for document in documents:
@@ -871,6 +2380,7 @@ class Pelican(dict):
         Search substring in a text index
         :s: search string
         """
+        @collection_operation
         def search_text_index(self,s):
              
             indexes = self._db["text_indexes"]
@@ -900,9 +2410,11 @@ class Pelican(dict):
             return result                           
                      
 
-        def _delete_values_from_unique_indexes(self,documents):
-            indexes = self._db._get_unique_indexes()
+        def _delete_values_from_unique_indexes(self,documents,**kwargs):
+            indexes = self._db._collection_indexes(self._name,"hash")
             for index,value in indexes.items():
+                 if kwargs.get("NoIndex")==True and value.get("unique")!=True: #see insert
+                     continue
                  if value['collection'] == self._name:
                       
                       self._db[index]._recording=True
@@ -915,9 +2427,80 @@ class Pelican(dict):
                       if not value.get("dynamic") == True:       
                         self._db[index]._write_index()
                       self._db[index]._recording=False          
+            self._delete_values_from_sorted_indexes(documents)
                                     
         
-        """B-tree indexes"""
+        """Sorted indexes"""
+
+        def _add_values_to_sorted_indexes(self,documents):
+            for index,value in self._db._collection_indexes(self._name,"sorted").items():
+                collection = self._db[index]
+                collection._sorted_entries()
+                collection._recording=True
+                for document in documents:
+                    if '_id' in document:
+                        collection._sorted_remove(document['_id'])
+                        collection._sorted_add(document['_id'],document.get(value['key']))
+                collection._write_index()
+                collection._recording=False
+
+        def _delete_values_from_sorted_indexes(self,documents):
+            for index,value in self._db._collection_indexes(self._name,"sorted").items():
+                collection = self._db[index]
+                collection._sorted_entries()
+                collection._recording=True
+                for document in documents:
+                    if '_id' in document:
+                        collection._sorted_remove(document['_id'])
+                collection._write_index()
+                collection._recording=False
+
+        """
+        Entries of a sorted index: parallel lists of sort keys and document IDs ordered by the key.
+        Built from the stored index {document ID: value} and built again when the index has been re-read from the file
+        """
+        def _sorted_entries(self):
+            data = self._data
+            if self._sorted_source is not data:
+                entries = sorted(((sort_key(value),doc_id) for doc_id,value in data.items()),key=lambda entry: entry[0])
+                self._sorted_keys = [entry[0] for entry in entries]
+                self._sorted_ids = [entry[1] for entry in entries]
+                self._sorted_source = data
+            return self._sorted_keys,self._sorted_ids
+
+        def _sorted_add(self,doc_id,value):
+            key = sort_key(value)
+            if key!=None:
+                position = bisect.bisect_right(self._sorted_keys,key)
+                self._sorted_keys.insert(position,key)
+                self._sorted_ids.insert(position,doc_id)
+                self._data[doc_id] = value
+
+        def _sorted_remove(self,doc_id):
+            if doc_id in self._data:
+                key = sort_key(self._data.pop(doc_id))
+                keys = self._sorted_keys
+                for position in range(bisect.bisect_left(keys,key),bisect.bisect_right(keys,key)):
+                    if self._sorted_ids[position]==doc_id:
+                        del keys[position]
+                        del self._sorted_ids[position]
+                        break
+
+        """
+        IDs of a sorted index between the bounds in the order of the key (see range_bounds).
+        An open bound is limited by the rank of the other one, numbers and strings are not mixed
+        """
+        def _sorted_range(self,low,low_inclusive,high,high_inclusive):
+            keys,ids = self._sorted_entries()
+            if low!=None:
+                start = bisect.bisect_left(keys,low) if low_inclusive else bisect.bisect_right(keys,low)
+            else:
+                start = bisect.bisect_left(keys,(high[0],))
+            if high!=None:
+                end = bisect.bisect_right(keys,high) if high_inclusive else bisect.bisect_left(keys,high)
+            else:
+                end = bisect.bisect_left(keys,(low[0]+1,))
+            return ids[start:end]
 
 
         """
@@ -998,10 +2581,7 @@ class Pelican(dict):
                 if self._is_modification() or not hasattr(object, '_data') :
                     
                     if not self._is_index():
-                        self._data = self._read_collection()
-                        self._data_idx=self._read_collection_idx()
-                        if self._db._RAM == True:
-                           self._maindata = self._read_collection_maindata()     
+                        self._refresh()
                     else:       
                         self._data = self._read_index()
                 
@@ -1033,21 +2613,104 @@ class Pelican(dict):
                      
                 else:     
                      if self._is_modification():
-                        self._data = self._read_collection()
-                        self._data_idx = self._read_collection_idx()
-                        if self._db._RAM == True:
-                           self._maindata = self._read_collection_maindata()     
+                        self._refresh()
                 
                 return object.__getattribute__(self, '_data')
             elif item=='_maindata':
                 if self._is_modification():
+                    self._refresh()
+                return object.__getattribute__(self, '_maindata')
+            else:
+                return super().__getattribute__(item)   
+
+        """
+        Re-reads the collection changed by another process.
+        Only pointers and last-version changes appended since the previous read are parsed, 
+        in RAM mode only the changed documents are loaded.
+        The whole collection is read again if the pointer file was rewritten (shrink, clear, conversion).
+        Both reads hold the shared lock, so a write of another thread is never replaced by the state read before it
+        """
+        def _refresh(self):
+            lock = self._db._file_lock(self._path,shared=True)
+            try:
+                with  lock.acquire(timeout=self._db['_timeout']):
+                    if object.__getattribute__(self,'_ptr_consumed')!=None and os.path.isfile(self._path):
+                        if self._refresh_tail():
+                            return
+
+                    self._columns = None
                     self._data = self._read_collection()
                     self._data_idx = self._read_collection_idx()
                     if self._db._RAM == True:
-                        self._maindata = self._read_collection_maindata() 
-                return object.__getattribute__(self, '_maindata')
+                        self._maindata = self._read_collection_maindata()     
+            except Timeout:
+                raise ValueError(f'Lock collection timeout error: {self._path}')
+
+        """
+        Applies pointers and last-version changes appended since the previous read. The caller holds the collection lock
+
+        :returns: False if the pointer file was rewritten and the whole collection must be read
+        """
+        def _refresh_tail(self):
+            if object.__getattribute__(self,'_ptr_consumed')==None:
+                return False
+            pointers = self._read_pointers(tail=True)
+            if pointers==None:
+                return False
+            object.__getattribute__(self,'_data').update(pointers)
+            
+            changes = self._read_collection_idx_tail()
+            if changes==None:
+                old_idx = self._data_idx
+                self._data_idx = self._read_collection_idx()
+                changes = [(doc_id,version) for doc_id,version in self._data_idx.items() if old_idx.get(doc_id)!=version]
+                changes.extend([(doc_id,None) for doc_id in old_idx if not doc_id in self._data_idx])
+            if len(changes)>0: #changes of other processes are not in the columnar cache
+                self._columns = None
+            
+            if self._db._RAM == True:
+                maindata = object.__getattribute__(self,'_maindata')
+                data = object.__getattribute__(self,'_data')
+                for doc_id,version in changes:
+                    c = None
+                    if version!=None:
+                        c = data.get(doc_id+"_"+str(self._data_idx.get(doc_id)))
+                    if c==None:
+                        maindata.pop(doc_id,None)
+                    else:
+                        maindata[doc_id] = self._read_document(c)
+            return True
+
+        """
+        Brings the collection up to date with the files before a write. The caller holds the collection lock
+        """
+        def _sync_locked(self):
+            key = stat_key(self._path)
+            if key==self._ptr_stat or (key!=None and self._refresh_tail()):
+                return
+            self._close_data_map()
+            self._columns = None
+            if os.path.isfile(self._path+".shrink"):
+                self._finish_shrink()
+            if os.path.isfile(self._path):
+                self._data = self._read_pointers()
             else:
-                return super().__getattribute__(item)   
+                self._data = {}
+                self._id_refs = {}
+                self._ptr_consumed = None
+            self._data_idx = self._read_collection_idx()
+            if self._db._RAM == True:
+                self._maindata = self._read_collection_maindata()
+
+        """
+        Forces the whole collection to be read again at the next access
+        """
+        def _invalidate(self):
+            self._columns = None
+            self._modification_uuid = None
+            self._ptr_stat = None
+            self._ptr_consumed = None
+            self._idl_consumed = None
 
         """
         generates document ID
@@ -1058,7 +2721,8 @@ class Pelican(dict):
 
             return next_id
         """
-        check data modified by another process
+        check data modified by another process.
+        The file is compared by os.stat with the state of the last read/write, the prefix is read only if the file has changed
         """
         def _is_modification(self):
             if  self._recording==True:
@@ -1067,57 +2731,461 @@ class Pelican(dict):
             if  self._modification_uuid==None:
                  return True
             
+            if getattr(self._local,"depth",0)>0: #checked at the start of the operation
+                 return False
+
+            if self._db.singleton == True:
+                 return False
 
+            key = stat_key(self._path)
+            if key==None:
+                return False
 
-            if not os.path.isfile(self._path):
+            if key==self._ptr_stat:
                 return False
 
+            uid=None
+            with open(self._path,"rb") as f:
+                text =f.read(PREFIX_SIZE).decode()
+                uid = text[:PREFIX_SIZE]
+
+            if uid==self._modification_uuid:
+                self._ptr_stat = key
+                return False
 
-            if self._db.singleton == True:
-                 return False
+            return True
+
+        """
+        Reads a document from the data file (*.dat) by its pointer.
+        The data file is memory-mapped once per collection and remapped only when the pointer is beyond the mapped size,
+        so the document is decoded straight from the page cache without open/seek/read calls
+
+        :c: pointer [begin,end,version,uid] or [begin,end,version,uid,flag,inner_begin,inner_end] of a compressed document
+
+        """
+        def _read_document(self,c):
+            data_map = self._data_map
+            if data_map==None or len(data_map)<c[1]:
+                if self._snapshot!=None: #the version was written after the collection was pinned
+                    return None
+                data_map = self._map_data_file()
+
+            if len(c)>4:
+                return self._decode(self._decompress(data_map,c))
+            view = memoryview(data_map)[c[0]:c[1]]
+            try:
+                return self._decode(view)
+            finally:
+                view.release()
+
+        """
+        Returns the encoded bytes of a compressed document. 
+        Decompressed blocks are kept in a small LRU cache, so neighbouring documents of a block are decompressed once
+
+        :data_map: memory map of the data file
+        :c: pointer [begin,end,version,uid,flag,inner_begin,inner_end]
+
+        """
+        def _decompress(self,data_map,c):
+            flag = c[4]
+            if flag & COMPRESSION_BLOCK:
+                cache = self._block_cache
+                key = (c[0],c[1])
+                block = cache.get(key)
+                if block==None:
+                    block = COMPRESSORS[flag & ~COMPRESSION_BLOCK][1](data_map[c[0]:c[1]])
+                    cache[key] = block
+                    if len(cache)>BLOCK_CACHE_SIZE:
+                        cache.popitem(last=False)
+                else:
+                    cache.move_to_end(key)
+                return memoryview(block)[c[5]:c[6]]
+            return COMPRESSORS[flag][1](data_map[c[0]:c[1]])
+
+        """
+        Returns the encoded bytes of a document (decompressed if needed)
+
+        :c: pointer of the document
+        :data_map: memory map of the data file to read from instead of the collection map
+
+        """
+        def _read_record(self,c,data_map=None):
+            if data_map==None:
+                data_map = self._data_map
+                if data_map==None or len(data_map)<c[1]:
+                    data_map = self._map_data_file()
+            if len(c)>4:
+                return bytes(self._decompress(data_map,c))
+            return data_map[c[0]:c[1]]
+
+        """
+        Lays out encoded documents in the data file, compressing them according to the collection settings. 
+        A document that does not shrink is stored uncompressed
+
+        :records: list of encoded documents
+        :begin: offset of the first byte in the data file
+
+        :returns: bytes to append to the data file and the location of every document: 
+        [begin,end] or [begin,end,flag,inner_begin,inner_end] if compressed
+
+        """
+        def _pack_records(self,records,begin):
+            compression = self._compression
+            locations = []
+            chunks = []
+            if compression==None:
+                for record in records:
+                    locations.append([begin,begin+len(record)])
+                    begin+=len(record)
+                return b"".join(records),locations
+
+            flag = COMPRESSIONS[compression["method"]]
+            compress = COMPRESSORS[flag][0]
+            if compression["mode"]=="block":
+                groups = []
+                group = []
+                size = 0
+                for record in records:
+                    group.append(record)
+                    size+=len(record)
+                    if size>=BLOCK_SIZE:
+                        groups.append(group)
+                        group = []
+                        size = 0
+                if len(group)>0:
+                    groups.append(group)
+            else:
+                groups = [[record] for record in records]
+
+            for group in groups:
+                raw = group[0] if len(group)==1 else b"".join(group)
+                packed = compress(raw)
+                if len(packed)>=len(raw):
+                    for record in group:
+                        chunks.append(record)
+                        locations.append([begin,begin+len(record)])
+                        begin+=len(record)
+                    continue
+                
+                chunks.append(packed)
+                if len(group)==1:
+                    locations.append([begin,begin+len(packed),flag,0,len(raw)])
+                else:
+                    inner = 0
+                    for record in group:
+                        locations.append([begin,begin+len(packed),flag | COMPRESSION_BLOCK,inner,inner+len(record)])
+                        inner+=len(record)
+                begin+=len(packed)
+            return b"".join(chunks),locations
+
+        def _map_data_file(self):
+            with open(self._path_data, "rb") as f:
+                self._data_map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            return self._data_map
+
+        """
+        Releases the memory map of the data file. 
+        Called before the data file is removed or replaced
+        """
+        def _close_data_map(self):
+            data_map = self._data_map
+            self._data_map = None
+            self._block_cache.clear()
+            if data_map!=None:
+                try:
+                    data_map.close()
+                except BufferError:
+                    pass #a document is being decoded in another thread, the map is closed when it is released
+
+        """
+        Returns the append offset of the data file (*.dat).
+        The tracked offset is checked against the file size, so appends of other processes are picked up without reading the file
+        """
+        def _get_data_end(self):
+            if self._batch_end!=None: #a group commit is being prepared, documents are placed after the previous ones of the batch
+                return self._batch_end
+            if os.path.isfile(self._path_data):
+                size = os.path.getsize(self._path_data)
+            else:
+                size = 0
+
+            if self._data_end!=size:
+                self._data_end = size
+
+            return self._data_end
+
+        """
+        Appends pointers to the pointer file and updates the modification prefix.
+        The caller holds the collection lock
+
+        :pointers: list of (key, [begin,end,version,uid]) pairs
+        :prefix: new modification prefix
+        :end: size of the data file after the write
+
+        Arguments:
+        :path: pointer file to write instead of the collection file
+        :path_ids: ID string table to write instead of the collection table
+        :id_refs: references of IDs in that table
+
+        """
+        def _write_pointers(self,pointers,prefix,end,**kwargs):
+            ptr_path = kwargs.get("path",self._path)
+            size = self._db._file_size(ptr_path)
+            new_file = size==None
+            if new_file:
+                size = 0
+            last = b""
+            last_id = b""
+            
+            if self._pointer_format=="binary":
+                records = []
+                ids_bytes = []
+                path_ids = kwargs.get("path_ids",self._path_ids)
+                ids_end = self._db._file_size(path_ids) or 0
+                id_refs = kwargs.get("id_refs")
+                if id_refs==None:
+                    #references are valid only in the table they were written to: shrink, clear and conversion of another process replace it
+                    key = stat_key(path_ids)
+                    if key==None or key[0]!=self._id_refs_inode:
+                        self._id_refs = {}
+                    id_refs = self._id_refs
+                compressed = self._compression!=None
+                for key,value in pointers:
+                    ref = id_refs.get(value[3])
+                    if ref==None:
+                        b = value[3].encode()
+                        ref = (ids_end,len(b))
+                        ids_bytes.append(b)
+                        ids_end+=len(b)
+                        id_refs[value[3]] = ref
+                    if compressed:
+                        if len(value)>4:
+                            records.append(POINTER_RECORD_COMPRESSED.pack(value[0],value[1]-value[0],value[2],ref[0],ref[1],value[4],value[5],value[6]-value[5]))
+                        else:
+                            records.append(POINTER_RECORD_COMPRESSED.pack(value[0],value[1]-value[0],value[2],ref[0],ref[1],0,0,0))
+                    else:
+                        records.append(POINTER_RECORD.pack(value[0],value[1]-value[0],value[2],ref[0],ref[1]))
+
+                if len(ids_bytes)>0:
+                    self._db._file_append(path_ids,b"".join(ids_bytes))
+                if not "id_refs" in kwargs:
+                    def table_written():
+                        key = stat_key(path_ids)
+                        self._id_refs_inode = None if key==None else key[0]
+                    self._db._after_write(table_written)
+                
+                if len(records)>0:
+                    last = records[-1]
+                    last_id = pointers[-1][1][3].encode()
+                content = b"".join(records)
+            else:
+                lines = [format_datastr(key,value) for key,value in pointers]
+                if len(lines)>0:
+                    last = (lines[-1]+"\n").encode("utf-8")
+                    content = ("\n".join(lines)+"\n").encode("utf-8")
+                else:
+                    content = b""
+
+            if new_file:
+                content = (format_header(prefix,end)+"\n").encode()+content
+            after = self._db._file_append(ptr_path,content)
             
+            #update prefix if needed
+            if not new_file:
+                self._db._file_write(ptr_path,0,prefix_bytes(ptr_path,prefix,end))
+            in_sync = new_file or size==self._ptr_consumed
+
+            def written():
+                self._modification_uuid=prefix
+                if in_sync:
+                    self._ptr_stat = stat_key(ptr_path)
+                    self._ptr_inode = self._ptr_stat[0]
+                    self._ptr_consumed = after
+                    if len(last)>0 or new_file:
+                        self._ptr_tail = last
+                        self._ptr_tail_id = last_id
+                else:
+                    #pointers of other processes were appended after the previous read, they are read at the next access
+                    self._modification_uuid=None
+            self._db._after_write(written)
 
-            uid=None
-            with open(self._path,"r", encoding='utf-8') as f:
-                text =f.read(36)
-                uid = text[:36]
+        """
+        Reads pointers from the pointer file. The caller holds the collection lock.
+        The consumed size of the file and its last line/record are remembered, 
+        so the next read can parse only what was appended.
+        Data is appended before the pointers referring to it, so the append offset in the header is never beyond the end of the data file: 
+        a shorter data file lost documents (ValueError)
+        Binary records (*.ptb) are read through memory maps of the pointer file and the ID string table (*.pts)
+
+        Arguments:
+        :tail: read only pointers appended since the previous read
+
+        :returns: dictionary of pointers or None if the file was rewritten and the tail can't be used
+
+        """
+        def _read_pointers(self,tail=False):
+            collection = {}
+            with open(self._path,"rb") as f:
+                st = os.fstat(f.fileno())
+                header = f.readline()
+                last = self._ptr_tail
+                last_id = self._ptr_tail_id
+                if tail:
+                    if st.st_ino!=self._ptr_inode or st.st_size<self._ptr_consumed:
+                        return None
+                    f.seek(self._ptr_consumed-len(last))
+                    if f.read(len(last))!=last:
+                        return None
+                    if len(last_id)>0:
+                        #a file rewritten by another process may reuse the inode and end with the same record, the ID it refers to tells them apart
+                        id_offset,id_length = POINTER_RECORD.unpack_from(last)[3:5]
+                        with open(self._path_ids,"rb") as fi:
+                            fi.seek(id_offset)
+                            if fi.read(id_length)!=last_id:
+                                return None
+                    start = self._ptr_consumed
+                else:
+                    last = b""
+                    last_id = b""
+                    start = len(header)
+                    self._id_refs = {} #the ID string table may have been rewritten with the pointer file
+                consumed = start
+
+                if self._pointer_format=="binary":
+                    record = POINTER_RECORD if self._compression==None else POINTER_RECORD_COMPRESSED
+                    count = (st.st_size-start)//record.size
+                    if count>0:
+                        consumed = start+count*record.size
+                        pointers_map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+                        with open(self._path_ids,"rb") as fi:
+                            ids_map = mmap.mmap(fi.fileno(),0,access=mmap.ACCESS_READ)
+
+                        #references of loaded IDs are not kept (it costs more than it saves): 
+                        #the first new version of such a document stores its ID in the string table once more, shrink rewrites the table
+                        with memoryview(pointers_map) as view:
+                            if record is POINTER_RECORD:
+                                for begin,length,version,id_offset,id_length in record.iter_unpack(view[start:consumed]):
+                                    doc_id = ids_map[id_offset:id_offset+id_length].decode()
+                                    collection[f"{doc_id}_{version}"] = [begin,begin+length,version,doc_id]
+                            else:
+                                for begin,length,version,id_offset,id_length,flag,inner_begin,inner_length in record.iter_unpack(view[start:consumed]):
+                                    doc_id = ids_map[id_offset:id_offset+id_length].decode()
+                                    if flag:
+                                        collection[f"{doc_id}_{version}"] = [begin,begin+length,version,doc_id,flag,inner_begin,inner_begin+inner_length]
+                                    else:
+                                        collection[f"{doc_id}_{version}"] = [begin,begin+length,version,doc_id]
+                        last = pointers_map[consumed-record.size:consumed]
+                        last_id = ids_map[id_offset:id_offset+id_length]
+                        
+                        ids_map.close()
+                        pointers_map.close()
+                else:
+                    f.seek(start)
+                    data = f.read(st.st_size-start)
+                    cut = data.rfind(b"\n")+1 #an incomplete line is left for the next read
+                    if cut>0:
+                        consumed = start+cut
+                        lines = [line for line in data[:cut].decode("utf-8").split("\n") if line.strip()!=""]
+                        if len(lines)>0:
+                            collection = from_json_str("{"+",".join(lines)+"}")
+                        last = data[data.rfind(b"\n",0,cut-1)+1:cut]
+
+            uid,data_end = parse_header(header.decode("utf-8"))
+            if data_end!=None and data_end>(self._db._file_size(self._path_data) or 0):
+                if tail: #e.g. the data file of an interrupted shrink swap, the whole collection is read
+                    return None
+                raise ValueError(f'Data file is shorter than the pointers refer to: {self._path_data}')
+            self._modification_uuid = uid
+            if data_end!=None:
+                self._data_end = data_end
+            self._ptr_inode = st.st_ino
+            self._ptr_consumed = consumed
+            self._ptr_tail = last
+            self._ptr_tail_id = last_id
+            self._ptr_stat = (st.st_ino,st.st_size,st.st_mtime_ns)
+
+            return collection
+
+        """
+        Rewrites the pointer file of the collection in another format.
+        Other processes working with the collection should reopen the database after conversion
+
+        :pointer_format: "text" (*.ptr) or "binary" (*.ptb)
 
-            return uid!=self._modification_uuid
+        """
+        def convert_pointers(self,pointer_format):
+            if not pointer_format in POINTER_FORMATS:
+                raise ValueError(f'Unknown pointer format {pointer_format}')
+            if self._is_index() or pointer_format==self._pointer_format:
+                return
+            
+            collection = self._data
+            pointers = list(collection.items())
+            old_path = self._path
+            old_ids = self._path_ids
+            
+            lock = self._lock_collection()
+            try:
+                self._pointer_format = pointer_format
+                self._path = self._get_pointer_path()
+                self._id_refs = {}
+                new_lock = self._lock_collection()
+                try:
+                    self._db._checkpoint_wal()
+                    if os.path.isfile(self._path):
+                        os.remove(self._path)
+                    if os.path.isfile(self._path_ids) and pointer_format=="binary":
+                        os.remove(self._path_ids)
+                    self._write_pointers(pointers,str(uuid.uuid4()),self._get_data_end())
+                    self._db._checkpoint_wal(self._path,self._path_ids)
+                    os.remove(old_path)
+                    if os.path.isfile(old_ids) and pointer_format=="text":
+                        os.remove(old_ids)
+                finally:
+                    self._release_collection(new_lock)
+            finally:
+                self._release_collection(lock)
+
+        def _get_pointer_path(self):
+            if self._pointer_format=="binary":
+                return self._db['_basepath'] +os.sep+self._name+".ptb"
+            else:
+                return self._db['_basepath'] +os.sep+self._name+".ptr"
 
         def _read_collection(self):
             
             #print("read_started")
             
             collection = {}
+            
+            #the data file could be replaced by shrink in another process
+            self._close_data_map()
                 
             if os.path.isfile(self._path):
                     path = Path(self._path)    
                     path.parent.mkdir(parents=True, exist_ok=True) 
 
-                    lock = SoftFileLock(self._path+".lock")
+                    lock = self._db._file_lock(self._path,shared=not os.path.isfile(self._path+".shrink"))
                     try:
                         with  lock.acquire(timeout=self._db['_timeout']):
+                            if os.path.isfile(self._path+".shrink"):
+                                self._finish_shrink()
                             #start_time = time.time()
-                            collection = {} 
-                            with open(self._path,"r", encoding='utf-8') as f:
-                                #content = f.readlines()
-                                #if len(content)>0:
-                                #    uid = content[0].rstrip()
-                                #    self._modification_uuid =uid
-                                #    collection = json.loads(content[1])
-                                #else:
-                                #    collection = {}                         
-                                content = f.readlines()
-                                txt = ",".join(content[1:])
-                                #txt = txt.replace("\n","")
-                                collection = from_json_str("{"+txt+"}")    
-                                uid = content[0].rstrip()
-                                self._modification_uuid =uid    
-
+                            collection = self._read_pointers()
                             #print("decode: --- %s seconds ---" % (time.time() - start_time))     
 
                     except Timeout:
                         raise ValueError(f'Lock collection timeout error: {self._path}')
+            else:
+                self._ptr_consumed = None
+                #the collection could be created or converted by another process in the other format
+                current_format = self._pointer_format
+                for pointer_format in POINTER_FORMATS:
+                    self._pointer_format = pointer_format
+                    if os.path.isfile(self._get_pointer_path()):
+                        self._path = self._get_pointer_path()
+                        return self._read_collection()
+                self._pointer_format = current_format
 
             return collection
         
@@ -1132,7 +3200,7 @@ class Pelican(dict):
                     path = Path(self._path)    
                     path.parent.mkdir(parents=True, exist_ok=True) 
 
-                    lock = SoftFileLock(self._path+".lock")
+                    lock = self._db._file_lock(self._path,shared=True)
                     try:
                         with  lock.acquire(timeout=self._db['_timeout']):
                             with open(self._path,"r", encoding='utf-8') as f:
@@ -1153,22 +3221,128 @@ class Pelican(dict):
             
             collection = {}
                 
-            if os.path.isfile(self._path_id):
+            if os.path.isfile(self._path_id) or os.path.isfile(self._path_id_journal):
                     path = Path(self._path_id)    
                     path.parent.mkdir(parents=True, exist_ok=True) 
 
-                    lock = SoftFileLock(self._path_id+".lock")
+                    lock = self._db._file_lock(self._path_id,shared=True)
                     try:
                         with  lock.acquire(timeout=self._db['_timeout']):
-                            with open(self._path_id, 'rb') as f:
-                                #collection = json.load(f)
-                                collection = pickle.load(f)
+                            self._id_stat = stat_key(self._path_id)
+                            collection,self._idl_consumed = self._load_collection_idx()
 
                     except Timeout:
                         raise ValueError(f'Lock collection timeout error') 
+            else:
+                self._id_stat = None
+                self._idl_consumed = 0
 
             return collection
         
+        """
+        Reads the snapshot (*.id) and replays the journal (*.idl) on top of it.
+        The caller holds the *.id lock
+
+        :returns: last-version dictionary and the consumed size of the journal
+        """
+        def _load_collection_idx(self):
+            collection = {}
+            consumed = 0
+            if os.path.isfile(self._path_id):
+                with open(self._path_id, 'rb') as f:
+                    #collection = json.load(f)
+                    collection = pickle.load(f)
+            if os.path.isfile(self._path_id_journal):
+                consumed = replay_idx_journal(self._path_id_journal,collection)
+            return collection,consumed
+
+        """
+        Replays last-version changes appended to the journal since the previous read
+
+        :returns: list of (document ID, version) changes or None if the snapshot was rewritten (checkpoint) and the whole dictionary must be read
+        """
+        def _read_collection_idx_tail(self):
+            if self._idl_consumed==None:
+                return None
+
+            lock = self._db._file_lock(self._path_id,shared=True)
+            try:
+                with  lock.acquire(timeout=self._db['_timeout']):
+                    if stat_key(self._path_id)!=self._id_stat:
+                        return None
+                    
+                    size = os.path.getsize(self._path_id_journal) if os.path.isfile(self._path_id_journal) else 0
+                    if size<self._idl_consumed:
+                        return None
+                    
+                    changes = []
+                    if size>self._idl_consumed:
+                        self._idl_consumed = replay_idx_journal(self._path_id_journal,self._data_idx,self._idl_consumed,changes)
+                    return changes
+            except Timeout:
+                raise ValueError(f'Lock collection timeout error') 
+
+        """
+        Stores changes of the last-version dictionary.
+        Changes are appended to the journal (*.idl), so the cost depends on the number of changed documents only.
+        When the journal grows beyond IDX_CHECKPOINT_SIZE (or on checkpoint=True) it is merged into the snapshot (*.id)
+
+        :ids: document ID or list of IDs whose last version has changed
+        
+        Arguments:
+        :checkpoint: write the snapshot regardless of the journal size
+
+        """
+        def _write_collection_idx(self,ids,**kwargs):
+            if not isinstance(ids,list):
+                ids = [ids]
+            changes = [(doc_id,self._data_idx.get(doc_id)) for doc_id in ids]
+
+            lock = self._db._file_lock(self._path_id)
+            try:
+                with  lock.acquire(timeout=self._db['_timeout']):
+                    size = self._db._file_size(self._path_id_journal) or 0
+                    #the journal has no records of other processes that weren't read yet
+                    in_sync = size==self._idl_consumed and stat_key(self._path_id)==self._id_stat
+
+                    if len(changes)>0:
+                        size = self._db._file_append(self._path_id_journal,pickle.dumps(changes,pickle.HIGHEST_PROTOCOL))
+            except Timeout:
+                raise ValueError(f'Lock collection timeout error')
+
+            def written():
+                if in_sync:
+                    self._idl_consumed = size
+                if kwargs.get("checkpoint")==True or size>IDX_CHECKPOINT_SIZE:
+                    self._checkpoint_collection_idx()
+            self._db._after_write(written)
+
+        """
+        Writes the snapshot of last versions (*.id) and removes the journal (*.idl)
+        """
+        def _checkpoint_collection_idx(self):
+            lock = self._db._file_lock(self._path_id)
+            try:
+                with  lock.acquire(timeout=self._db['_timeout']):
+                    size = os.path.getsize(self._path_id_journal) if os.path.isfile(self._path_id_journal) else 0
+                    in_sync = size==self._idl_consumed and stat_key(self._path_id)==self._id_stat
+
+                    #the journal may contain records of other processes, so the snapshot is built from the files
+                    collection,consumed = self._load_collection_idx()
+                    with open(self._path_id+".tmp", 'wb') as f:
+                        pickle.dump(collection, f, pickle.HIGHEST_PROTOCOL)
+                    #the log may contain journal writes, it must not replay them after the journal is removed
+                    self._db._checkpoint_wal(self._path_id+".tmp")
+                    os.replace(self._path_id+".tmp",self._path_id)
+                    if os.path.isfile(self._path_id_journal):
+                        os.remove(self._path_id_journal)
+                    
+                    if in_sync:
+                        self._id_stat = stat_key(self._path_id)
+                        self._idl_consumed = 0
+            except Timeout:
+                raise ValueError(f'Lock collection timeout error')
+        
         def _read_collection_maindata(self):
             
             collection = {}
@@ -1176,14 +3350,57 @@ class Pelican(dict):
                 path = Path(self._path_data)    
                 path.parent.mkdir(parents=True, exist_ok=True) 
 
-                lock = SoftFileLock(self._path_data+".lock")
+                lock = self._db._file_lock(self._path_data,shared=True)
                 try:
                     with  lock.acquire(timeout=self._db['_timeout']):
-                        for key,value in self._data_idx.items():
-                                collection[key] = self.get_version(key,value)
+                        collection = self._read_documents(self._data_idx)
                 except Timeout:
                         raise ValueError(f'Lock collection timeout error: {self._path_data}')
             return collection
+
+        """
+        Bulk reading of documents.
+        Pointers are sorted by offset, so the data file is read sequentially through its memory map 
+        and every document is decoded in a single pass (instead of a random seek per document)
+
+        :idx: dictionary {document ID: version}
+
+        :returns: dictionary {document ID: document} in the order of idx
+
+        """
+        def _read_documents(self,idx):
+            data = object.__getattribute__(self,'_data')
+            pointers = []
+            for key,version in idx.items():
+                c = data.get(f"{key}_{version}")
+                if c!=None:
+                    pointers.append(c)
+            if len(pointers)==0:
+                return {}
+
+            pointers.sort(key=operator.itemgetter(0))
+            data_map = self._data_map
+            if data_map==None or len(data_map)<pointers[-1][1]:
+                if self._snapshot!=None: #versions written after the collection was pinned
+                    end = 0 if data_map==None else len(data_map)
+                    pointers = [c for c in pointers if c[1]<=end]
+                    if len(pointers)==0:
+                        return {}
+                else:
+                    data_map = self._map_data_file()
+            if hasattr(mmap,"MADV_SEQUENTIAL"):
+                data_map.madvise(mmap.MADV_SEQUENTIAL)
+
+            decoded = {}
+            loads = self._decode
+            with memoryview(data_map) as view:
+                for c in pointers:
+                    if len(c)>4:
+                        decoded[c[3]] = loads(self._decompress(data_map,c))
+                    else:
+                        decoded[c[3]] = loads(view[c[0]:c[1]])
+            
+            return {key:decoded[key] for key in idx if key in decoded}
         
         def _write_index(self,**kwargs):
             path = Path(self._path)    
@@ -1191,7 +3408,7 @@ class Pelican(dict):
  
             prefix = str(uuid.uuid4())
             
-            lock = SoftFileLock(self._path+".lock")
+            lock = self._db._file_lock(self._path)
             try:
                     with  lock.acquire(timeout=self._db['_timeout']):
                         with open(self._path,"w", encoding='utf-8') as f: 
@@ -1212,7 +3429,7 @@ class Pelican(dict):
             collection ={}
             
             if os.path.isfile(str(path.absolute())):
-                lock = SoftFileLock(str(path.absolute())+".lock")
+                lock = self._db._file_lock(str(path.absolute()),shared=True)
                 try:
                         with  lock.acquire(timeout=self._db['_timeout']):
                             
@@ -1241,20 +3458,80 @@ class Pelican(dict):
         :name: collection name
         :db_instance: database instance
 
+        Arguments:
+        :pointer_format: "text" or "binary" pointer file for a new collection (the format of existing files is detected)
+        :codec: document codec of a new collection, see CODECS (the codec of an existing collection is taken from admin.db)
+        :compression: compression method of a new collection: "zlib", "lzma" or "bz2"
+        :compression_mode: "record" (each document is compressed separately, default) or "block" (documents written together are compressed in blocks)
+        :keep_versions: retention policy, see set_retention
+        :keep_seconds: retention policy, see set_retention
+        :group_commit: single-document inserts of concurrent threads are written in batches (see _update_collection_group)
+
         """
-        def __init__(self,name: str,db_instance):
+        def __init__(self,name: str,db_instance,**kwargs):
             
             self._db = db_instance
             self._name = name    
             self._maindata = {}
             self._maindata_temp ={}
 
+            basepath = db_instance['_basepath'] +os.sep+name
+            if os.path.isfile(basepath+".ptb"):
+                self._pointer_format = "binary"
+            elif os.path.isfile(basepath+".ptr"):
+                self._pointer_format = "text"
+            else:
+                self._pointer_format = kwargs.get("pointer_format",db_instance['_pointer_format'])
+            if not self._pointer_format in POINTER_FORMATS:
+                raise ValueError(f'Unknown pointer format {self._pointer_format}')
+            self._id_refs = {}
+            self._id_refs_inode = None
+            self._path_ids = basepath+".pts"
+
+            if self._is_index():
+                self._codec = "pickle"
+                self._compression = None
+            else:
+                compression = None
+                if kwargs.get("compression")!=None:
+                    compression = {"method":kwargs.get("compression"),"mode":kwargs.get("compression_mode","record")}
+                self._codec,self._compression = db_instance._get_collection_storage(name,kwargs.get("codec"),compression,os.path.isfile(basepath+".dat"))
+            self._encode,self._decode = get_codec(self._codec)
+            self._block_cache = collections.OrderedDict()
+
             if self._is_index():        
                 self._path =db_instance['_basepath'] +os.sep+name+".idx"
             else:    
-                 self._path =db_instance['_basepath'] +os.sep+name+".ptr"
+                 self._path =self._get_pointer_path()
             self._path_id =db_instance['_basepath'] +os.sep+name+".id"
+            self._path_id_journal =db_instance['_basepath'] +os.sep+name+".idl"
             self._path_data =db_instance['_basepath'] +os.sep+name+".dat"
+            self._path_clock =db_instance['_basepath'] +os.sep+name+".clk"
+            self._clock_time = 0
+            self._data_end = None
+            self._data_map = None
+            self._ptr_consumed = None
+            self._ptr_inode = None
+            self._ptr_tail = b""
+            self._ptr_tail_id = b""
+            self._idl_consumed = None
+            self._id_stat = None
+            self._ptr_stat = None
+            self._local = threading.local()
+            self._group_commit = kwargs.get("group_commit",db_instance['_group_commit'])
+            self._group_queue = []
+            self._group_queue_lock = threading.Lock()
+            self._group_flush_lock = threading.Lock()
+            self._batch_end = None
+            self._snapshot = None
+            self._sorted_source = None
+            self._sorted_keys = []
+            self._sorted_ids = []
+            self._column_fields = None
+            self._columns = None
+
+            if kwargs.get("keep_versions")!=None or kwargs.get("keep_seconds")!=None:
+                self.set_retention(keep_versions=kwargs.get("keep_versions"),keep_seconds=kwargs.get("keep_seconds"))
             
             
                    
@@ -1262,44 +3539,244 @@ class Pelican(dict):
             
             self._next_id = None        
         
-        def shrink(self):
+        """
+        Compacts the collection: versions of live documents are copied into a new data file, deleted documents are dropped.
+        Documents are streamed into the new file in batches without locking the collection,
+        then writes made during the copy are caught up and the files are replaced by rename under the collection lock.
+        Old versions are dropped according to the retention policy (see set_retention).
+        Does nothing if the collection is being compacted by another thread or process
+
+        Arguments:
+        :background: compact in a background thread, the started thread is returned
+
+        """
+        def shrink(self,**kwargs):
+            if kwargs.get("background")==True:
+                thread = threading.Thread(target=self._shrink)
+                thread.start()
+                return thread
+            self._shrink()
+
+        @collection_operation
+        def _shrink(self):
+            if not os.path.isfile(self._path_data) or not os.path.isfile(self._path):
+                return
+
+            shrink_lock = self._db._file_lock(self._path_data+".shrink")
+            try:
+                shrink_lock.acquire(timeout=0)
+            except Timeout:
+                return
             
-            def updater():
-                new_data = {}
+            tmp_data = self._path_data+".shrink"
+            tmp_path = self._path+".shrink"
+            tmp_ids = self._path_ids+".shrink"
+            tmp_clock = self._path_clock+".shrink"
+            try:
+                retention = self._db._get_retention(self._name)
 
-                dbytes = b''
-                _begin = 0  
-                datastr= ""
+                lock = self._db._file_lock(self._path)
+                try:
+                    with  lock.acquire(timeout=self._db['_timeout']):
+                        if os.path.isfile(tmp_path):
+                            self._finish_shrink()
+                        for path in (tmp_data,tmp_path,tmp_ids,tmp_clock): #files of an interrupted copy
+                            if os.path.isfile(path):
+                                os.remove(path)
+                        
+                        #documents in the data file up to start are copied, the rest is caught up at the swap
+                        self._sync_locked()
+                        idx = self._data_idx
+                        lookup = clock_lookup(self._read_clock())
+                        now = time.time()
+                        live = sorted([(key,value) for key,value in object.__getattribute__(self,'_data').items() 
+                                       if value[3] in idx and self._retained(value,idx[value[3]],retention,lookup,now)],key=lambda item: item[1][0])
+                        ptr_inode = self._ptr_inode
+                        with open(self._path_data, "rb") as f:
+                            st = os.fstat(f.fileno())
+                            data_inode = st.st_ino
+                            start = st.st_size
+                            source = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) if start>0 else None
+                except Timeout:
+                    raise ValueError(f'Lock collection timeout error: {self._path}')
 
-                for key,value in self._data.items():
-                    
-                    if value[3] in self._data_idx:
-                        _version =  value[2]
-                        in_file = open(self._path_data, "rb") 
-                        in_file.seek(value[0])
-                        bytes = in_file.read(value[1]) 
+                new_data = {}
+                with open(tmp_data,"wb") as out:
+                    batch = []
+                    size = 0
+                    for n,(key,value) in enumerate(live):
+                        batch.append((key,value))
+                        size+=value[1]-value[0]
+                        #batches don't mix periods of the version clock, so blocks don't make old versions look newer
+                        if size>=SHRINK_BATCH_SIZE or n==len(live)-1 or lookup(value)!=lookup(live[n+1][1]):
+                            #documents are decompressed and packed again, so blocks keep only live documents
+                            dbytes,locations = self._pack_records([self._read_record(value,source) for key,value in batch],out.tell())
+                            out.write(dbytes)
+                            for (key,value),location in zip(batch,locations):
+                                new_data[key] = location[:2]+[value[2],value[3]]+location[2:]
+                            batch = []
+                            size = 0
+                if source!=None:
+                    source.close()
 
-                        dbytes+= bytes
+                try:
+                    with  lock.acquire(timeout=self._db['_timeout']):
+                        data_key = stat_key(self._path_data)
+                        if self._ptr_inode!=ptr_inode or data_key==None or data_key[0]!=data_inode or not self._refresh_tail():
+                            return #the collection was rewritten by another process
+                        
+                        #catch up writes made during the copy
+                        with open(self._path_data, "rb") as f, open(tmp_data,"ab") as out:
+                            shift = out.tell()-start
+                            f.seek(start)
+                            while True:
+                                chunk = f.read(SHRINK_BATCH_SIZE)
+                                if not chunk:
+                                    break
+                                out.write(chunk)
+                            end = out.tell()
                         
-                        new_data[key] =[_begin,_begin+len(bytes),_version,value[3]]
-                        if datastr=="":
-                            datastr = format_datastr(key,new_data[key])
-                        else:     
-                            datastr +="\n"+ format_datastr(key,new_data[key])
+                        idx = self._data_idx
+                        for key,value in object.__getattribute__(self,'_data').items():
+                            if value[0]>=start:
+                                new_data[key] = [value[0]+shift,value[1]+shift]+value[2:]
+
+                        #version clock of the new data file: a copied document keeps the time of its old position
+                        clock = []
+                        level = 0
+                        for key,value in live:
+                            written = lookup(value)
+                            if written==None:
+                                break
+                            level = max(level,written)
+                            new_end = new_data[key][1]
+                            if len(clock)>0 and (clock[-1][0]==level or clock[-1][1]==new_end):
+                                clock[-1] = (level,new_end)
+                            else:
+                                clock.append((level,new_end))
+                        for written,clock_end in self._read_clock():
+                            if clock_end>start:
+                                clock.append((max(level,written),clock_end+shift))
+                        with open(tmp_clock,"wb") as f:
+                            f.write(b"".join(CLOCK_RECORD.pack(*record) for record in clock))
+
+                        new_data = {key:value for key,value in new_data.items() if value[3] in idx}
 
-                        _begin+=len(bytes)
+                        id_refs = {}
+                        self._write_pointers(list(new_data.items()),str(uuid.uuid4()),end,path=tmp_path,path_ids=tmp_ids,id_refs=id_refs)
+                        
+                        #the log must not replay writes at the offsets of the old files
+                        self._db._checkpoint_wal(tmp_data,tmp_ids,tmp_clock,tmp_path)
+
+                        #the pointer file is replaced last: its new version without the new data file means an interrupted swap (see _finish_shrink)
+                        os.replace(tmp_data,self._path_data)
+                        if os.path.isfile(tmp_ids):
+                            os.replace(tmp_ids,self._path_ids)
+                        os.replace(tmp_clock,self._path_clock)
+                        os.replace(tmp_path,self._path)
+                        
+                        self._data = new_data
+                        self._id_refs = id_refs
+                        key = stat_key(self._path_ids)
+                        self._id_refs_inode = None if key==None else key[0]
+                        self._data_end = end
+                        #the old map isn't closed: reads in progress in other threads use it, the old file stays valid while it is mapped
+                        self._data_map = None
+                        self._block_cache = collections.OrderedDict()
+                except Timeout:
+                    raise ValueError(f'Lock collection timeout error: {self._path}')
                 
-                return [],dbytes,[],len(dbytes),datastr        
-                     
-            doc_id = self._update_collection(updater, shrink = True)
+                self._write_collection_idx([], checkpoint = True)
+            finally:
+                if os.path.isfile(tmp_data) or not os.path.isfile(tmp_path): #an interrupted swap is left to _finish_shrink
+                    for path in (tmp_path,tmp_ids,tmp_clock,tmp_data):
+                        if os.path.isfile(path):
+                            os.remove(path)
+                shrink_lock.release()
 
-            if doc_id == -1:
-                        raise ValueError('Write failed')
+        """
+        Completes the file replacement of a shrink interrupted after the data file was replaced. 
+        The caller holds the collection lock
+        """
+        def _finish_shrink(self):
+            if not os.path.isfile(self._path_data+".shrink"):
+                if os.path.isfile(self._path_ids+".shrink"):
+                    os.replace(self._path_ids+".shrink",self._path_ids)
+                if os.path.isfile(self._path_clock+".shrink"):
+                    os.replace(self._path_clock+".shrink",self._path_clock)
+                os.replace(self._path+".shrink",self._path)
+
+        """
+        Checks whether shrink keeps a version of a live document
+
+        :value: pointer of the version
+        :last_version: last version of the document
+        :retention: retention policy or None to keep all versions
+        :lookup: write time lookup of the version clock (see clock_lookup)
+        :now: time of the shrink
+
+        """
+        def _retained(self,value,last_version,retention,lookup,now):
+            if retention==None or value[2]==last_version:
+                return True
+            if retention.get("keep_versions")!=None and value[2]>last_version-retention["keep_versions"]:
+                return True
+            if retention.get("keep_seconds")!=None:
+                written = lookup(value)
+                return written==None or written>=now-retention["keep_seconds"]
+            return False
+
+        """
+        Appends a record to the version clock (*.clk) at most once per CLOCK_INTERVAL. 
+        The clock dates versions for the retention policy. The caller holds the collection lock
+
+        :end: size of the data file after a write
+
+        """
+        def _tick(self,end):
+            now = time.time()
+            if now-self._clock_time>=CLOCK_INTERVAL:
+                self._db._file_append(self._path_clock,CLOCK_RECORD.pack(now,end))
+                self._clock_time = now
+
+        """
+        Reads the version clock
+
+        :returns: list of (time, data file size) records sorted by size
+        """
+        def _read_clock(self):
+            if not os.path.isfile(self._path_clock):
+                return []
+            with open(self._path_clock,"rb") as f:
+                data = f.read()
+            data = data[:len(data)-len(data)%CLOCK_RECORD.size]
+            return sorted(CLOCK_RECORD.iter_unpack(data),key=operator.itemgetter(1))
+
+        """
+        Sets the version retention policy applied by shrink, the policy is recorded in admin.db.
+        Besides the last version, versions are kept if they are among the last keep_versions versions 
+        or were written less than keep_seconds ago. Without arguments all versions are kept
+
+        Arguments:
+        :keep_versions: number of the last versions kept, 1 keeps only the last version
+        :keep_seconds: age of the versions kept in seconds. 
+        The write time of a version is known with the accuracy of CLOCK_INTERVAL, a version is never dropped earlier
+
+        """
+        def set_retention(self,**kwargs):
+            retention = None
+            if kwargs.get("keep_versions")!=None or kwargs.get("keep_seconds")!=None:
+                retention = {"keep_versions":kwargs.get("keep_versions"),"keep_seconds":kwargs.get("keep_seconds")}
+            check_retention(retention)
+            self._db._set_retention(self._name,retention)
             
-        
+        @collection_operation
         def fast_insert(self,document, **kwargs):
             
             collection = self._data
+            document = unwrap_view(document)
+            if self._db._RAM == True and self._maindata.get(document.get("_id")) is document:
+                document = dict(document) #the stored document may be shared with snapshots (see _pin_snapshot), it is replaced, not changed
 
             self._recording = True
 
@@ -1326,54 +3803,54 @@ class Pelican(dict):
                     
                     document["_version"]  = _version
                     
-                    datastr = ""
-                    
                     begin = 0
 
                     if 'session' in kwargs: #updating with transaction
                         session = kwargs['session']
                         self._maindata_temp[doc_id] = document
                         if self._name in session._operations_add:
-                             for line in session._operations_add[self._name]:
-                                  begin = line[3]
-                                  #_doc_id = line[0]
-                                  #last_version = self._data_idx[_doc_id]
-                                  #begin = self._data[_doc_id+"_"+str(last_version)][1]
-
-
-                    if os.path.exists(self._path_data) and begin==0:
-                        in_file = open(self._path_data, "rb") 
-                        data = in_file.read() 
-                        begin = len(data)
-                        in_file.close()
+                             #the document follows the data of the previous operation of the session
+                             begin = session._operations_add[self._name][-1][3]
+
+
+                    if begin==0:
+                        begin = self._get_data_end()
                     
-                    dbytes = pickle.dumps(document)
+                    dbytes,locations = self._pack_records([self._encode(document)],begin)
 
-                    self._data[doc_id+"_"+str(_version)] =[begin,begin+len(dbytes),_version,doc_id]
-                    datastr=format_datastr(doc_id+"_"+str(_version),self._data[doc_id+"_"+str(_version)])
+                    self._data[doc_id+"_"+str(_version)] =locations[0][:2]+[_version,doc_id]+locations[0][2:]
+                    pointers=[(doc_id+"_"+str(_version),self._data[doc_id+"_"+str(_version)])]
                     self._data_idx[doc_id] = _version
                     
                     if self._db._RAM == True:
                         self._maindata[doc_id] = document   
                     
-                    return doc_id,dbytes,_version,begin+len(dbytes),datastr
+                    return doc_id,dbytes,_version,begin+len(dbytes),pointers
                     
 
+            self._check_unique_values([document])
+
             if 'session' in kwargs: #updating with transaction
                     session = kwargs['session']
-                    if not kwargs.get("NoIndex") == True and (kwargs.get("upsert")==True or kwargs.get("update")==True):  
+                    if kwargs.get("upsert")==True or kwargs.get("update")==True:  
                         cdocument = [copy.deepcopy(document)]
-                        session._related_delete.append((self._name,cdocument))
+                        if not kwargs.get("NoIndex") == True:
+                            session._related_delete.append((self._name,cdocument))
+                        else:
+                            session._planned_delete.append((self._name,cdocument))
 
-                    doc_id,bytes,version,end,datastr = self._update_collection_memory(updater,session)
+                    doc_id,bytes,version,end,pointers = self._update_collection_memory(updater,session)
 
                     if not self._name in session._operations_add:
                              session._operations_add[self._name] = []
                         
-                    session._operations_add[self._name].append([doc_id,bytes,version,end,datastr])
+                    session._operations_add[self._name].append([doc_id,bytes,version,end,pointers])
+                    self._columns = None
                     
                     if not kwargs.get("NoIndex") == True:  
                         session._related_add.append((self._name,[document]))
+                    else:
+                        session._planned_add.append((self._name,[document]))
                         
             else:   #update directly 
                     
@@ -1383,14 +3860,20 @@ class Pelican(dict):
                         else:   
                             self._delete_values_from_unique_indexes([document]) 
                             self._delete_values_from_text_indexes([document]) 
+                    elif kwargs.get("upsert")==True or kwargs.get("update")==True:
+                        self._delete_values_from_unique_indexes([document],NoIndex=True)
                     
-                    doc_id = self._update_collection(updater)
+                    if self._group_commit:
+                        doc_id = self._update_collection_group(updater)
+                    else:
+                        doc_id = self._update_collection(updater)
 
                     self._recording = False
 
                     if doc_id == -1:
                         raise ValueError('Write failed')
                     else:
+                        self._add_columns([document])
                         #loop = asyncio.get_event_loop()
                         #hr = threading.Thread(target=index_worker, args=(2,))
                         #thr.start()
@@ -1402,6 +3885,8 @@ class Pelican(dict):
                                 self._add_values_to_unique_indexes([document])
                                 self._add_values_to_text_indexes([document])
                                 #self._db._add_value_to_subscriptions(self._name,doc_id)
+                        else:
+                            self._add_values_to_unique_indexes([document],NoIndex=True)
 
             return doc_id     
 
@@ -1416,6 +3901,7 @@ class Pelican(dict):
 
 
         """
+        @collection_operation
         def fast_delete(self,document, **kwargs):
             
             collection = self._data
@@ -1431,6 +3917,8 @@ class Pelican(dict):
                 
                 
                 self._data_idx.pop(doc_id,None)
+                if self._db._RAM == True:
+                    self._maindata.pop(doc_id,None)
                 
                 return doc_id,None,None,None,None
                     
@@ -1438,14 +3926,17 @@ class Pelican(dict):
             if 'session' in kwargs: #updating with transaction
                     session = kwargs['session']
                     
-                    doc_id,dbytes,_version,end,datastr = self._update_collection_memory(updater,session)
+                    doc_id,dbytes,_version,end,pointers = self._update_collection_memory(updater,session)
                     if not self._name in session._operations_replace:
                         session._operations_replace[self._name] = []
 
-                    session._operations_replace[self._name].append([doc_id,dbytes,_version,end,datastr])
+                    session._operations_replace[self._name].append([doc_id,dbytes,_version,end,pointers])
+                    self._columns = None
 
                     if not kwargs.get("NoIndex") == True:  
-                        session._related_delete.append((self._name,document,doc_id))
+                        session._related_delete.append((self._name,[document]))
+                    else:
+                        session._planned_delete.append((self._name,[document]))
                     
                     return doc_id
                     
@@ -1457,6 +3948,7 @@ class Pelican(dict):
                     if doc_id == -1:
                         raise ValueError('Write failed')
                     else:
+                        self._remove_columns([doc_id])
                         
                         if not kwargs.get("NoIndex") == True: 
                             if self._db.queue!=None:
@@ -1464,9 +3956,12 @@ class Pelican(dict):
                             else:    
                                 self._delete_values_from_unique_indexes([document])
                                 self._delete_values_from_text_indexes([document])
+                        else:
+                            self._delete_values_from_unique_indexes([document],NoIndex=True)
                         #    self._add_value_to_text_indexes(document)
                         
                         return doc_id                   
+        @collection_operation
         def delete_many(self, dataset, **kwargs) -> str:
                 
             ids = []
@@ -1495,6 +3990,8 @@ class Pelican(dict):
                     ids.append(doc_id)
 
                     self._data_idx.pop(doc_id,None)
+                    if self._db._RAM == True:
+                        self._maindata.pop(doc_id,None)
 
                     
                 return ids,None,None,None,None
@@ -1507,13 +4004,14 @@ class Pelican(dict):
                 session = kwargs['session']
                 
                 #res,search,no_search_list_file = self._update_collection_memory(updater,session)
-                doc_id,dbytes,_version,end,datastr = self._update_collection_memory(updater,session)
+                doc_id,dbytes,_version,end,pointers = self._update_collection_memory(updater,session)
 
                 if not self._name in session._operations_replace:
                     session._operations_replace[self._name] =[]  
 
                 
-                session._operations_replace[self._name].append([doc_id,dbytes,_version,end,datastr])
+                session._operations_replace[self._name].append([doc_id,dbytes,_version,end,pointers])
+                self._columns = None
 
                 if not kwargs.get("NoIndex") ==True:
                      pass
@@ -1527,6 +4025,7 @@ class Pelican(dict):
                     raise ValueError('Write failed')
  
                 self._recording = False
+                self._remove_columns([document.get("_id") for document in documents])
                 
                 if not kwargs.get("NoIndex") ==True:
                     
@@ -1535,11 +4034,14 @@ class Pelican(dict):
                     else:     
                         self._delete_values_from_unique_indexes(documents)
                         self._delete_values_from_text_indexes(documents)
+                else:
+                    self._delete_values_from_unique_indexes(documents,NoIndex=True)
 
                 return res   
                 
             return None    
 
+        @collection_operation
         def insert_many(self,documents, **kwargs):
             if len(documents)==0:
                 raise ValueError('No documents in list')
@@ -1547,6 +4049,10 @@ class Pelican(dict):
             #start_time = time.time()
             collection = self._data
             #print("insert_many - read collection: --- %s seconds ---" % (time.time() - start_time))
+            documents = [unwrap_view(document) for document in documents]
+            if self._db._RAM == True:
+                maindata = self._maindata
+                documents = [dict(document) if maindata.get(document.get("_id")) is document else document for document in documents]
 
             self._recording = True
 
@@ -1555,20 +4061,8 @@ class Pelican(dict):
             if 'session' in kwargs: #updating with transaction
                 session = kwargs['session']
                 if self._name in session._operations_add:
-                        for line in session._operations_add[self._name]:
-                            begin = line[3] 
-                            #_doc_id = line[0]
-                            #last_version = self._data_idx[_doc_id]
-                            #begin = self._data[_doc_id+"_"+str(last_version)][1]
+                        begin = session._operations_add[self._name][-1][3]
 
-            #start_time = time.time()
-            
-            if os.path.exists(self._path_data) and begin==0:
-                in_file = open(self._path_data, "rb") 
-                data = in_file.read() 
-                begin = len(data)
-                in_file.close()
-            
             #print("getting begin: --- %s seconds ---" % (time.time() - start_time))
              
 
@@ -1577,11 +4071,11 @@ class Pelican(dict):
                 ids = []
                 versions = []
 
-                dbytes = b''
-
-                _begin = begin  
+                dbytes = bytearray()
+                records = []
 
-                datastr= ""
+                start = begin if begin!=0 else self._get_data_end()
+                _begin = start
 
                 #t1 = 0
                 #t2 = 0
@@ -1589,7 +4083,7 @@ class Pelican(dict):
                 #t4 = 0
                 #t5 = 0
                     
-                liststr=[]    
+                pointers=[]    
                 for document in documents:    
                     #start_time = time.time()
                     if "_id" in document:
@@ -1617,13 +4111,16 @@ class Pelican(dict):
 
                     #start_time = time.time()
                     
-                    bytes = pickle.dumps(document,pickle.HIGHEST_PROTOCOL)
+                    bytes = self._encode(document)
 
                     #t2+=(time.time() - start_time)
 
                     #start_time = time.time()
                     
-                    dbytes+= bytes
+                    if self._compression==None:
+                        dbytes+= bytes
+                    else:
+                        records.append(bytes)
 
                     #t3+=(time.time() - start_time)
                     #start_time = time.time()
@@ -1635,7 +4132,7 @@ class Pelican(dict):
                     #    datastr = format_datastr(doc_id+"_"+str(_version),value)
                     #else:     
                     #    datastr +="\n"+ format_datastr(doc_id+"_"+str(_version),value)
-                    liststr.append(format_datastr(doc_id+"_"+str(_version),value))    
+                    pointers.append((full_id,value))    
 
                     #t4+=(time.time() - start_time)
                     #start_time = time.time()
@@ -1653,32 +4150,46 @@ class Pelican(dict):
                     if 'session' in kwargs:
                          self._maindata_temp[doc_id] = document
 
-                datastr = "\n".join(liststr)
                 #print("updater 1: --- %s seconds ---" % (t1))
                 #print("updater 2: --- %s seconds ---" % (t2))
                 #print("updater 3: --- %s seconds ---" % (t3))
                 #print("updater 3: --- %s seconds ---" % (t4))
                 #print("updater 3: --- %s seconds ---" % (t5))
+
+                if self._compression!=None: #uncompressed locations are replaced by locations of compressed records or blocks
+                    dbytes,locations = self._pack_records(records,start)
+                    for (full_id,value),location in zip(pointers,locations):
+                        value[0:2] = location[:2]
+                        value.extend(location[2:])
+                    _begin = start+len(dbytes)
                     
-                return ids,dbytes,versions,_begin,datastr
+                return ids,dbytes,versions,_begin,pointers
                     
 
+            self._check_unique_values(documents)
+
             if 'session' in kwargs: #updating with transaction
-                    if not kwargs.get("NoIndex") == True and (kwargs.get("upsert")==True or kwargs.get("update")==True):  
+                    session = kwargs['session']
+                    if kwargs.get("upsert")==True or kwargs.get("update")==True:  
                         
                         cdocuments = copy.deepcopy(documents)
-                        session._related_delete.append((self._name,cdocuments))
+                        if not kwargs.get("NoIndex") == True:
+                            session._related_delete.append((self._name,cdocuments))
+                        else:
+                            session._planned_delete.append((self._name,cdocuments))
 
-                    session = kwargs['session']
-                    doc_id,dbytes,_version,end,datastr = self._update_collection_memory(updater,session)
+                    doc_id,dbytes,_version,end,pointers = self._update_collection_memory(updater,session)
                     
                     if not self._name in session._operations_add:
                         session._operations_add[self._name] = []
-                    session._operations_add[self._name].append([doc_id,dbytes,_version,end,datastr] )
+                    session._operations_add[self._name].append([doc_id,dbytes,_version,end,pointers] )
+                    self._columns = None
 
                     
                     if not kwargs.get("NoIndex") == True:  
                         session._related_add.append((self._name,documents))
+                    else:
+                        session._planned_add.append((self._name,documents))
             else:   #update directly 
                     if not kwargs.get("NoIndex") == True and (kwargs.get("upsert")==True or kwargs.get("update")==True): 
                         
@@ -1689,6 +4200,8 @@ class Pelican(dict):
                         else:  
                             self._delete_values_from_unique_indexes(cdocuments) 
                             self._delete_values_from_text_indexes(documents)
+                    elif kwargs.get("upsert")==True or kwargs.get("update")==True:
+                        self._delete_values_from_unique_indexes(documents,NoIndex=True)
 
                     doc_id = self._update_collection(updater)
 
@@ -1697,6 +4210,7 @@ class Pelican(dict):
                     if doc_id == -1:
                         raise ValueError('Write failed')
                     else:
+                        self._add_columns(documents)
                         
                         if not kwargs.get("NoIndex") == True:   
                             if self._db.queue!=None:
@@ -1704,6 +4218,8 @@ class Pelican(dict):
                             else: 
                                 self._add_values_to_unique_indexes(documents)
                                 self._add_values_to_text_indexes(documents)
+                        else:
+                            self._add_values_to_unique_indexes(documents,NoIndex=True)
 
                         #    self._add_value_to_text_indexes(documents)
 
@@ -1720,10 +4236,10 @@ class Pelican(dict):
             
             collection = self._data
 
-            doc_id,dbytes,_version,end,datastr = updater() 
+            doc_id,dbytes,_version,end,pointers = updater() 
             
             gc.enable() 
-            return doc_id,dbytes,_version,end,datastr
+            return doc_id,dbytes,_version,end,pointers
         
         def _update_collection(self,updater: Callable[[Dict[int, Mapping]], None],**kwargs):
             
@@ -1735,61 +4251,37 @@ class Pelican(dict):
             path.parent.mkdir(parents=True, exist_ok=True) 
 
             prefix = str(uuid.uuid4())
-            
-            #starting updater code
-            doc_id,dbytes,_version,end,datastr = updater() 
-            
 
-            gc.enable()    
-
-            if kwargs.get("shrink") == True:
-                os.remove(self._path)
-                os.remove(self._path_data)
-                self._modification_uuid=None
-              
-            lock = SoftFileLock(self._path+".lock")
+            lock = self._db._file_lock(self._path)
 
             
             try:
                 with  lock.acquire(timeout=self._db['_timeout']):
+                    try:
+                        #writes of other processes are applied first, so new versions and data offsets don't collide with them
+                        self._sync_locked()
                         
-                    try:    
-                        
-                        #Writing a pointer file (*.ptr) with a modification prefix
-                        prefix_updated=False
-                        with open(self._path,"a", encoding='utf-8') as f: 
-                                    
-                            if self._modification_uuid==None:
-                                f.write(prefix)
-                                f.write("\n")
-                                self._modification_uuid=prefix
-                                prefix_updated=True
-                                
-
-                            f.write(datastr)
-                            f.write("\n") 
+                        #starting updater code
+                        doc_id,dbytes,_version,end,pointers = updater() 
+                    finally:
+                        gc.enable()    
                         
+                    def write():
+                        #write binary data-file. The data is written before the pointers referring to it (see _read_pointers)
+                        self._db._file_append(self._path_data,dbytes)
 
-                        #update prefix if needed
-                        if not prefix_updated:
-                            with open(self._path,"r+", encoding='utf-8') as f:
-                                text =f.read(36)
-                                f.seek(0)
-                                f.write(prefix)
-                                self._modification_uuid=prefix                                    
+                        #Writing a pointer file (*.ptr/*.ptb) with a modification prefix
+                        self._write_pointers(pointers,prefix,end)
 
                         
-                        #write last version dictionary                                
-                        with open(self._path_id, 'wb') as f:
-                            pickle.dump(self._data_idx, f, pickle.HIGHEST_PROTOCOL)            
-                        
-                        
-                        #write binary data-file
-                        out_file = open(self._path_data, "ab")
-                        out_file.write(dbytes)
-                        out_file.close()   
+                        #write last version changes                                
+                        self._write_collection_idx(doc_id)
                         
+                        self._data_end = end
+                        self._tick(end)
 
+                    try:    
+                        self._db._logged(write)
                     except Exception:
                         raise ValueError(f'Write collections error') 
                         
@@ -1802,6 +4294,85 @@ class Pelican(dict):
             return  doc_id               
             
             
+        """
+        Group commit: the updater is queued and the first waiting thread writes all queued updaters at once,
+        with one collection lock acquisition and one append to every file. 
+        Returns when the batch containing the updater is written
+
+        :updater: function preparing a document (see _update_collection)
+
+        :returns: document ID
+
+        """
+        def _update_collection_group(self,updater):
+            request = [updater,None,None,threading.Event()] #updater, document ID, exception, written
+            with self._group_queue_lock:
+                self._group_queue.append(request)
+
+            with self._group_flush_lock:
+                if not request[3].is_set():
+                    with self._group_queue_lock:
+                        batch = self._group_queue
+                        self._group_queue = []
+                    self._write_group(batch)
+
+            if request[2]!=None:
+                raise request[2]
+            return request[1]
+
+        """
+        Writes a batch of queued updaters (see _update_collection_group), an updater error fails only its own request
+        """
+        def _write_group(self,batch):
+            prefix = str(uuid.uuid4())
+            error = None
+            try:
+                lock = self._db._file_lock(self._path)
+                with  lock.acquire(timeout=self._db['_timeout']):
+                    self._sync_locked()
+
+                    ids = []
+                    chunks = []
+                    pointers = []
+                    self._batch_end = self._get_data_end()
+                    try:
+                        for request in batch:
+                            try:
+                                doc_id,dbytes,_version,end,request_pointers = request[0]()
+                            except Exception as e:
+                                request[2] = e
+                                continue
+                            request[1] = doc_id
+                            ids.append(doc_id)
+                            chunks.append(dbytes)
+                            pointers.extend(request_pointers)
+                            self._batch_end = end
+                    finally:
+                        end = self._batch_end
+                        self._batch_end = None
+
+                    def write():
+                        self._db._file_append(self._path_data,b"".join(chunks))
+                        self._write_pointers(pointers,prefix,end)
+                        self._write_collection_idx(ids)
+                        self._data_end = end
+                        self._tick(end)
+
+                    if len(pointers)>0:
+                        try:
+                            self._db._logged(write)
+                        except Exception:
+                            raise ValueError(f'Write collections error') 
+            except Timeout:
+                error = ValueError(f'Lock collection timeout error: {self._path}')
+            except Exception as e:
+                error = e
+            finally:
+                for request in batch:
+                    if error!=None and request[2]==None:
+                        request[2] = error
+                    request[3].set()
+
         def _update_collection_without_bytes(self,updater: Callable[[Dict[int, Mapping]], None]):
             
             collection = self._data
@@ -1811,9 +4382,9 @@ class Pelican(dict):
 
             prefix = str(uuid.uuid4())
 
-            doc_id,dbytes,_version,end,datastr = updater() 
+            doc_id,dbytes,_version,end,pointers = updater() 
         
-            lock = SoftFileLock(self._path_id+".lock")
+            lock = self._db._file_lock(self._path)
             try:
                 with  lock.acquire(timeout=self._db['_timeout']):
                     try:    
@@ -1824,15 +4395,74 @@ class Pelican(dict):
                         #    self._modification_uuid=prefix
                         #    f.write(json.dumps(self._data)) 
 
-                        with open(self._path_id, 'wb') as f:
-                            pickle.dump(self._data_idx, f, pickle.HIGHEST_PROTOCOL)     
+                        def write():
+                            self._write_collection_idx(doc_id)
+                            self._update_prefix(prefix)
+                        self._db._logged(write)
                         
                         return  doc_id               
                     except:
                         raise ValueError(f'Write collection {self._data_idx} error') 
             except Timeout:
                     raise ValueError(f'Lock collection timeout error')     
+
+        """
+        Writes a new modification prefix without appending pointers (deletion), so other processes notice the change.
+        The caller holds the collection lock
+
+        :prefix: modification prefix
+
+        """
+        def _update_prefix(self,prefix):
+            if os.path.isfile(self._path):
+                self._db._file_write(self._path,0,prefix_bytes(self._path,prefix))
+
+                def written():
+                    key = stat_key(self._path)
+                    if key[1]==self._ptr_consumed:
+                        self._modification_uuid=prefix
+                        self._ptr_stat = key
+                    else:
+                        self._modification_uuid=None
+                self._db._after_write(written)
             
+        """
+        Pins the state of the collection for a snapshot: a read-only copy sharing the pointers, 
+        with its own last versions, documents (RAM mode) and memory map of the data file. 
+The documents themselves are shared: writes replace stored documents instead of changing them. 
+        Pointers of existing versions never change and shrink replaces the pointer dictionary and the data file, 
+        so the copy stays valid while the collection is written
+
+        :snapshot: snapshot of the database (see DBSnapshot)
+
+        :returns: pinned collection
+
+        """
+        def _pin_snapshot(self,snapshot):
+            self._data #brings the collection up to date
+
+            pinned = object.__new__(type(self))
+            lock = self._db._file_lock(self._path,shared=True)
+            try:
+                with  lock.acquire(timeout=self._db['_timeout']):
+                    pinned.__dict__.update(self.__dict__)
+                    pinned._data_idx = dict(self._data_idx)
+                    pinned._maindata = dict(object.__getattribute__(self,'_maindata'))
+                    pinned._maindata_temp = dict(self._maindata_temp)
+                    pinned._data_map = None
+                    if os.path.isfile(self._path_data) and os.path.getsize(self._path_data)>0:
+                        with open(self._path_data, "rb") as f:
+                            pinned._data_map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            except Timeout:
+                raise ValueError(f'Lock collection timeout error: {self._path}')
+
+            #the pinned state is never checked against the files
+            pinned._recording = True
+            pinned._snapshot = snapshot
+            pinned._block_cache = collections.OrderedDict()
+            pinned._local = threading.local()
+            return pinned
+
         """
         Lock collection file
         
@@ -1842,7 +4472,7 @@ class Pelican(dict):
             path = Path(self._path)    
             path.parent.mkdir(parents=True, exist_ok=True) 
         
-            lock = SoftFileLock(self._path+".lock")
+            lock = self._db._file_lock(self._path)
             lock.acquire()
 
             return lock
@@ -1866,14 +4496,81 @@ class Pelican(dict):
             self.__dict__[key]=self.Collection(key,self)
             return self.__dict__[key]
         
-    def _get_unique_indexes(self):
+    """
+    Writes admin.db. The caller holds the admin.db lock.
+    The file is replaced, so readers never see a partial file and other processes notice the change by stat (see _index_catalog)
+
+    :admin: contents of admin.db
+
+    """
+    def _write_admin(self,admin):
+        path = self.__dict__['_basepath']+os.sep+"admin.db"
+        with open(path+".tmp","w", encoding='utf-8') as f:
+            json.dump(admin,f)
+        os.replace(path+".tmp",path)
+        self.__dict__['_catalog'] = None
+
+    """
+    Index catalog: hash, text and sorted indexes of every collection. 
+    admin.db is read again only when it has been changed (checked by stat), 
+    indexes registered by other processes are added to the index settings of the database
+
+    :returns: dictionary {collection name: {"hash": {index name: settings}, "text": {...}, "sorted": {...}}}
+
+    """
+    def _index_catalog(self):
+        path = self.__dict__['_basepath']+os.sep+"admin.db"
+        key = stat_key(path)
+        catalog = self.__dict__['_catalog']
+        if catalog!=None and key==self.__dict__['_catalog_stat']:
+            return catalog
+
+        admin = {}
+        lock = self._file_lock(str(Path(path).absolute()),shared=True)
+        try:
+            with  lock.acquire(timeout=self.__dict__['_timeout']):
+                key = stat_key(path)
+                if key!=None:
+                    with open(path,"r", encoding='utf-8') as f:
+                        admin = json.load(f)
+        except Timeout:
+            raise ValueError(f'Lock admin.db timeout error')
+
+        catalog = {}
+        for kind,section in (("hash","hash_indexes"),("text","text_indexes"),("sorted","sorted_indexes")):
+            for name,settings in admin.get(section,{}).items():
+                catalog.setdefault(settings["collection"],{"hash":{},"text":{},"sorted":{}})[kind][name] = settings
+                self.__dict__[section].setdefault(name,settings)
+                self.__dict__['db_indexes'].setdefault(name,settings)
+
+        self.__dict__['_catalog'] = catalog
+        self.__dict__['_catalog_stat'] = key
+        return catalog
+
+    """
+    Indexes of a collection from the index catalog (see _index_catalog)
+
+    :collection_name: collection name
+    :kind: "hash", "text" or "sorted"
+
+    :returns: dictionary {index name: settings}
+
+    """
+    def _collection_indexes(self,collection_name,kind):
+        indexes = self._index_catalog().get(collection_name)
+        if indexes==None:
+            return {}
+        return indexes[kind]
+
+    def _get_unique_indexes(self,**kwargs):
+        section = kwargs.get("section","hash_indexes")
         admin = {}
         indexes = {} 
 
         path = Path(self.__dict__['_basepath']+os.sep+"admin.db")    
         path.parent.mkdir(parents=True, exist_ok=True) 
         
-        lock = SoftFileLock(str(path.absolute())+".lock")
+        lock = self._file_lock(str(path.absolute()),shared=True)
         
         try:
                 with  lock.acquire(timeout=self.__dict__['_timeout']):
@@ -1883,8 +4580,8 @@ class Pelican(dict):
                                 admin = json.load(f)
                                 f.close()
 
-                    if 'hash_indexes' in admin:
-                            indexes = admin['hash_indexes']
+                    if section in admin:
+                            indexes = admin[section]
                                  
         except Timeout:
                     raise ValueError(f'Lock admin.db timeout error')
@@ -1898,7 +4595,7 @@ class Pelican(dict):
         path = Path(self.__dict__['_basepath']+os.sep+"admin.db")    
         path.parent.mkdir(parents=True, exist_ok=True) 
         
-        lock = SoftFileLock(str(path.absolute())+".lock")
+        lock = self._file_lock(str(path.absolute()),shared=True)
         
         try:
                 with  lock.acquire(timeout=self.__dict__['_timeout']):
@@ -1920,13 +4617,14 @@ class Pelican(dict):
     
 
     def _register_unique_index(self,collection_name,name,key,**kwargs):
+        section = kwargs.get("section","hash_indexes")
         admin = {}
 
             
         path = Path(self.__dict__['_basepath']+os.sep+"admin.db")    
         path.parent.mkdir(parents=True, exist_ok=True) 
         
-        lock = SoftFileLock(str(path.absolute())+".lock")
+        lock = self._file_lock(str(path.absolute()))
         
         try:
                 with  lock.acquire(timeout=self.__dict__['_timeout']):
@@ -1936,35 +4634,389 @@ class Pelican(dict):
                                 admin = json.load(f)
                                 f.close()
 
-                    if 'hash_indexes' in admin:
-                            indexes = admin['hash_indexes']
+                    if section in admin:
+                            indexes = admin[section]
                     else:
                             indexes = {}    
                         
-                    indexes[name]={"collection":collection_name,"key":key,"dynamic":kwargs.get("dynamic",False)}
+                    indexes[name]={"collection":collection_name,"key":key,"dynamic":kwargs.get("dynamic",False),"unique":kwargs.get("unique",False)}
 
-                    admin['hash_indexes']=indexes
+                    admin[section]=indexes
 
-                    self["db_indexes"][name]={"collection":collection_name,"key":key,"dynamic":kwargs.get("dynamic")}
-                    self["hash_indexes"][name]={"collection":collection_name,"key":key, "dynamic":kwargs.get("dynamic")}
+                    self["db_indexes"][name]={"collection":collection_name,"key":key,"dynamic":kwargs.get("dynamic"),"unique":kwargs.get("unique",False)}
+                    self[section][name]={"collection":collection_name,"key":key, "dynamic":kwargs.get("dynamic"),"unique":kwargs.get("unique",False)}
 
-                    with open(str(path.absolute()),"w", encoding='utf-8') as f:    
- 
-                                json.dump(admin,f)
-                                f.close()    
+                    self._write_admin(admin)
+                                
+                                
+        except Timeout:
+                    raise ValueError(f'Lock admin.db timeout error')
+
+    """
+    Returns the document codec and the compression of a collection recorded in admin.db.
+    The settings of a new collection are recorded on first use, 
+    existing collections created before the settings were recorded are pickled and not compressed
+
+    :collection_name: collection name
+    :codec: requested codec or None for the database default
+    :compression: requested compression or None for the database default
+    :exists: the collection already has a data file
+
+    """
+    def _get_collection_storage(self,collection_name,codec,compression,exists):
+        admin = {}
+
+        path = Path(self.__dict__['_basepath']+os.sep+"admin.db")    
+        path.parent.mkdir(parents=True, exist_ok=True) 
+        
+        lock = self._file_lock(str(path.absolute()))
+        
+        try:
+                with  lock.acquire(timeout=self.__dict__['_timeout']):
+                      
+                    if os.path.isfile(str(path.absolute())):
+                        with open(str(path.absolute()),"r", encoding='utf-8') as f:
+                                admin = json.load(f)
+                                f.close()
+
+                    codecs = admin.get('codecs',{})
+                    compressions = admin.get('compression',{})
+                    if collection_name in codecs:
+                        if codec!=None and codec!=codecs[collection_name]:
+                            raise ValueError(f'Collection {collection_name} is stored with codec {codecs[collection_name]}')
+                        if compression!=None and compression!=compressions.get(collection_name):
+                            raise ValueError(f'Collection {collection_name} is stored with compression {compressions.get(collection_name)}')
+                        return codecs[collection_name],compressions.get(collection_name)
+
+                    if exists:
+                        if compression!=None:
+                            raise ValueError(f'Collection {collection_name} is stored without compression')
+                        codecs[collection_name] = "pickle"
+                    else:
+                        codecs[collection_name] = self.__dict__['_codec'] if codec==None else codec
+                        if compression==None:
+                            compression = self.__dict__['_compression']
+                        if compression!=None:
+                            check_compression(compression)
+                            compressions[collection_name] = compression
+                    get_codec(codecs[collection_name])
+                    admin['codecs'] = codecs
+                    if len(compressions)>0:
+                        admin['compression'] = compressions
+
+                    self._write_admin(admin)
+
+                    return codecs[collection_name],compressions.get(collection_name)
                                 
+        except Timeout:
+                    raise ValueError(f'Lock admin.db timeout error')
+
+    """
+    Returns the retention policy of a collection recorded in admin.db or None
+    """
+    def _get_retention(self,collection_name):
+        admin = {}
+
+        path = Path(self.__dict__['_basepath']+os.sep+"admin.db")    
+        
+        lock = self._file_lock(str(path.absolute()),shared=True)
+        
+        try:
+                with  lock.acquire(timeout=self.__dict__['_timeout']):
+                      
+                    if os.path.isfile(str(path.absolute())):
+                        with open(str(path.absolute()),"r", encoding='utf-8') as f:
+                                admin = json.load(f)
+                                f.close()
+                                 
+        except Timeout:
+                    raise ValueError(f'Lock admin.db timeout error')
+        
+        return admin.get('retention',{}).get(collection_name)
+
+    """
+    Records the retention policy of a collection in admin.db
+
+    :collection_name: collection name
+    :retention: policy or None to keep all versions
+
+    """
+    def _set_retention(self,collection_name,retention):
+        admin = {}
+
+        path = Path(self.__dict__['_basepath']+os.sep+"admin.db")    
+        path.parent.mkdir(parents=True, exist_ok=True) 
+        
+        lock = self._file_lock(str(path.absolute()))
+        
+        try:
+                with  lock.acquire(timeout=self.__dict__['_timeout']):
+                      
+                    if os.path.isfile(str(path.absolute())):
+                        with open(str(path.absolute()),"r", encoding='utf-8') as f:
+                                admin = json.load(f)
+                                f.close()
+
+                    policies = admin.get('retention',{})
+                    if retention==None:
+                        policies.pop(collection_name,None)
+                    else:
+                        policies[collection_name] = retention
+                    admin['retention'] = policies
+
+                    self._write_admin(admin)
                                 
         except Timeout:
                     raise ValueError(f'Lock admin.db timeout error')
 
+    """
+    Write-ahead log.
+    With durability "batch" or "full" the file writes of a commit (data, pointers, journal of last versions, version clock)
+    are collected first, appended to the log of the database (wal.log) as one record and only then applied to the files.
+    A commit interrupted by a crash is replayed from the log when the database is opened, a torn record is ignored.
+    Rewrites of whole files (shrink, snapshot of last versions, clear) checkpoint the log first.
+    With durability "none" the writes go straight to the files
+    """
+
+    """
+    Runs the file writes of a commit through the write-ahead log. The caller holds the locks of the written collections
+
+    :write: function writing the files with _file_append, _file_write and _after_write
+
+    :returns: result of the function
+
+    """
+    def _logged(self,write):
+        local = self.__dict__['_wal_local']
+        if self.__dict__['_durability']=="none" or getattr(local,"writes",None)!=None:
+            return write()
+
+        writes = {"ops":[],"sizes":{},"after":[]}
+        local.writes = writes
+        try:
+            result = write()
+        finally:
+            local.writes = None
+
+        if len(writes["ops"])>0:
+            lock = self.__dict__['_wal_lock']
+            try:
+                with lock.acquire(timeout=self.__dict__['_timeout']):
+                    size = self._append_wal(writes["ops"])
+                    apply_writes(writes["ops"])
+                    if size>WAL_CHECKPOINT_SIZE:
+                        self._checkpoint_wal()
+            except Timeout:
+                raise ValueError(f'Lock write-ahead log timeout error')
+
+        for callback in writes["after"]:
+            callback()
+        return result
+
+    """
+    Pending writes of the current thread's commit or None if the writes go straight to the files
+    """
+    def _pending_writes(self):
+        return getattr(self.__dict__['_wal_local'],"writes",None)
+
+    """
+    Size of a file including the pending writes of the commit
+
+    :path: filename
+
+    :returns: size or None if there is no file
+
+    """
+    def _file_size(self,path):
+        writes = self._pending_writes()
+        if writes!=None and path in writes["sizes"]:
+            return writes["sizes"][path]
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    """
+    Appends to a file
+
+    :path: filename
+    :content: bytes
+
+    :returns: size of the file after the write
+
+    """
+    def _file_append(self,path,content):
+        writes = self._pending_writes()
+        if writes==None:
+            with open(path,"ab") as f:
+                f.write(content)
+                return f.tell()
+        offset = self._file_size(path) or 0
+        writes["ops"].append((path,offset,content))
+        writes["sizes"][path] = offset+len(content)
+        return offset+len(content)
+
+    """
+    Writes to an existing file at the given offset
+
+    :path: filename
+    :offset: offset in the file
+    :content: bytes
+
+    """
+    def _file_write(self,path,offset,content):
+        writes = self._pending_writes()
+        if writes==None:
+            with open(path,"r+b") as f:
+                f.seek(offset)
+                f.write(content)
+            return
+        writes["ops"].append((path,offset,content))
+        writes["sizes"][path] = max(self._file_size(path) or 0,offset+len(content))
+
+    """
+    Runs a function when the writes of the commit are applied to the files (updates of the state which depends on the files)
+
+    :callback: function without arguments
+
+    """
+    def _after_write(self,callback):
+        writes = self._pending_writes()
+        if writes==None:
+            callback()
+        else:
+            writes["after"].append(callback)
+
+    """
+    Appends a record to the write-ahead log and synchronizes the log according to the durability level.
+    The caller holds the log lock
+
+    :ops: file writes of the commit
+
+    :returns: size of the log
+
+    """
+    def _append_wal(self,ops):
+        basepath = self.__dict__['_basepath']
+        record = pickle.dumps([(os.path.relpath(path,basepath),offset,content) for path,offset,content in ops],pickle.HIGHEST_PROTOCOL)
+        f = self.__dict__['_wal_file']
+        if f==None:
+            f = open(self.__dict__['_wal_path'],"ab")
+            self.__dict__['_wal_file'] = f
+        f.write(WAL_RECORD.pack(len(record),zlib.crc32(record))+record)
+        f.flush()
+        if self.__dict__['_durability']=="full":
+            os.fsync(f.fileno())
+        else:
+            self._schedule_wal_sync()
+        return f.tell()
+
+    """
+    Synchronizes the write-ahead log with the disk after durability_interval seconds, if it isn't already scheduled (durability "batch")
+    """
+    def _schedule_wal_sync(self):
+        with self.__dict__['_wal_timer_lock']:
+            if self.__dict__['_wal_timer']!=None:
+                return
+            timer = threading.Timer(self.__dict__['_durability_interval'],self._sync_wal)
+            timer.daemon = True
+            self.__dict__['_wal_timer'] = timer
+            timer.start()
+
+    def _sync_wal(self):
+        with self.__dict__['_wal_timer_lock']:
+            self.__dict__['_wal_timer'] = None
+        os.fsync(self.__dict__['_wal_file'].fileno())
+
+    """
+    Checkpoint of the write-ahead log: the files written by the logged commits are flushed to the disk and the log is emptied.
+    Called before a file is rewritten or removed, so the log doesn't replay writes into its new version
+
+    :paths: files written outside the log which are flushed too (with durability "batch" or "full")
+
+    """
+    def _checkpoint_wal(self,*paths):
+        if self.__dict__['_durability']!="none":
+            for path in paths:
+                fsync_file(path)
+
+        wal_path = self.__dict__['_wal_path']
+        if not os.path.isfile(wal_path) or os.path.getsize(wal_path)==0:
+            return
+        lock = self.__dict__['_wal_lock']
+        try:
+            with lock.acquire(timeout=self.__dict__['_timeout']):
+                basepath = self.__dict__['_basepath']
+                written = set()
+                for record in read_wal(wal_path):
+                    for path,offset,content in record:
+                        written.add(path)
+                for path in written:
+                    fsync_file(basepath+os.sep+path)
+                with open(wal_path,"r+b") as f:
+                    f.truncate(0)
+                    os.fsync(f.fileno())
+        except Timeout:
+            raise ValueError(f'Lock write-ahead log timeout error')
+
+    """
+    Replays the write-ahead log left by a crashed process and checkpoints it. Writes of completed commits are replayed 
+    with the same contents at the same offsets, so the replay doesn't change the files of other running processes
+    """
+    def _recover_wal(self):
+        wal_path = self.__dict__['_wal_path']
+        if not os.path.isfile(wal_path) or os.path.getsize(wal_path)==0:
+            return
+        lock = self.__dict__['_wal_lock']
+        try:
+            with lock.acquire(timeout=self.__dict__['_timeout']):
+                basepath = self.__dict__['_basepath']
+                for record in read_wal(wal_path):
+                    apply_writes([(basepath+os.sep+path,offset,content) for path,offset,content in record])
+                self._checkpoint_wal()
+        except Timeout:
+            raise ValueError(f'Lock write-ahead log timeout error')
+
+    """
+    Lock of a database file (see LockManager)
+
+    :path: locked file
+
+    Arguments:
+    :shared: shared (read) lock instead of exclusive
+
+    """
+    def _file_lock(self,path,**kwargs):
+        return self.__dict__['_locks'].lock(path,**kwargs)
+
+    """
+    Lock statistics of the database in this process: acquisitions, contended acquisitions (the lock was held by another process or thread),
+    timeouts, total and maximal wait time in seconds by lock file
+
+    Arguments:
+    :reset: clear the statistics
+
+    """
+    def lock_stats(self,**kwargs):
+        return self.__dict__['_locks'].stats(**kwargs)
+
+    """
+    Snapshot of the database for reading (see DBSnapshot)
+
+    :collections: names of collections pinned when the snapshot starts, others are pinned when the snapshot first reads them
+
+    """
+    def snapshot(self,*collections):
+        return DBSnapshot(self,collections)
+
     """
         Pre-reads all the collections
     """
     def initialize(self):
             for r, d, f in os.walk(self.__dict__['_basepath']):
                 for file in f:
-                    if file.endswith(".ptr"):
-                        collection_name = file.replace(".ptr","")
+                    if file.endswith(".ptr") or file.endswith(".ptb"):
+                        collection_name = file[:-4]
                         self[collection_name].get("")
                     elif file.endswith(".idx"):
                         collection_name = file.replace(".idx","")
@@ -2008,6 +5060,9 @@ class Pelican(dict):
         else:    
             self.__dict__['_timeout']=LOCK_TIMEOUT
 
+        self.__dict__['_locks'] = LockManager()
+        self.__dict__['_snapshot_local'] = threading.local()
+
         self.__dict__['_RAM']= True
         if 'RAM' in kwargs:
             self.__dict__['_RAM'] = kwargs.get("RAM") 
@@ -2022,13 +5077,44 @@ class Pelican(dict):
 
         self.__dict__['_name'] = name         
 
+        self.__dict__['_pointer_format'] = kwargs.get("pointer_format","text")
+        if not self.__dict__['_pointer_format'] in POINTER_FORMATS:
+            raise ValueError(f'Unknown pointer format {self.__dict__["_pointer_format"]}')
+
+        self.__dict__['_codec'] = kwargs.get("codec","pickle")
+        get_codec(self.__dict__['_codec'])
+
+        self.__dict__['_group_commit'] = kwargs.get("group_commit",False)
+
+        self.__dict__['_durability'] = kwargs.get("durability","none")
+        if not self.__dict__['_durability'] in DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability level {self.__dict__["_durability"]}')
+        self.__dict__['_durability_interval'] = kwargs.get("durability_interval",DURABILITY_INTERVAL)
+        self.__dict__['_wal_path'] = basepath+os.sep+"wal.log"
+        self.__dict__['_wal_lock'] = self._file_lock(self.__dict__['_wal_path'])
+        self.__dict__['_wal_local'] = threading.local()
+        self.__dict__['_wal_file'] = None
+        self.__dict__['_wal_timer'] = None
+        self.__dict__['_wal_timer_lock'] = threading.Lock()
+        self._recover_wal()
+
+        self.__dict__['_compression'] = None
+        if kwargs.get("compression")!=None:
+            self.__dict__['_compression'] = {"method":kwargs.get("compression"),"mode":kwargs.get("compression_mode","record")}
+            check_compression(self.__dict__['_compression'])
+
+        self.__dict__['_catalog'] = None
+        self.__dict__['_catalog_stat'] = None
         hash_indexes = self._get_unique_indexes()
         text_indexes = self._get_text_indexes()
+        sorted_indexes = self._get_unique_indexes(section="sorted_indexes")
         common = dict(hash_indexes)
         common.update(text_indexes)
+        common.update(sorted_indexes)
         self.__dict__['db_indexes']  = common
         self.__dict__['text_indexes']  = text_indexes
         self.__dict__['hash_indexes']  = hash_indexes
+        self.__dict__['sorted_indexes']  = sorted_indexes
 
     def collection(self, name: str, **kwargs) -> Collection:
         
@@ -2036,7 +5122,7 @@ class Pelican(dict):
         if name in self.__dict__:
             return self.__dict__[name]
 
-        collection = self.Collection(name, self)
+        collection = self.Collection(name, self, **kwargs)
         self.__dict__[name] = collection
 
         return collection
@@ -2053,6 +5139,9 @@ class DBSession:
 
         self._related_add = []
         self._related_delete = []
+        #changes of writes with NoIndex, only unique hash indexes and sorted indexes are updated (see Collection.insert)
+        self._planned_add = []
+        self._planned_delete = []
         self._db = db
     """
     commit transaction: store collections to files
@@ -2080,42 +5169,45 @@ class DBSession:
         prefix = str(uuid.uuid4())
         no_update_uuid=False
 
-        for collection_name, value in self._operations_add.items():
-            collection = self._db[collection_name]
+        def write():
+            for collection_name, value in self._operations_add.items():
+                collection = self._db[collection_name]
+
+                #operations were placed at the data end of the time they were queued, other processes may have appended since:
+                #the block is moved to the data end taken under the lock
+                shift = collection._get_data_end()-(value[0][3]-len(value[0][1]))
+                end = value[-1][3]+shift
+                pointers = []
+                chunks = []
+                for line in value:
+                    chunks.append(line[1])
+                    pointers.extend(line[4])
+                if shift!=0:
+                    for key,pointer in pointers:
+                        pointer[0]+=shift
+                        pointer[1]+=shift
+                
+                #data and pointers of all operations of the collection are written at once
+                self._db._file_append(collection._path_data,b"".join(chunks))
+                collection._write_pointers(pointers,prefix,end)
 
-            prefix_updated = False
-            for line in value:
-                dbytes = line[1] 
-                datastr = line[4]
+                collection._data_end = end
+                collection._tick(end)
 
-                
-                with open(collection._path,"a", encoding='utf-8') as f: 
-                            
-                    if collection._modification_uuid==None:
-                        f.write(prefix)
-                        f.write("\n")
-                        collection._modification_uuid=prefix
-                        prefix_updated=True
-                        
+            #write last version changes of inserted, updated and deleted documents
+            for collection_name in list_locks.keys():
+                ids = []
+                for line in self._operations_add.get(collection_name,[])+self._operations_replace.get(collection_name,[]):
+                    if isinstance(line[0],list):
+                        ids.extend(line[0])
+                    else:
+                        ids.append(line[0])
+                self._db[collection_name]._write_collection_idx(ids)                
+                if not collection_name in self._operations_add:
+                    self._db[collection_name]._update_prefix(prefix)
 
-                    f.write(datastr)
-                    f.write("\n") 
-            
-                
-                
-                out_file = open(collection._path_data, "ab") 
-                out_file.write(dbytes)
-                out_file.close()       
-            
-            if not prefix_updated:
-                with open(collection._path,"r+", encoding='utf-8') as f:
-                    text =f.read(36)
-                    f.seek(0)
-                    f.write(prefix)
-                    collection._modification_uuid=prefix                                        
-
-            with open(collection._path_id, 'wb') as f:
-                pickle.dump(collection._data_idx, f, pickle.HIGHEST_PROTOCOL)            
+        #all collections of the session are written with one record of the write-ahead log
+        self._db._logged(write)
                           
 
         for collection_name, lock in list_locks.items():
@@ -2167,6 +5259,11 @@ class DBSession:
                 else:                       
                     self._db[collection_name]._add_values_to_unique_indexes(set)
                     self._db[collection_name]._add_values_to_text_indexes(set)
+
+            for planned,update in ((self._planned_delete,self._db[collection_name]._delete_values_from_unique_indexes),(self._planned_add,self._db[collection_name]._add_values_to_unique_indexes)):
+                set = [document for c_name,documents in planned if c_name == collection_name for document in documents]
+                if len(set)>0:
+                    update(set,NoIndex=True)
             
 
            
@@ -2180,6 +5277,8 @@ class DBSession:
 
         self._related_add=[]
         self._related_delete=[]
+        self._planned_add=[]
+        self._planned_delete=[]
 
     def __enter__(self) -> "DBSession":
         
@@ -2202,7 +5301,7 @@ class DBSession:
             return True
         else:
             for collection_name in self._operations.keys():
-                self._db[collection_name]._modification_uuid=None
+                self._db[collection_name]._invalidate()
                 c = self._db[collection_name]
             
         self._operations = {}
@@ -2212,8 +5311,56 @@ class DBSession:
 
         self._related_add=[]
         self._related_delete=[]
+        self._planned_add=[]
+        self._planned_delete=[]
         
         return False
+
+"""
+Snapshot isolation for reading. Inside "with db.snapshot():" the queries of the collections (get, get_version, find, all)
+in this thread read the state of each collection pinned when the snapshot first reads it, without locks and without 
+seeing later writes of this or other processes. Data and pointer files are append-only, so a long scan doesn't block writers 
+and isn't disturbed by them. Writes inside the snapshot go to the collections as usual, but aren't seen by its queries
+"""
+class DBSnapshot:
+    def __init__(self, db: Pelican, collections=()) -> None:
+        self._db = db
+        self._collections = collections
+        self._pinned = {}
+        self._previous = None
+
+    def _pin(self,collection):
+        pinned = self._pinned.get(collection._name)
+        if pinned==None:
+            pinned = collection._pin_snapshot(self)
+            self._pinned[collection._name] = pinned
+        return pinned
+
+    def __enter__(self) -> "DBSnapshot":
+        for name in self._collections:
+            self._pin(self._db[name])
+        local = self._db.__dict__['_snapshot_local']
+        self._previous = getattr(local,"snapshot",None)
+        local.snapshot = self
+        return self
+
+    """
+    left the "with" operator, memory maps of the pinned data files are released
+    """
+    def __exit__(self,
+        type: Optional[Type[BaseException]],
+        value: Optional[BaseException],
+        traceback: Optional[TracebackType]) -> bool:
+
+        self._db.__dict__['_snapshot_local'].snapshot = self._previous
+        for pinned in self._pinned.values():
+            if pinned._data_map!=None:
+                try:
+                    pinned._data_map.close()
+                except BufferError:
+                    pass
+        self._pinned = {}
+        return False
     
 def feed(dbs,message):
     results = {}
@@ -2272,6 +5419,26 @@ def read_command(collection_set):
     
     return uid,command,parameter  
 
+"""
+Options of a find command asking for a page of the results: [condition, {"sort": ..., "limit": ..., "skip": ..., "projection": ...}],
+the condition is a dictionary or None. Other parameters (e.g. [function, arguments]) are conditions of find
+
+:parameter: parameter of the command
+
+:returns: dictionary of the options or None
+
+"""
+def page_options(parameter):
+    if not isinstance(parameter,list) or len(parameter)==0 or len(parameter)>2:
+        return None
+    if not (isinstance(parameter[0],dict) or (parameter[0]==None and len(parameter)==2)):
+        return None
+    if len(parameter)==1:
+        return {}
+    if isinstance(parameter[1],dict) and set(parameter[1])<=PAGE_OPTIONS:
+        return parameter[1]
+    return None
+
 def perform_command(command,db,collection_name,parameter,session=None):
     kw = {}
     
@@ -2290,11 +5457,15 @@ def perform_command(command,db,collection_name,parameter,session=None):
             raise ValueError(f'Parameter {parameter} is not valid')               
     elif command=="delete" or command=="-": 
         result = db[collection_name].delete(parameter,**kw)           
-    elif command=="find" or command=="??":         
-        result = db[collection_name].find(parameter,**kw) 
-    elif command=="get" or command=="?":         
-        result = db[collection_name].find(parameter,**kw)     
+    elif command=="find" or command=="??" or command=="get" or command=="?":         
+        options = page_options(parameter)
+        if options!=None:
+            result = db[collection_name].find(parameter[0],sort=options.get("sort"),limit=options.get("limit"),skip=options.get("skip"),projection=options.get("projection"))
+        else:
+            result = db[collection_name].find(parameter,**kw) 
     elif command=="clear" or command=="--":         
         result = db[collection_name].clear()         
+    elif command=="aggregate":         
+        result = db[collection_name].aggregate(parameter)         
 
     return result                    
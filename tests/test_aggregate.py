@@ -0,0 +1,45 @@
+import pytest
+
+from pelicandb import Pelican
+
+
+@pytest.fixture
+def goods(tmp_path):
+    goods = Pelican("db", path=str(tmp_path))["goods"]
+    goods.insert([
+        {"_id": "a", "kind": "milk", "price": 2},
+        {"_id": "b", "kind": "milk", "price": 4},
+        {"_id": "c", "kind": "bread", "price": 1},
+    ])
+    return goods
+
+
+def test_group_accumulators(goods):
+    result = goods.aggregate([
+        {"$group": {"_id": "$kind", "n": {"$count": {}}, "total": {"$sum": "$price"},
+                    "avg": {"$avg": "$price"}, "low": {"$min": "$price"}, "high": {"$max": "$price"}}},
+        {"$sort": [("_id", 1)]},
+    ])
+    assert list(result) == [
+        {"_id": "bread", "n": 1, "total": 1, "avg": 1.0, "low": 1, "high": 1},
+        {"_id": "milk", "n": 2, "total": 6, "avg": 3.0, "low": 2, "high": 4},
+    ]
+
+
+def test_count_of_no_documents_is_empty(goods):
+    assert list(goods.aggregate([{"$match": {"kind": "milk"}}, {"$count": "n"}])) == [{"n": 2}]
+    assert list(goods.aggregate([{"$match": {"kind": "tea"}}, {"$count": "n"}])) == []
+    assert list(goods.aggregate([{"$match": {"kind": "tea"}}, {"$group": {"_id": None, "n": {"$count": {}}}}])) == []
+
+
+def test_match_counts_documents_written_without_index(tmp_path):
+    goods = Pelican("db", path=str(tmp_path))["goods"]
+    goods.register_hash_index("goods_kind", "kind", unique=True)
+    goods.register_sorted_index("goods_price", "price")
+    goods.insert({"_id": "a", "kind": "milk", "price": 2})
+    goods.insert({"_id": "b", "kind": "bread", "price": 4}, no_index=True)
+    goods.insert([{"_id": "c", "kind": "tea", "price": 6}], no_index=True)
+
+    assert list(goods.aggregate([{"$match": {"price": {"$gte": 2}}}, {"$count": "n"}])) == [{"n": 3}]
+    assert list(goods.aggregate([{"$match": {"kind": {"$in": ["bread", "tea"]}}},
+                                 {"$group": {"_id": None, "total": {"$sum": "$price"}}}])) == [{"_id": None, "total": 10}]
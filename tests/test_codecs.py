@@ -0,0 +1,55 @@
+import pytest
+
+import pelicandb
+from pelicandb import Pelican
+
+DOCUMENT = {"n": 1, "f": 2.5, "s": "text", "b": True, "none": None, "list": [1, "two", [3]], "dict": {"nested": {"deep": [1, 2]}}}
+
+
+@pytest.mark.parametrize("RAM", [True, False], ids=["ram", "disk"])
+@pytest.mark.parametrize("pointer_format", pelicandb.POINTER_FORMATS)
+@pytest.mark.parametrize("codec", sorted(pelicandb.CODECS))
+def test_codec_round_trip(tmp_path, codec, pointer_format, RAM):
+    db = Pelican("db", path=str(tmp_path), RAM=RAM, pointer_format=pointer_format)
+    goods = db.collection("goods", codec=codec)
+    goods.insert(dict(DOCUMENT, _id="a"))
+    goods.insert_many([dict(DOCUMENT, _id=f"m{number}", n=number) for number in range(10)])
+    goods.insert(dict(DOCUMENT, _id="a", n=2), upsert=True)
+    goods.delete("m0")
+
+    def check(collection):
+        assert collection._codec == codec
+        assert {k: v for k, v in collection.get("a").items() if k != "_version"} == dict(DOCUMENT, _id="a", n=2)
+        assert collection.get_version("a", 0)["n"] == 1
+        assert sorted(document["_id"] for document in collection.all()) == ["a"] + [f"m{number}" for number in range(1, 10)]
+        assert [document["_id"] for document in collection.find({"dict.nested.deep": [1, 2], "n": 5})] == ["m5"]
+
+    check(goods)
+    check(Pelican("db", path=str(tmp_path), RAM=RAM)["goods"])
+    goods.shrink()
+    check(Pelican("db", path=str(tmp_path), RAM=RAM)["goods"])
+
+
+def test_codec_is_kept_by_existing_collection(tmp_path):
+    Pelican("db", path=str(tmp_path)).collection("goods", codec="marshal").insert({"_id": "a"})
+
+    with pytest.raises(ValueError):
+        Pelican("db", path=str(tmp_path)).collection("goods", codec="pickle")
+    goods = Pelican("db", path=str(tmp_path))["goods"]
+
+    assert goods._codec == "marshal"
+    assert goods.get("a")["_id"] == "a"
+
+
+def test_registered_codec(tmp_path, monkeypatch):
+    monkeypatch.setitem(pelicandb.CODECS, "repr", None)
+    pelicandb.register_codec("repr", lambda document: repr(document).encode(), lambda data: eval(bytes(data).decode()))
+
+    Pelican("db", path=str(tmp_path)).collection("goods", codec="repr").insert({"_id": "a", "list": [1, 2]})
+
+    assert Pelican("db", path=str(tmp_path))["goods"].get("a")["list"] == [1, 2]
+
+
+def test_unknown_codec(tmp_path):
+    with pytest.raises(ValueError):
+        Pelican("db", path=str(tmp_path)).collection("goods", codec="unknown")
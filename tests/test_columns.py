@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pelicandb
+from pelicandb import DBSession, Pelican
+
+PACKAGE = os.path.dirname(os.path.abspath(pelicandb.__file__))
+
+CONDITIONS = [
+    {"price": 3},
+    {"price": {"$gt": 2.5}},
+    {"price": {"$gte": 2, "$lt": 5}},
+    {"price": {"$in": [1, 4, 7]}},
+    {"price": {"$lte": 4}, "kind": "milk"},
+    {"price": {"$gt": 0}, "qty": {"$lt": 3}},
+]
+
+PIPELINE = [{"$match": {"price": {"$gt": 1}}}, {"$group": {"_id": None, "n": {"$count": {}}, "total": {"$sum": "$price"}, "high": {"$max": "$qty"}}}]
+
+pytestmark = pytest.mark.skipif(pelicandb.numpy is None, reason="NumPy is not installed")
+
+
+def scan(tmp_path, RAM):
+    return Pelican("db", path=str(tmp_path), RAM=RAM)["goods"]
+
+
+def ids(documents):
+    return sorted(document["_id"] for document in documents)
+
+
+def check(goods, tmp_path, RAM):
+    plain = scan(tmp_path, RAM)
+    for condition in CONDITIONS:
+        assert ids(goods.find(condition)) == ids(plain.find(condition)), condition
+    assert list(goods.aggregate(PIPELINE)) == list(plain.aggregate(PIPELINE))
+
+
+@pytest.mark.parametrize("RAM", [True, False], ids=["ram", "disk"])
+def test_columns_match_scan(tmp_path, RAM):
+    goods = Pelican("db", path=str(tmp_path), RAM=RAM)["goods"]
+    goods.insert_many([{"_id": f"d{n}", "kind": ["milk", "bread"][n % 2], "price": [n % 8, n % 8 + 0.5, True, 2 ** 40 + n][n % 4], "qty": n % 4} for n in range(60)])
+    goods.insert({"_id": "missing", "kind": "milk"})
+    goods.register_columns("price", "qty")
+    check(goods, tmp_path, RAM)
+    assert goods._columns is not None
+
+    goods.insert({"_id": "d1", "price": 3, "kind": "milk", "qty": 0}, upsert=True)
+    goods.update({"_id": "d2"}, {"price": 4})
+    goods.delete("d3")
+    goods.delete_many([{"_id": "d4"}, {"_id": "d5"}])
+    goods.insert_many([{"_id": "new1", "price": 7, "qty": 1}, {"_id": "new2", "price": 3.0, "qty": 2}])
+    check(goods, tmp_path, RAM)
+
+
+@pytest.mark.parametrize("RAM", [True, False], ids=["ram", "disk"])
+def test_columns_see_writes_of_another_process(tmp_path, RAM):
+    goods = Pelican("db", path=str(tmp_path), RAM=RAM)["goods"]
+    goods.insert_many([{"_id": f"d{n}", "price": n} for n in range(10)])
+    goods.register_columns("price")
+    assert ids(goods.find({"price": {"$gte": 8}})) == ["d8", "d9"]
+
+    script = (f"import sys\nsys.path.insert(0,{PACKAGE!r})\nfrom pelicandb import DBSession, Pelican\n"
+              f"goods = Pelican('db',path={str(tmp_path)!r})['goods']\n"
+              "goods.insert({'_id':'d1','price':20},upsert=True)\ngoods.delete('d9')\ngoods.insert({'_id':'x','price':8})\n")
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+    assert ids(goods.find({"price": {"$gte": 8}})) == ["d1", "d8", "x"]
+    check(goods, tmp_path, RAM)
+
+
+def test_columns_in_session(tmp_path):
+    db = Pelican("db", path=str(tmp_path))
+    goods = db["goods"]
+    goods.insert_many([{"_id": f"d{n}", "price": n} for n in range(10)])
+    goods.register_columns("price")
+    assert ids(goods.find({"price": {"$gt": 7}})) == ["d8", "d9"]
+
+    with DBSession(db) as session:
+        goods.insert({"_id": "d0", "price": 10}, upsert=True, session=session)
+        goods.delete("d9", session=session)
+
+    assert ids(goods.find({"price": {"$gt": 7}})) == ["d0", "d8"]
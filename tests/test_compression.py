@@ -0,0 +1,53 @@
+import pytest
+
+import pelicandb
+from pelicandb import Pelican
+
+SETTINGS = [(method, mode, pointer_format) for method in pelicandb.COMPRESSIONS for mode in pelicandb.COMPRESSION_MODES for pointer_format in pelicandb.POINTER_FORMATS]
+
+
+def documents(count):
+    return [{"_id": f"doc{number}", "n": number, "text": "lorem ipsum " * number, "tags": ["a", "b"][: number % 3]} for number in range(count)]
+
+
+@pytest.mark.parametrize("RAM", [True, False], ids=["ram", "disk"])
+@pytest.mark.parametrize("method,mode,pointer_format", SETTINGS)
+def test_compressed_round_trip(tmp_path, method, mode, pointer_format, RAM):
+    db = Pelican("db", path=str(tmp_path), RAM=RAM, pointer_format=pointer_format, compression=method, compression_mode=mode)
+    goods = db["goods"]
+    goods.insert_many(documents(50))
+    goods.insert({"_id": "doc1", "n": -1}, upsert=True)
+    goods.delete("doc2")
+
+    expected = {document["_id"]: document for document in documents(50)}
+    expected["doc1"] = {"_id": "doc1", "n": -1}
+    del expected["doc2"]
+
+    def check(collection):
+        assert {document["_id"]: {k: v for k, v in document.items() if k != "_version"} for document in collection.all()} == expected
+        assert collection.get_version("doc1", 0)["n"] == 1
+        assert collection.find({"n": 40})[0]["text"] == "lorem ipsum " * 40
+
+    check(goods)
+    check(Pelican("db", path=str(tmp_path), RAM=RAM)["goods"])
+    goods.shrink()
+    check(goods)
+    reopened = Pelican("db", path=str(tmp_path), RAM=RAM)["goods"]
+    check(reopened)
+    reopened.insert({"_id": "doc50", "n": 50})
+    assert Pelican("db", path=str(tmp_path), RAM=RAM)["goods"].get("doc50")["n"] == 50
+
+
+def test_compression_is_kept_by_existing_collection(tmp_path):
+    Pelican("db", path=str(tmp_path), compression="zlib")["goods"].insert({"_id": "a", "text": "x" * 1000})
+
+    goods = Pelican("db", path=str(tmp_path))["goods"]
+    goods.insert({"_id": "b", "text": "y" * 1000})
+
+    assert goods._compression == {"method": "zlib", "mode": "record"}
+    assert [document["text"][0] for document in Pelican("db", path=str(tmp_path))["goods"].all()] == ["x", "y"]
+
+
+def test_unknown_compression_method(tmp_path):
+    with pytest.raises(ValueError):
+        Pelican("db", path=str(tmp_path), compression="snappy")
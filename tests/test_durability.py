@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pelicandb
+from pelicandb import DBSession, Pelican
+
+PACKAGE = os.path.dirname(os.path.abspath(pelicandb.__file__))
+
+#the process dies after the commit is appended to the log and before the files are written
+CRASH = """
+import os
+import sys
+sys.path.insert(0,{package!r})
+import pelicandb
+db = pelicandb.Pelican('db',path={path!r},durability='full',RAM={ram!r})
+pelicandb.apply_writes = lambda writes: None
+{operation}
+os._exit(0)
+"""
+
+
+def crash(path, ram, operation):
+    script = CRASH.format(package=PACKAGE, path=str(path), ram=ram, operation=operation)
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def state(path, ram, **kwargs):
+    return sorted((d["_id"], d["v"]) for d in Pelican("db", path=str(path), RAM=ram, **kwargs)["goods"].all())
+
+
+@pytest.mark.parametrize("durability", ["batch", "full"])
+@pytest.mark.parametrize("ram", [True, False], ids=["ram", "disk"])
+def test_reopen_after_logged_writes(tmp_path, durability, ram):
+    db = Pelican("db", path=str(tmp_path), durability=durability, RAM=ram)
+    goods = db["goods"]
+    goods.insert([{"_id": "a", "v": 1}, {"_id": "b", "v": 2}])
+    goods.insert({"_id": "c", "v": 3})
+    goods.update("a", {"v": 10})
+    goods.delete("b")
+    with DBSession(db) as session:
+        goods.insert({"_id": "d", "v": 4}, session=session)
+
+    assert state(tmp_path, ram, durability=durability) == [("a", 10), ("c", 3), ("d", 4)]
+    assert state(tmp_path, ram) == [("a", 10), ("c", 3), ("d", 4)]
+
+
+@pytest.mark.parametrize("ram", [True, False], ids=["ram", "disk"])
+def test_commits_in_log_are_replayed_when_opened(tmp_path, ram):
+    Pelican("db", path=str(tmp_path), durability="full")["goods"].insert({"_id": "a", "v": 1})
+    wal = os.path.join(str(tmp_path), "db", "wal.log")
+
+    crash(tmp_path, ram, "db['goods'].insert({'_id':'b','v':2})")
+    assert os.path.getsize(wal) > 0
+    assert state(tmp_path, ram) == [("a", 1), ("b", 2)]
+    assert os.path.getsize(wal) == 0
+
+    crash(tmp_path, ram, "db['goods'].delete('a')")
+    assert state(tmp_path, ram) == [("b", 2)]
+
+    crash(tmp_path, ram, "db['goods'].insert([{'_id':'c','v':3},{'_id':'b','v':20}],upsert=True)")
+    assert state(tmp_path, ram) == [("b", 20), ("c", 3)]
+
+
+def test_torn_log_record_is_ignored(tmp_path):
+    Pelican("db", path=str(tmp_path), durability="full")["goods"].insert({"_id": "a", "v": 1})
+    crash(tmp_path, False, "db['goods'].insert({'_id':'b','v':2})")
+    wal = os.path.join(str(tmp_path), "db", "wal.log")
+    assert len(pelicandb.read_wal(wal)) == 1
+    with open(wal, "r+b") as f:
+        f.truncate(os.path.getsize(wal) - 1)
+
+    #the commit wasn't completely logged, it is lost
+    assert state(tmp_path, False) == [("a", 1)]
+    goods = Pelican("db", path=str(tmp_path), durability="full")["goods"]
+    goods.insert({"_id": "c", "v": 3})
+    assert state(tmp_path, False) == [("a", 1), ("c", 3)]
@@ -0,0 +1,31 @@
+import pytest
+
+from pelicandb import Pelican, feed
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Pelican("db", path=str(tmp_path))
+    db["goods"].insert([{"_id": "a", "v": 1}, {"_id": "b", "v": 2}, {"_id": "c", "v": 3}])
+    return db
+
+
+def find(db, parameter):
+    return feed({"db": db}, [{"db": {"goods": {"find": parameter, "uid": "r"}}}])["r"]
+
+
+def ids(documents):
+    return [document["_id"] for document in documents]
+
+
+def test_find_page(db):
+    assert ids(find(db, [{"v": {"$gt": 1}}, {"sort": [["v", -1]], "limit": 1}])) == ["c"]
+    assert ids(find(db, [None, {"sort": [["v", 1]], "skip": 1}])) == ["b", "c"]
+    assert ids(find(db, [{"_id": "a"}])) == ["a"]
+
+
+def test_find_with_function_condition(db):
+    def greater(document, value):
+        return document["v"] > value
+
+    assert sorted(ids(find(db, [greater, 1]))) == ["b", "c"]
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from pelicandb import Pelican
+
+
+@pytest.mark.parametrize("durability", ["none", "full"])
+@pytest.mark.parametrize("ram", [True, False], ids=["ram", "disk"])
+def test_concurrent_inserts(tmp_path, durability, ram):
+    goods = Pelican("db", path=str(tmp_path), group_commit=True, durability=durability, RAM=ram)["goods"]
+    errors = []
+
+    def write(thread):
+        try:
+            for i in range(50):
+                goods.insert({"_id": f"{thread}_{i}", "v": i})
+                if i % 5 == 0:
+                    goods.insert({"_id": f"{thread}_{i}", "v": -i}, upsert=True)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for collection in (goods, Pelican("db", path=str(tmp_path), RAM=ram)["goods"]):
+        documents = {document["_id"]: document for document in collection.all()}
+        assert len(documents) == 8 * 50
+        for thread in range(8):
+            for i in range(50):
+                document = documents[f"{thread}_{i}"]
+                assert document["v"] == (-i if i % 5 == 0 else i)
+                assert document["_version"] == (1 if i % 5 == 0 else 0)
+
+
+def test_failed_insert_fails_only_its_own_request(tmp_path):
+    goods = Pelican("db", path=str(tmp_path))["goods"]
+    goods._group_commit = True
+    goods.insert({"_id": "a", "v": 1})
+    results = {}
+
+    def write(doc_id):
+        try:
+            goods.insert({"_id": doc_id, "v": 2})
+            results[doc_id] = "ok"
+        except ValueError:
+            results[doc_id] = "error"
+
+    threads = [threading.Thread(target=write, args=(doc_id,)) for doc_id in ("a", "b", "c", "a")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {"a": "error", "b": "ok", "c": "ok"}
+    assert sorted((d["_id"], d["v"]) for d in Pelican("db", path=str(tmp_path))["goods"].all()) == [("a", 1), ("b", 2), ("c", 2)]
@@ -0,0 +1,85 @@
+import pytest
+
+from pelicandb import DBSession, Pelican
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Pelican("db", path=str(tmp_path))
+
+
+def ids(documents):
+    return sorted(document["_id"] for document in documents)
+
+
+def test_repeated_values_are_found_without_unique_index(db):
+    goods = db["goods"]
+    goods.register_hash_index("goods_barcode", "barcode")
+    goods.insert({"_id": "a", "barcode": "1"})
+    goods.insert({"_id": "b", "barcode": "1"})
+    goods.insert({"_id": "c", "barcode": "2"})
+
+    assert ids(goods.find({"barcode": "1"})) == ["a", "b"]
+    assert ids(goods.find({"barcode": {"$in": ["1", "2"]}})) == ["a", "b", "c"]
+
+    goods.delete("b")
+    assert ids(goods.find({"barcode": "1"})) == ["a"]
+
+
+def test_unique_index_rejects_repeated_values(db):
+    goods = db["goods"]
+    goods.register_hash_index("goods_barcode", "barcode", unique=True)
+    goods.insert({"_id": "a", "barcode": "1"})
+
+    with pytest.raises(ValueError):
+        goods.insert({"_id": "b", "barcode": "1"})
+    with pytest.raises(ValueError):
+        goods.insert([{"_id": "c", "barcode": "2"}, {"_id": "d", "barcode": "2"}])
+    with DBSession(db) as session:
+        goods.insert({"_id": "e", "barcode": "3"}, session=session)
+        with pytest.raises(ValueError):
+            goods.insert({"_id": "f", "barcode": "3"}, session=session)
+
+    goods.update("a", {"barcode": "1", "name": "milk"})
+    goods.update("a", {"barcode": "4"})
+    goods.insert({"_id": "g", "barcode": "1"})
+
+    assert goods._hash_ids({"barcode": "1"}) is not None
+    assert ids(goods.find({"barcode": "1"})) == ["g"]
+    assert ids(goods.find({"barcode": {"$in": ["1", "3", "4"]}})) == ["a", "e", "g"]
+
+
+def test_unique_index_is_not_registered_over_repeated_values(db):
+    goods = db["goods"]
+    goods.insert([{"_id": "a", "barcode": "1"}, {"_id": "b", "barcode": "1"}])
+
+    with pytest.raises(ValueError):
+        goods.register_hash_index("goods_barcode", "barcode", unique=True)
+
+    assert "goods_barcode" not in db["hash_indexes"]
+    assert ids(goods.find({"barcode": "1"})) == ["a", "b"]
+
+
+
+@pytest.mark.parametrize("ram", [True, False], ids=["ram", "disk"])
+def test_no_index_writes_keep_unique_indexes(tmp_path, ram):
+    db = Pelican("db", path=str(tmp_path), RAM=ram)
+    goods = db["goods"]
+    goods.register_hash_index("goods_barcode", "barcode", unique=True)
+    goods.insert({"_id": "a", "barcode": "111"})
+    goods.insert({"_id": "b", "barcode": "222"}, no_index=True)
+    goods.insert([{"_id": "c", "barcode": "333"}], no_index=True)
+    with DBSession(db) as session:
+        goods.insert({"_id": "d", "barcode": "444"}, session=session, no_index=True)
+
+    assert ids(goods.find({"barcode": "222"})) == ["b"]
+    assert ids(goods.find({"barcode": {"$in": ["333", "444"]}})) == ["c", "d"]
+    with pytest.raises(ValueError):
+        goods.insert({"_id": "e", "barcode": "222"})
+    with pytest.raises(ValueError):
+        goods.insert({"_id": "e", "barcode": "444"}, no_index=True)
+
+    goods.update("b", {"barcode": "555"}, no_index=True)
+    goods.delete("d", no_index=True)
+    goods.insert({"_id": "e", "barcode": "444"})
+    assert ids(goods.find({"barcode": {"$in": ["222", "444", "555"]}})) == ["b", "e"]
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pelicandb
+from pelicandb import Pelican
+
+PACKAGE = os.path.dirname(os.path.abspath(pelicandb.__file__))
+
+
+def run(path, code):
+    """Runs code in another process with db opened on path"""
+    script = f"import sys\nsys.path.insert(0,{PACKAGE!r})\nfrom pelicandb import Pelican\ndb = Pelican('db',path={str(path)!r})\n" + code
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def live(path):
+    return sorted((document["_id"], document["_version"]) for document in Pelican("db", path=str(path))["g"].all())
+
+
+def test_write_after_shrink_of_another_process(tmp_path):
+    db = Pelican("db", path=str(tmp_path), pointer_format="binary")
+    collection = db["g"]
+    for doc_id in ("first", "second", "third"):
+        collection.insert({"_id": doc_id, "v": 1})
+
+    run(tmp_path, "g = db['g']\ng.delete('first')\ng.shrink()\n")
+    collection.insert({"_id": "third", "v": 2}, upsert=True)
+
+    assert live(tmp_path) == [("second", 0), ("third", 1)]
+    assert collection.get("third")["v"] == 2
+
+
+def test_write_after_clear_of_another_process(tmp_path):
+    db = Pelican("db", path=str(tmp_path), pointer_format="binary")
+    collection = db["g"]
+    collection.insert({"_id": "first", "v": 1})
+
+    run(tmp_path, "g = db['g']\ng.clear()\ng.insert({'_id':'other','v':1})\n")
+    collection.insert({"_id": "first", "v": 2}, upsert=True)
+
+    assert live(tmp_path) == [("first", 0), ("other", 0)]
+
+
+def test_concurrent_writer_and_shrink(tmp_path):
+    Pelican("db", path=str(tmp_path), pointer_format="binary")["g"].insert({"_id": "seed", "v": 0})
+    writer = (
+        "g = db['g']\n"
+        "for i in range(300):\n"
+        "    g.insert({'_id':'w'+str(i),'v':i})\n"
+        "    if i%3==0:\n"
+        "        g.insert({'_id':'w'+str(i),'v':-i},upsert=True)\n"
+    )
+    shrinker = (
+        "g = db['g']\n"
+        "for i in range(15):\n"
+        "    g.insert({'_id':'s'+str(i),'v':i})\n"
+        "    g.delete('s'+str(i))\n"
+        "    g.shrink()\n"
+    )
+    script = f"import sys\nsys.path.insert(0,{PACKAGE!r})\nfrom pelicandb import Pelican\ndb = Pelican('db',path={str(tmp_path)!r})\n"
+    processes = [subprocess.Popen([sys.executable, "-c", script + code]) for code in (writer, shrinker)]
+    assert [process.wait(timeout=600) for process in processes] == [0, 0]
+
+    documents = {document["_id"]: document for document in Pelican("db", path=str(tmp_path))["g"].all()}
+    assert sorted(documents) == sorted(["seed"] + ["w" + str(i) for i in range(300)])
+    assert all(documents["w" + str(i)]["v"] == (-i if i % 3 == 0 else i) for i in range(300))
+
+
+@pytest.mark.parametrize("pointer_format", ["text", "binary"])
+def test_data_file_shorter_than_pointers(tmp_path, pointer_format):
+    collection = Pelican("db", path=str(tmp_path), pointer_format=pointer_format)["g"]
+    collection.insert([{"_id": "first", "v": 1}, {"_id": "second", "v": 2}])
+    collection.insert({"_id": "third", "v": 3})
+
+    header = pelicandb.parse_header(open(collection._path, "rb").readline().decode())
+    assert header[1] == os.path.getsize(collection._path_data)
+
+    with open(collection._path_data, "r+b") as f:
+        f.truncate(header[1] - 1)
+    with pytest.raises(ValueError):
+        Pelican("db", path=str(tmp_path))["g"].all()
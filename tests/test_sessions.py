@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pelicandb
+from pelicandb import DBSession, Pelican
+
+PACKAGE = os.path.dirname(os.path.abspath(pelicandb.__file__))
+
+WRITER = """
+import sys
+sys.path.insert(0,{package!r})
+from pelicandb import DBSession, Pelican
+db = Pelican('db',path={path!r})
+goods = db['goods']
+for i in range(40):
+    with DBSession(db) as session:
+        goods.insert({{'_id':'{name}_%d_a' % i,'v':i,'pad':'{name}'*(i+1)}},session=session)
+        goods.insert([{{'_id':'{name}_%d_b' % i,'v':i}},{{'_id':'{name}_%d_c' % i,'v':i}}],session=session)
+"""
+
+
+def test_sessions_committed_by_concurrent_processes(tmp_path):
+    Pelican("db", path=str(tmp_path))["goods"].insert({"_id": "first", "v": 0})
+
+    writers = [
+        subprocess.Popen([sys.executable, "-c", WRITER.format(package=PACKAGE, path=str(tmp_path), name=name)])
+        for name in ("p", "q")
+    ]
+    assert [writer.wait() for writer in writers] == [0, 0]
+
+    goods = Pelican("db", path=str(tmp_path))["goods"]
+    documents = goods.all()
+    assert len(documents) == 1 + 2 * 40 * 3
+    for document in documents:
+        if document["_id"] != "first":
+            name, i, part = document["_id"].split("_")
+            assert document["v"] == int(i)
+            if part == "a":
+                assert document["pad"] == name * (int(i) + 1)
+
+
+def test_session_commit_after_write_of_another_process(tmp_path):
+    db = Pelican("db", path=str(tmp_path))
+    goods = db["goods"]
+    goods.insert({"_id": "first", "v": 0})
+
+    with DBSession(db) as session:
+        goods.insert({"_id": "mine", "v": 1}, session=session)
+        other = Pelican("db", path=str(tmp_path))
+        other["goods"].insert({"_id": "other", "v": 2, "pad": "x" * 100})
+
+    assert goods.get("mine")["v"] == 1
+    fresh = Pelican("db", path=str(tmp_path))["goods"]
+    assert sorted((d["_id"], d["v"]) for d in fresh.all()) == [("first", 0), ("mine", 1), ("other", 2)]
@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+from pelicandb import Pelican
+
+
+@pytest.fixture(params=[("text", None), ("binary", None), ("binary", "zlib")], ids=["text", "binary", "zlib"])
+def goods(request, tmp_path):
+    pointer_format, compression = request.param
+    db = Pelican("db", path=str(tmp_path), RAM=False, pointer_format=pointer_format, compression=compression)
+    goods = db["goods"]
+    for doc_id in ("a", "b", "c"):
+        goods.insert({"_id": doc_id, "v": 0, "pad": doc_id * 200})
+        for version in range(1, 4):
+            goods.insert({"_id": doc_id, "v": version, "pad": doc_id * 200}, upsert=True)
+    goods.delete("c")
+    return goods
+
+
+def reopened(tmp_path):
+    return Pelican("db", path=str(tmp_path), RAM=False)["goods"]
+
+
+def test_shrink_drops_deleted_documents(goods, tmp_path):
+    size = os.path.getsize(goods._path_data)
+    goods.shrink()
+
+    assert os.path.getsize(goods._path_data) < size
+    for collection in (goods, reopened(tmp_path)):
+        assert sorted((d["_id"], d["v"]) for d in collection.all()) == [("a", 3), ("b", 3)]
+        assert collection.get_version("a", 1)["v"] == 1
+        assert collection.get("c") is None
+    goods.insert({"_id": "d", "v": 0})
+    assert reopened(tmp_path).get("d")["v"] == 0
+
+
+def test_shrink_prunes_versions_by_count(goods, tmp_path):
+    goods.set_retention(keep_versions=2)
+    goods.shrink()
+
+    for collection in (goods, reopened(tmp_path)):
+        assert collection.get_version("a", 3)["v"] == 3
+        assert collection.get_version("a", 2)["v"] == 2
+        with pytest.raises(ValueError):
+            collection.get_version("a", 1)
+        with pytest.raises(ValueError):
+            collection.get_version("b", 0)
+    goods.insert({"_id": "a", "v": 4}, upsert=True)
+    assert reopened(tmp_path).get_version("a", 2)["v"] == 2
+
+
+def test_shrink_prunes_versions_by_age(goods, monkeypatch):
+    goods.set_retention(keep_seconds=60)
+    goods.shrink()
+    assert goods.get_version("a", 0)["v"] == 0
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    goods.shrink()
+    with pytest.raises(ValueError):
+        goods.get_version("a", 0)
+    assert goods.get("a")["v"] == 3
+
+
+@pytest.mark.parametrize("RAM", [True, False], ids=["ram", "disk"])
+def test_background_shrink_keeps_concurrent_writes(tmp_path, RAM):
+    goods = Pelican("db", path=str(tmp_path), RAM=RAM)["goods"]
+    goods.insert_many([{"_id": f"old{n}", "pad": "x" * 500} for n in range(200)])
+    goods.delete_many([{"_id": f"old{n}"} for n in range(0, 200, 2)])
+
+    thread = goods.shrink(background=True)
+    for n in range(100):
+        goods.insert({"_id": f"new{n}", "n": n})
+        goods.insert({"_id": f"old{2 * n + 1}", "pad": "y"}, upsert=True)
+    thread.join()
+
+    expected = {f"new{n}" for n in range(100)} | {f"old{n}" for n in range(1, 200, 2)}
+    for collection in (goods, reopened(tmp_path)):
+        documents = {document["_id"]: document for document in collection.all()}
+        assert set(documents) == expected
+        assert all(documents[f"old{n}"]["pad"] == "y" for n in range(1, 200, 2))
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from pelicandb import DBSnapshot, Pelican
+
+
+@pytest.fixture(params=[True, False], ids=["ram", "disk"])
+def db(request, tmp_path):
+    return Pelican("db", path=str(tmp_path), RAM=request.param)
+
+
+def test_snapshot_keeps_documents_updated_in_same_thread(db):
+    goods = db["goods"]
+    goods.insert({"_id": "a", "v": 1, "tags": ["x"]})
+
+    with DBSnapshot(db, collections=["goods"]):
+        goods.update("a", {"v": 2})
+        goods.update(["a"], {"tags": ["y"]})
+        document = goods.get("a")
+        assert document["v"] == 1
+        assert document["tags"] == ["x"]
+        assert document["_version"] == 0
+
+    assert goods.get("a")["v"] == 2
+    assert goods.get("a")["tags"] == ["y"]
+
+
+def test_snapshot_keeps_documents_updated_by_another_thread(db):
+    goods = db["goods"]
+    goods.insert([{"_id": "a", "v": 1}, {"_id": "b", "v": 1}])
+
+    def write():
+        goods.update("a", {"v": 2})
+        goods.update({"_id": "b"}, {"v": 2})
+        goods.insert({"_id": "c", "v": 2})
+
+    with DBSnapshot(db, collections=["goods"]):
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+        assert sorted((d["_id"], d["v"]) for d in goods.all()) == [("a", 1), ("b", 1)]
+
+    assert sorted((d["_id"], d["v"]) for d in goods.all()) == [("a", 2), ("b", 2), ("c", 2)]
@@ -0,0 +1,44 @@
+import pytest
+
+from pelicandb import DBSession, Pelican
+
+
+@pytest.fixture(params=[True, False], ids=["ram", "disk"])
+def goods(request, tmp_path):
+    db = Pelican("db", path=str(tmp_path), RAM=request.param)
+    goods = db["goods"]
+    goods.register_sorted_index("goods_price", "price")
+    goods.insert({"_id": "a", "price": 10})
+    goods.insert({"_id": "b", "price": 20}, no_index=True)
+    goods.insert([{"_id": "c", "price": 5}, {"_id": "x", "name": "no price"}], no_index=True)
+    with DBSession(db) as session:
+        goods.insert({"_id": "d", "price": 30}, session=session, no_index=True)
+    return goods
+
+
+def ids(documents):
+    return [document["_id"] for document in documents]
+
+
+def test_range_queries_and_order(goods):
+    assert sorted(ids(goods.find({"price": {"$gt": 15}}))) == ["b", "d"]
+    assert sorted(ids(goods.find({"price": {"$gte": 5, "$lt": 20}}))) == ["a", "c"]
+    assert ids(goods.ordered("price")) == ["c", "a", "b", "d"]
+    assert ids(goods.ordered("price", reverse=True)) == ["d", "b", "a", "c"]
+    assert goods.min("price")["_id"] == "c"
+    assert goods.max("price")["_id"] == "d"
+
+
+def test_changes_without_index_update_order(goods):
+    goods.update("b", {"price": 1}, no_index=True)
+    goods.delete("d", no_index=True)
+
+    assert ids(goods.ordered("price")) == ["b", "c", "a"]
+    assert goods.max("price")["_id"] == "a"
+    assert ids(goods.find({"price": {"$gt": 15}})) == []
+
+
+def test_sort_by_indexed_field(goods):
+    assert ids(goods.find(None, sort=[("price", -1)])) == ["d", "b", "a", "c", "x"]
+    assert ids(goods.find(None, sort=[("price", 1)], limit=2)) == ["c", "a"]
+    assert ids(goods.find({"price": {"$lte": 20}}, sort=[("price", -1)])) == ["b", "a", "c"]
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import pelicandb
+from pelicandb import DBSession, Pelican
+
+CODECS = [name for name in ("pickle", "marshal", "orjson") if name in pelicandb.CODECS]
+
+
+@pytest.fixture(params=CODECS)
+def goods(request, tmp_path):
+    db = Pelican("db", path=str(tmp_path))
+    return db.collection("goods", codec=request.param)
+
+
+def stored(collection, doc_id):
+    document = Pelican("db", path=collection._db["_basepath"].rsplit("/", 1)[0])[collection._name].get(doc_id)
+    assert type(document) is dict
+    return document
+
+
+def test_views_are_written_as_plain_documents(goods):
+    goods.insert({"_id": "a", "v": 1, "tags": ["x"], "box": {"size": 2}})
+    view = goods.find({"_id": "a"}, copy=False)[0]
+
+    copy = dict(view)
+    copy["_id"] = "b"
+    goods.insert(copy)
+    view["_id"] = "c"
+    goods.insert(view)
+    goods.insert([goods.find({"_id": "a"}, copy=False)[0]], upsert=True)
+    goods.update("a", {"tags": goods.find({"_id": "b"}, copy=False)[0]["tags"]})
+    with DBSession(goods._db) as session:
+        view = goods.find({"_id": "a"}, copy=False)[0]
+        view["_id"] = "d"
+        goods.insert(view, session=session)
+
+    for doc_id in ("a", "b", "c", "d"):
+        document = stored(goods, doc_id)
+        assert document["tags"] == ["x"] and document["box"] == {"size": 2}
+        assert type(document["tags"]) is list and type(document["box"]) is dict
+        json.dumps(document)
+        assert type(goods.get(doc_id)) is dict